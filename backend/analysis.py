@@ -0,0 +1,288 @@
+import cv2
+import numpy as np
+from PIL import Image
+import io
+import os
+import sys
+from typing import Optional
+import logging
+import random
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.config import config
+
+logger = logging.getLogger(__name__)
+
+# Mock AI predictor for demonstration
+class MockPredictor:
+    def predict(self, image, tta=None):
+        try:
+            # Simulate AI analysis with realistic probabilities
+            risk_levels = ['Normal', 'Slightly High', 'High']
+            
+            # Generate random but realistic probabilities
+            base_prob = [0.7, 0.2, 0.1]  # Mostly normal
+            
+            # Add some randomness for demo
+            if random.random() < 0.3:  # 30% chance of higher risk
+                base_prob = [0.3, 0.4, 0.3]
+            
+            # Normalize probabilities to sum to 1
+            total = sum(base_prob)
+            probabilities = [p/total for p in base_prob]
+            
+            risk_index = random.choices(range(3), weights=probabilities)[0]
+            confidence = probabilities[risk_index] + random.uniform(0.1, 0.2)
+            confidence = min(confidence, 0.95)
+            
+            # Demo embedding: a mean-centered 16x16 thumbnail, so alike images are neighbours
+            thumbnail = cv2.resize(image, (16, 16), interpolation=cv2.INTER_AREA).astype(np.float32)
+            
+            return {
+                'risk_level': risk_levels[risk_index],
+                'confidence': float(confidence),  # Convert to Python float
+                'probabilities': [float(p) for p in probabilities],  # Convert to Python float
+                'embedding': (thumbnail - thumbnail.mean()).flatten()
+            }
+        except Exception as e:
+            logger.error(f"Prediction error: {e}")
+            return {
+                'risk_level': 'Normal',
+                'confidence': 0.85,
+                'probabilities': [0.85, 0.10, 0.05]
+            }
+    
+    def analyze_image_quality(self, image):
+        try:
+            # Convert to grayscale for analysis if needed
+            if len(image.shape) == 3:
+                gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            else:
+                gray = image
+            
+            # Calculate basic quality metrics
+            brightness = np.mean(gray)
+            contrast = np.std(gray)
+            sharpness = cv2.Laplacian(gray, cv2.CV_64F).var() if gray.size > 0 else 100
+            
+            # Normalize quality score
+            quality_score = min(1.0, (contrast / 100 + sharpness / 1000) / 2)
+            
+            return {
+                'quality_score': float(quality_score),  # Convert to Python float
+                'brightness': float(brightness),        # Convert to Python float
+                'contrast': float(contrast),            # Convert to Python float
+                'sharpness': float(sharpness),          # Convert to Python float
+                'is_acceptable': bool(quality_score > 0.4)  # Convert to Python bool
+            }
+        except Exception as e:
+            logger.error(f"Quality analysis error: {e}")
+            return {
+                'quality_score': 0.8,
+                'brightness': 127.0,
+                'contrast': 50.0,
+                'sharpness': 500.0,
+                'is_acceptable': True
+            }
+
+def add_cascade(full_model, roi_crop=False):
+    """Put the configured screener in front of full_model (unchanged when the cascade is off)
+    
+    Used for both MODEL_PATH and registry versions, so they serve the same composition.
+    """
+    if not config.CASCADE_ENABLED:
+        return full_model
+    
+    from models.eye_model import GlaucomaRiskPredictor
+    from models.cascade import CascadePredictor
+    if config.SCREENER_MODEL_PATH:
+        # A missing screener would silently run on random weights
+        if not os.path.exists(config.SCREENER_MODEL_PATH):
+            raise FileNotFoundError(f"Screener model not found: {config.SCREENER_MODEL_PATH}")
+        screener = GlaucomaRiskPredictor(model_path=config.SCREENER_MODEL_PATH,
+                                         backbone=config.SCREENER_BACKBONE, roi_crop=roi_crop)
+    else:
+        # The served full model (single or ensemble) at a lower resolution, sharing its weights
+        screener = GlaucomaRiskPredictor(model=full_model.model, image_size=config.SCREENER_IMAGE_SIZE,
+                                         roi_crop=roi_crop)
+    return CascadePredictor(screener, full_model, threshold=config.CASCADE_THRESHOLD)
+
+def load_predictor():
+    """Load the predictor shared by the API and the in-process frontend"""
+    if config.ENSEMBLE_MODEL_PATHS or os.path.exists(config.MODEL_PATH):
+        from models.eye_model import GlaucomaRiskPredictor
+        model = None
+        if config.ENSEMBLE_MODEL_PATHS:
+            from models.ensemble import load_ensemble
+            model = load_ensemble(config.ENSEMBLE_MODEL_PATHS, backbone=config.MODEL_BACKBONE,
+                                  allow_backbone_mismatch=config.ENSEMBLE_ALLOW_BACKBONE_MISMATCH)
+        full_model = GlaucomaRiskPredictor(model_path=config.MODEL_PATH, backbone=config.MODEL_BACKBONE,
+                                           roi_crop=config.ROI_CROP, tta_threshold=config.TTA_THRESHOLD,
+                                           model=model)
+        return add_cascade(full_model, roi_crop=config.ROI_CROP)
+    
+    logger.info(f"No trained model at {config.MODEL_PATH}, using demo predictor")
+    return MockPredictor()
+
+def convert_numpy_types(obj):
+    """Convert numpy types to Python native types for JSON serialization"""
+    if isinstance(obj, (np.integer, np.floating)):
+        return float(obj)
+    elif isinstance(obj, np.bool_):
+        return bool(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, dict):
+        return {key: convert_numpy_types(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_numpy_types(item) for item in obj]
+    else:
+        return obj
+
+def decode_image(contents: bytes, downscaled: bool = False) -> Image.Image:
+    """Decode uploaded bytes, using JPEG draft mode to skip full-size decoding"""
+    image = Image.open(io.BytesIO(contents))
+    
+    max_edge = config.MAX_DECODE_EDGE
+    if not downscaled and max_edge > 0 and image.format == 'JPEG':
+        # Let libjpeg decode at a reduced DCT scale, then finish the resize
+        image.draft('RGB', (max_edge, max_edge))
+        if max(image.size) > max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    
+    return image
+
+def parse_original_size(value: Optional[str]) -> Optional[list]:
+    """Parse an X-Original-Size header of the form WIDTHxHEIGHT"""
+    try:
+        width, height = value.lower().split('x')
+        return [int(width), int(height)]
+    except (AttributeError, ValueError):
+        return None
+
+def image_to_array(image: Image.Image) -> np.ndarray:
+    """Convert a decoded PIL image to an RGB numpy array"""
+    # Convert to numpy array
+    image_np = np.array(image)
+    logger.info(f"🖼️ Image shape: {image_np.shape}")
+    
+    # Handle different image formats
+    if len(image_np.shape) == 2:  # Grayscale
+        image_np = cv2.cvtColor(image_np, cv2.COLOR_GRAY2RGB)
+    elif image_np.shape[2] == 4:  # RGBA
+        image_np = cv2.cvtColor(image_np, cv2.COLOR_RGBA2RGB)
+    
+    logger.info(f"✅ Image processed successfully: {image_np.shape}")
+    
+    return image_np
+
+def analyze_contents(contents: bytes, predictor, downscaled: bool = False,
+                     original_size: Optional[str] = None, tta: Optional[bool] = None,
+                     include_embedding: bool = False, model_version: Optional[str] = None) -> dict:
+    """Decode an uploaded image and run quality and risk analysis on it"""
+    # Convert bytes to image (clients may have downscaled it already)
+    image = decode_image(contents, downscaled=downscaled)
+    
+    return analyze_image_array(image_to_array(image), predictor, downscaled, original_size, tta,
+                               include_embedding, model_version)
+
+def embed_contents(contents: bytes, predictor, stage: str = 'full') -> Optional[np.ndarray]:
+    """Decode an uploaded image and return the predictor's embedding of it (None if it has none)
+    
+    stage picks the cascade stage whose embedding space is wanted.
+    """
+    image_np = image_to_array(decode_image(contents))
+    if hasattr(predictor, 'embed'):
+        return predictor.embed(image_np, stage)
+    return predictor.predict(image_np, tta=False).get('embedding')
+
+def analyze_image_array(image_np: np.ndarray, predictor, downscaled: bool = False,
+                        original_size: Optional[str] = None, tta: Optional[bool] = None,
+                        include_embedding: bool = False, model_version: Optional[str] = None) -> dict:
+    """Run the analysis pipeline on an RGB image array
+    
+    This is the single code path behind both the HTTP API and the frontend's
+    in-process mode, so both return the same result dict. tta forces
+    test-time augmentation on or off; None leaves it to the confidence threshold.
+    The image embedding is kept out of the result unless include_embedding is
+    set, in which case it is added under 'embedding' as a numpy array.
+    model_version is recorded so stored and cached results name their model.
+    """
+    # Analyze image quality
+    quality_result = predictor.analyze_image_quality(image_np)
+    logger.info(f"📊 Quality analysis: {quality_result}")
+    
+    # Analyze image for glaucoma risk
+    result = predictor.predict(image_np, tta=tta)
+    embedding = result.pop('embedding', None)
+    logger.info(f"🔬 Risk analysis: {result}")
+    
+    # Generate recommendations
+    recommendations = generate_recommendations(result, quality_result)
+    
+    # Prepare analysis data
+    analysis_data = {
+        'image_info': {
+            'size': [int(dim) for dim in image_np.shape],  # Convert to Python int
+            'quality_score': float(quality_result.get('quality_score', 0)),
+            'is_acceptable': bool(quality_result.get('is_acceptable', False)),
+            'client_downscaled': bool(downscaled),
+            'original_size': parse_original_size(original_size)
+        },
+        'analysis_result': result,
+        'recommendations': recommendations,
+        'quality_assessment': quality_result,
+        'model_version': model_version
+    }
+    
+    # Convert all numpy types to Python native types
+    analysis_data = convert_numpy_types(analysis_data)
+    if include_embedding and embedding is not None:
+        analysis_data['embedding'] = embedding
+    
+    return analysis_data
+
+def generate_recommendations(result: dict, quality_result: dict) -> list:
+    """Generate personalized recommendations"""
+    try:
+        risk_level = result['risk_level']
+        confidence = result['confidence']
+        
+        base_recommendations = {
+            'Normal': [
+                "✅ Your eye health appears normal. Continue regular eye care habits.",
+                "📅 Schedule annual comprehensive eye exams.",
+                "💻 Practice the 20-20-20 rule to reduce digital eye strain.",
+                "🥗 Maintain a balanced diet rich in eye-healthy nutrients."
+            ],
+            'Slightly High': [
+                "⚠️ Moderate risk detected. Increased monitoring recommended.",
+                "👁️ Practice eye relaxation exercises daily.",
+                "🕒 Reduce continuous screen time; take frequent breaks.",
+                "🏥 Consider consulting an eye specialist for evaluation.",
+                "📊 Monitor changes weekly with follow-up images."
+            ],
+            'High': [
+                "🚨 Higher risk level detected. Professional consultation advised.",
+                "👨‍⚕️ Schedule an appointment with an ophthalmologist promptly.",
+                "📵 Significantly reduce screen time and eye strain.",
+                "🧘 Practice eye exercises 3-4 times daily.",
+                "💧 Maintain proper hydration and monitor blood pressure."
+            ]
+        }
+        
+        recommendations = base_recommendations.get(risk_level, [])
+        
+        # Add quality-based recommendations
+        if not quality_result.get('is_acceptable', False):
+            recommendations.insert(0, "📸 Image quality is low. For better analysis, ensure good lighting and focus.")
+        
+        if confidence < 0.7:
+            recommendations.append("ℹ️ Analysis confidence is moderate. Consider retaking the image with better lighting.")
+        
+        return recommendations
+    except Exception as e:
+        logger.error(f"Recommendations error: {e}")
+        return ["Please consult an eye specialist for professional evaluation."]
@@ -11,19 +11,57 @@ class Config:
     API_VERSION = "1.0.0"
     API_HOST = os.getenv("API_HOST", "0.0.0.0")
     API_PORT = int(os.getenv("API_PORT", "8000"))
+    API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # >1 splits in-memory history/summaries/cases per worker
+    WORKER_THREADS = int(os.getenv("WORKER_THREADS", "0"))  # 0 = CPUs per worker
     
     # Model Settings
     MODEL_PATH = os.getenv("MODEL_PATH", "models/best_eyesense_model.pth")
+    MODEL_BACKBONE = os.getenv("MODEL_BACKBONE", "resnet50")  # must match the checkpoint
+    # Versioned model registry; the backend serves its CURRENT version when there is one
+    # and polls for promotions every REGISTRY_POLL_SECONDS (0 disables the watcher)
+    MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "models/registry")
+    REGISTRY_POLL_SECONDS = float(os.getenv("REGISTRY_POLL_SECONDS", "5"))
+    # Comma-separated checkpoints served as one shared-backbone ensemble (overrides MODEL_PATH;
+    # with a registry version they add heads on that version's backbone)
+    ENSEMBLE_MODEL_PATHS = [path for path in os.getenv("ENSEMBLE_MODEL_PATHS", "").split(",") if path]
+    # Heads whose checkpoints have different backbone weights are refused unless this is set
+    ENSEMBLE_ALLOW_BACKBONE_MISMATCH = os.getenv("ENSEMBLE_ALLOW_BACKBONE_MISMATCH", "false").lower() == "true"
+    # Crop to the optic disc before classification (for models trained with --roi-crop)
+    ROI_CROP = os.getenv("ROI_CROP", "false").lower() == "true"
+    
+    # Two-stage cascade: a cheap screener answers when its top-class probability
+    # is at least CASCADE_THRESHOLD, otherwise the full model runs. Without a
+    # separate SCREENER_MODEL_PATH the screener is the served full model (or
+    # ensemble) at SCREENER_IMAGE_SIZE.
+    CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "false").lower() == "true"
+    CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0.9"))
+    SCREENER_MODEL_PATH = os.getenv("SCREENER_MODEL_PATH", "")
+    SCREENER_BACKBONE = os.getenv("SCREENER_BACKBONE", "mobilenet_v3_small")
+    SCREENER_IMAGE_SIZE = int(os.getenv("SCREENER_IMAGE_SIZE", "112"))
     IMAGE_SIZE = (224, 224)
+    # Average over augmented views when the full model's confidence is below this (0 = only on request)
+    TTA_THRESHOLD = float(os.getenv("TTA_THRESHOLD", "0"))
+    
+    # Similar-case search: exact below this many stored cases, IVF lists above it
+    SIMILARITY_IVF_THRESHOLD = int(os.getenv("SIMILARITY_IVF_THRESHOLD", "10000"))
+    SIMILARITY_NPROBE = int(os.getenv("SIMILARITY_NPROBE", "8"))  # IVF lists scanned per query
+    
+    # Weight of the newest analysis in each user's exponentially weighted risk score
+    RISK_EWMA_ALPHA = float(os.getenv("RISK_EWMA_ALPHA", "0.3"))
     
     # Database Settings (for future use)
     DATABASE_URL = os.getenv("DATABASE_URL", "mongodb://localhost:27017/eyesense")
     
     # Security
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # empty disables the admin endpoints
     
     # File Upload
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'bmp'}
+    
+    # Longest edge full-size JPEG uploads are decoded at (0 = full resolution).
+    # Uploads sent with the X-Image-Downscaled header are always decoded as-is.
+    MAX_DECODE_EDGE = int(os.getenv("MAX_DECODE_EDGE", "0"))
 
 config = Config()
\ No newline at end of file
@@ -1,22 +1,25 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
-import cv2
-import numpy as np
-from PIL import Image
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import uvicorn
-import cv2
-import numpy as np
-from PIL import Image
-import io
+import hmac
+import time
+import uuid
 import os
+import sys
 from datetime import datetime
+from typing import Optional
 import logging
-import random
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.config import config
+from backend.summary import new_user_summary, update_user_summary
+from backend.analysis import analyze_contents, embed_contents, convert_numpy_types
+from backend.similarity import CaseIndex
+from backend.serving import ServedModel
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +28,8 @@ logger = logging.getLogger(__name__)
 # Mock database for storage
 users_db = {}
 analysis_history = {}
+user_summaries = {}  # Aggregates updated as each analysis is saved
+case_indexes = {}  # Embeddings of saved analyses per (model version, cascade stage); embedding spaces differ
 
 app = FastAPI(title="EyeSense API", version="1.0.0")
 
@@ -37,90 +42,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mock AI predictor for demonstration
-class MockPredictor:
-    def predict(self, image):
-        try:
-            # Simulate AI analysis with realistic probabilities
-            risk_levels = ['Normal', 'Slightly High', 'High']
-            
-            # Generate random but realistic probabilities
-            base_prob = [0.7, 0.2, 0.1]  # Mostly normal
-            
-            # Add some randomness for demo
-            if random.random() < 0.3:  # 30% chance of higher risk
-                base_prob = [0.3, 0.4, 0.3]
-            
-            # Normalize probabilities to sum to 1
-            total = sum(base_prob)
-            probabilities = [p/total for p in base_prob]
-            
-            risk_index = random.choices(range(3), weights=probabilities)[0]
-            confidence = probabilities[risk_index] + random.uniform(0.1, 0.2)
-            confidence = min(confidence, 0.95)
-            
-            return {
-                'risk_level': risk_levels[risk_index],
-                'confidence': float(confidence),  # Convert to Python float
-                'probabilities': [float(p) for p in probabilities]  # Convert to Python float
-            }
-        except Exception as e:
-            logger.error(f"Prediction error: {e}")
-            return {
-                'risk_level': 'Normal',
-                'confidence': 0.85,
-                'probabilities': [0.85, 0.10, 0.05]
-            }
-    
-    def analyze_image_quality(self, image):
-        try:
-            # Convert to grayscale for analysis if needed
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-            else:
-                gray = image
-            
-            # Calculate basic quality metrics
-            brightness = np.mean(gray)
-            contrast = np.std(gray)
-            sharpness = cv2.Laplacian(gray, cv2.CV_64F).var() if gray.size > 0 else 100
-            
-            # Normalize quality score
-            quality_score = min(1.0, (contrast / 100 + sharpness / 1000) / 2)
-            
-            return {
-                'quality_score': float(quality_score),  # Convert to Python float
-                'brightness': float(brightness),        # Convert to Python float
-                'contrast': float(contrast),            # Convert to Python float
-                'sharpness': float(sharpness),          # Convert to Python float
-                'is_acceptable': bool(quality_score > 0.4)  # Convert to Python bool
-            }
-        except Exception as e:
-            logger.error(f"Quality analysis error: {e}")
-            return {
-                'quality_score': 0.8,
-                'brightness': 127.0,
-                'contrast': 50.0,
-                'sharpness': 500.0,
-                'is_acceptable': True
-            }
+# Shared predictor (the registry's current version, the configured model or the demo mock),
+# hot-swapped when the registry's CURRENT version changes
+served_model = ServedModel()
+if config.REGISTRY_POLL_SECONDS > 0:
+    served_model.watch(config.REGISTRY_POLL_SECONDS)
 
-predictor = MockPredictor()
+def case_index_for(version: str, stage: str = 'full') -> CaseIndex:
+    if (version, stage) not in case_indexes:
+        case_indexes[(version, stage)] = CaseIndex(ivf_threshold=config.SIMILARITY_IVF_THRESHOLD,
+                                                   nprobe=config.SIMILARITY_NPROBE)
+    return case_indexes[(version, stage)]
 
-def convert_numpy_types(obj):
-    """Convert numpy types to Python native types for JSON serialization"""
-    if isinstance(obj, (np.integer, np.floating)):
-        return float(obj)
-    elif isinstance(obj, np.bool_):
-        return bool(obj)
-    elif isinstance(obj, np.ndarray):
-        return obj.tolist()
-    elif isinstance(obj, dict):
-        return {key: convert_numpy_types(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_numpy_types(item) for item in obj]
-    else:
-        return obj
+@app.middleware("http")
+async def add_model_version_header(request: Request, call_next):
+    response = await call_next(request)
+    # Model endpoints already set the exact version that answered
+    if 'x-model-version' not in response.headers:
+        response.headers['X-Model-Version'] = served_model.version
+    return response
 
 @app.get("/")
 async def root():
@@ -131,13 +71,17 @@ async def health_check():
     return {
         "status": "healthy", 
         "timestamp": datetime.now().isoformat(),
-        "message": "Backend is running perfectly!"
+        "message": "Backend is running perfectly!",
+        "model_version": served_model.version
     }
 
 @app.post("/api/analyze-eye")
 async def analyze_eye_image(
     file: UploadFile = File(...),
-    user_id: str = "demo_user"
+    user_id: str = "demo_user",
+    tta: Optional[bool] = None,
+    x_image_downscaled: bool = Header(False),
+    x_original_size: Optional[str] = Header(None)
 ):
     try:
         logger.info(f"📸 Received analysis request from {user_id}")
@@ -148,57 +92,45 @@ async def analyze_eye_image(
         if len(contents) == 0:
             raise HTTPException(status_code=400, detail="Empty file received")
         
-        # Convert bytes to image
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to numpy array
-        image_np = np.array(image)
-        logger.info(f"🖼️ Image shape: {image_np.shape}")
+        # The whole request uses one model version, even if a new one is swapped in meanwhile
+        predictor, model_version = served_model.current()
         
-        # Handle different image formats
-        if len(image_np.shape) == 2:  # Grayscale
-            image_np = cv2.cvtColor(image_np, cv2.COLOR_GRAY2RGB)
-        elif image_np.shape[2] == 4:  # RGBA
-            image_np = cv2.cvtColor(image_np, cv2.COLOR_RGBA2RGB)
-        
-        logger.info(f"✅ Image processed successfully: {image_np.shape}")
-        
-        # Analyze image quality
-        quality_result = predictor.analyze_image_quality(image_np)
-        logger.info(f"📊 Quality analysis: {quality_result}")
-        
-        # Analyze image for glaucoma risk
-        result = predictor.predict(image_np)
-        logger.info(f"🔬 Risk analysis: {result}")
-        
-        # Generate recommendations
-        recommendations = generate_recommendations(result, quality_result)
-        
-        # Prepare analysis data
-        analysis_data = {
-            'image_info': {
-                'size': [int(dim) for dim in image_np.shape],  # Convert to Python int
-                'quality_score': float(quality_result.get('quality_score', 0)),
-                'is_acceptable': bool(quality_result.get('is_acceptable', False))
-            },
-            'analysis_result': result,
-            'recommendations': recommendations,
-            'quality_assessment': quality_result
-        }
-        
-        # Convert all numpy types to Python native types
-        analysis_data = convert_numpy_types(analysis_data)
+        # Decode and run the models off the event loop so concurrent uploads overlap
+        analysis_data = await run_in_threadpool(
+            analyze_contents, contents, predictor, x_image_downscaled, x_original_size, tta, True,
+            model_version
+        )
+        embedding = analysis_data.pop('embedding', None)
+        result = analysis_data['analysis_result']
         
         # Store analysis history
-        analysis_id = f"analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        analysis_id = f"analysis_{uuid.uuid4().hex}"
+        analysis_data['analysis_id'] = analysis_id
         if user_id not in analysis_history:
             analysis_history[user_id] = []
         analysis_history[user_id].append(analysis_data)
         
-        logger.info(f"✅ Analysis completed: {result['risk_level']} (Confidence: {result['confidence']:.2f})")
+        if user_id not in user_summaries:
+            user_summaries[user_id] = new_user_summary(user_id)
+        update_user_summary(user_summaries[user_id], result, alpha=config.RISK_EWMA_ALPHA)
+        
+        if embedding is not None:
+            try:
+                # Screener answers are indexed with the screener's embedding; no extra full-model run
+                case_index_for(model_version, result.get('stage', 'full')).add(embedding, {
+                    'user_id': user_id,
+                    'analysis_id': analysis_id,
+                    'risk_level': result['risk_level'],
+                    'confidence': result['confidence']
+                })
+            except ValueError as e:
+                # e.g. an embedding size that does not match the index
+                logger.warning(f"Case not indexed: {e}")
         
-        return JSONResponse(content=analysis_data)
+        logger.info(f"✅ Analysis completed: {result['risk_level']} (Confidence: {result['confidence']:.2f})")
         
+        return JSONResponse(content=analysis_data, headers={"X-Model-Version": model_version})
+    
     except Exception as e:
         logger.error(f"❌ Analysis error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
@@ -218,48 +150,83 @@ async def get_user_history(user_id: str):
         logger.error(f"History error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-def generate_recommendations(result: dict, quality_result: dict) -> list:
-    """Generate personalized recommendations"""
+@app.get("/api/cascade-metrics")
+async def get_cascade_metrics():
+    """Escalation rate and latency saved by the screener/full-model cascade"""
+    predictor, model_version = served_model.current()
+    if not hasattr(predictor, 'metrics'):
+        return {"enabled": False, "model_version": model_version}
+    return dict(predictor.metrics(), enabled=True, model_version=model_version)
+
+@app.post("/api/similar-cases")
+async def find_similar_cases(file: UploadFile = File(...), k: int = Query(5, ge=1, le=100)):
+    """Past analyses whose image embeddings are closest to the uploaded image"""
+    contents = await file.read()
+    if len(contents) == 0:
+        raise HTTPException(status_code=400, detail="Empty file received")
+    
+    predictor, model_version = served_model.current()
+    # Only cases embedded by the same model version and stage are comparable, so the
+    # query is embedded once per stage that has cases and the hits are merged by similarity
+    stages = [stage for stage in ('screener', 'full')
+              if len(case_indexes.get((model_version, stage), ()))] or ['full']
+    cases = []
+    index_stats = {}
+    search_ms = 0.0
+    for stage in stages:
+        embedding = await run_in_threadpool(embed_contents, contents, predictor, stage)
+        if embedding is None:
+            raise HTTPException(status_code=503, detail="The predictor does not provide image embeddings")
+        
+        case_index = case_index_for(model_version, stage)
+        start = time.perf_counter()
+        try:
+            cases += [dict(case, stage=stage) for case in case_index.search(embedding, k=k)]
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        search_ms += 1000 * (time.perf_counter() - start)
+        index_stats[stage] = case_index.stats()
+    
+    cases = sorted(cases, key=lambda case: case['similarity'], reverse=True)[:k]
+    index = {"cases": sum(stats['cases'] for stats in index_stats.values()), "stages": index_stats}
+    content = {"cases": cases, "search_ms": search_ms, "index": index,
+               "model_version": model_version}
+    return JSONResponse(content=content, headers={"X-Model-Version": model_version})
+
+@app.get("/api/models")
+async def list_models():
+    """Registered model versions and the one being served"""
+    versions = [{key: value for key, value in metadata.items() if key != 'path'}
+                for metadata in served_model.registry.versions()]
+    return {"serving": served_model.version, "registry_current": served_model.registry.current(),
+            "versions": versions}
+
+@app.post("/api/admin/reload-model")
+async def reload_model(version: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Load, warm up and swap in a registry version, then make it current for every worker
+    
+    Without a version the registry's CURRENT one is reloaded. Requires ADMIN_TOKEN.
+    """
+    if not config.ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", config.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    
     try:
-        risk_level = result['risk_level']
-        confidence = result['confidence']
-        
-        base_recommendations = {
-            'Normal': [
-                "✅ Your eye health appears normal. Continue regular eye care habits.",
-                "📅 Schedule annual comprehensive eye exams.",
-                "💻 Practice the 20-20-20 rule to reduce digital eye strain.",
-                "🥗 Maintain a balanced diet rich in eye-healthy nutrients."
-            ],
-            'Slightly High': [
-                "⚠️ Moderate risk detected. Increased monitoring recommended.",
-                "👁️ Practice eye relaxation exercises daily.",
-                "🕒 Reduce continuous screen time; take frequent breaks.",
-                "🏥 Consider consulting an eye specialist for evaluation.",
-                "📊 Monitor changes weekly with follow-up images."
-            ],
-            'High': [
-                "🚨 Higher risk level detected. Professional consultation advised.",
-                "👨‍⚕️ Schedule an appointment with an ophthalmologist promptly.",
-                "📵 Significantly reduce screen time and eye strain.",
-                "🧘 Practice eye exercises 3-4 times daily.",
-                "💧 Maintain proper hydration and monitor blood pressure."
-            ]
-        }
-        
-        recommendations = base_recommendations.get(risk_level, [])
-        
-        # Add quality-based recommendations
-        if not quality_result.get('is_acceptable', False):
-            recommendations.insert(0, "📸 Image quality is low. For better analysis, ensure good lighting and focus.")
-        
-        if confidence < 0.7:
-            recommendations.append("ℹ️ Analysis confidence is moderate. Consider retaking the image with better lighting.")
-        
-        return recommendations
+        served_version = await run_in_threadpool(served_model.reload, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
-        logger.error(f"Recommendations error: {e}")
-        return ["Please consult an eye specialist for professional evaluation."]
+        logger.error(f"Model reload failed: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving {served_model.version}: {e}")
+    
+    # Other worker processes follow through their registry watchers
+    if version is not None and served_model.registry.current() != served_version:
+        served_model.registry.promote(served_version)
+    return {"status": "ok", "model_version": served_version}
+
+@app.get("/api/user-summary/{user_id}")
+async def get_user_summary(user_id: str):
+    """Serve the incrementally maintained risk summary without touching history"""
+    return user_summaries.get(user_id) or new_user_summary(user_id)
 
 if __name__ == "__main__":
     print("🚀 Starting FIXED EyeSense Backend on http://127.0.0.1:8000")
@@ -0,0 +1,138 @@
+import os
+import sys
+import threading
+import time
+import logging
+from typing import Optional, Tuple, Any
+
+import numpy as np
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.config import config
+from backend.analysis import load_predictor, add_cascade, MockPredictor
+from models.registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+def load_registered_predictor(metadata: dict):
+    """Build a predictor for a registry version, raising if its weights cannot be loaded
+    
+    The version gets the same composition as MODEL_PATH: with
+    ENSEMBLE_MODEL_PATHS set, those heads are served on the version's
+    backbone alongside its own head, and the cascade settings apply.
+    """
+    import torch
+    from models.eye_model import GlaucomaRiskPredictor, ImprovedEyeSenseModel, load_model_weights
+    
+    # Loaded here rather than by GlaucomaRiskPredictor, which falls back to random weights
+    if config.ENSEMBLE_MODEL_PATHS:
+        from models.ensemble import load_ensemble
+        model = load_ensemble([metadata['path']] + config.ENSEMBLE_MODEL_PATHS,
+                              num_classes=metadata['num_classes'], backbone=metadata['backbone'],
+                              allow_backbone_mismatch=config.ENSEMBLE_ALLOW_BACKBONE_MISMATCH)
+    else:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        model = ImprovedEyeSenseModel(num_classes=metadata['num_classes'], use_pretrained=False,
+                                      backbone=metadata['backbone'])
+        load_model_weights(model, metadata['path'], device)
+    
+    roi_crop = metadata.get('roi_crop', False)
+    full_model = GlaucomaRiskPredictor(model=model, image_size=metadata['image_size'], roi_crop=roi_crop,
+                                       tta_threshold=config.TTA_THRESHOLD)
+    return add_cascade(full_model, roi_crop=roi_crop)
+
+def warm_up(predictor, image_size: int = 224, runs: int = 2):
+    """Run a few predictions so the first real requests do not pay for lazy initialization"""
+    image = np.full((image_size, image_size, 3), 96, dtype=np.uint8)
+    for _ in range(runs):
+        result = predictor.predict(image, tta=False)
+        if 'error' in result:
+            raise RuntimeError(f"Warm-up prediction failed: {result['error']}")
+
+class ServedModel:
+    """The predictor being served and its version, swapped atomically on reload
+    
+    Requests take the (predictor, version) pair once and use it to the end,
+    so in-flight work finishes on the old model while new requests already
+    get the new one. The old predictor is freed when its last request ends.
+    """
+    
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        self.registry = registry or ModelRegistry(config.MODEL_REGISTRY_DIR)
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()  # one load at a time
+        self._watched_mtime = self.registry.current_mtime()
+        
+        version = self.registry.current()
+        predictor = None
+        if version is not None:
+            try:
+                predictor = load_registered_predictor(self.registry.get(version))
+            except Exception as e:
+                logger.error(f"Could not load model version {version}: {e}")
+        if predictor is None:
+            # No usable registry version: the configured model or the demo predictor
+            predictor = load_predictor()
+            version = 'demo' if isinstance(predictor, MockPredictor) else 'unversioned'
+        self._current = (predictor, version)
+        logger.info(f"Serving model version {version}")
+    
+    def current(self) -> Tuple[Any, str]:
+        with self._lock:
+            return self._current
+    
+    @property
+    def version(self) -> str:
+        return self.current()[1]
+    
+    def reload(self, version: Optional[str] = None) -> str:
+        """Load, warm up and swap in a registry version (default: the current one)
+        
+        Serving continues on the old model while the new one loads. If loading
+        or warm-up fails the old model stays in place and the error is raised.
+        Returns the served version.
+        """
+        with self._reload_lock:
+            version = version or self.registry.current()
+            if version is None:
+                raise ValueError("The model registry is empty")
+            if version == self.version:
+                return version
+            
+            metadata = self.registry.get(version)
+            start = time.perf_counter()
+            predictor = load_registered_predictor(metadata)
+            warm_up(predictor, metadata['image_size'])
+            with self._lock:
+                self._current = (predictor, version)
+            logger.info(f"Now serving model version {version} (ready in {time.perf_counter() - start:.1f}s)")
+            return version
+    
+    def check_for_update(self) -> bool:
+        """Reload if the registry's CURRENT file changed since the last check"""
+        mtime = self.registry.current_mtime()
+        if mtime == self._watched_mtime:
+            return False
+        # A failed version is not retried until CURRENT changes again
+        self._watched_mtime = mtime
+        version = self.registry.current()
+        if version is None or version == self.version:
+            return False
+        self.reload(version)
+        return True
+    
+    def watch(self, interval: float) -> threading.Thread:
+        """Poll the registry from a daemon thread, so every worker process follows promotions"""
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check_for_update()
+                except Exception as e:
+                    logger.error(f"Model reload failed: {e}", exc_info=True)
+        
+        thread = threading.Thread(target=poll, name="model-registry-watcher", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,205 @@
+import math
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+class _GrowableArray:
+    """Append-only tensor whose capacity doubles, so appends are amortized O(1)
+    
+    Appends never modify existing rows, so a view() taken earlier stays
+    valid while other threads keep appending.
+    """
+    
+    def __init__(self, initial: torch.Tensor):
+        self._buffer = initial
+        self.size = len(initial)
+    
+    def append(self, rows: torch.Tensor):
+        end = self.size + len(rows)
+        if end > len(self._buffer):
+            grown = self._buffer.new_empty((max(end, 2 * len(self._buffer)), *self._buffer.shape[1:]))
+            grown[:self.size] = self._buffer[:self.size]
+            self._buffer = grown
+        self._buffer[self.size:end] = rows
+        self.size = end
+    
+    def view(self) -> torch.Tensor:
+        return self._buffer[:self.size]
+    
+    def nbytes(self) -> int:
+        return self._buffer.numel() * self._buffer.element_size()
+
+def spherical_kmeans(vectors: torch.Tensor, clusters: int, iterations: int = 8,
+                     sample_size: Optional[int] = None, seed: int = 0, chunk: int = 8192):
+    """Cluster unit vectors by cosine similarity
+    
+    Centroids are trained on a random sample (32 points per cluster by
+    default) and then every vector is assigned. Returns (centroids, assignment).
+    """
+    generator = torch.Generator().manual_seed(seed)
+    order = torch.randperm(len(vectors), generator=generator)
+    sample = vectors[order[:sample_size or 32 * clusters]].float()
+    centroids = sample[:clusters].clone()
+    
+    for _ in range(iterations):
+        assignment = (sample @ centroids.T).argmax(dim=1)
+        sums = torch.zeros_like(centroids).index_add_(0, assignment, sample)
+        counts = torch.bincount(assignment, minlength=clusters)
+        # Empty clusters keep their previous centroid
+        centroids = F.normalize(torch.where(counts[:, None] > 0, sums, centroids), dim=1)
+    
+    assignment = torch.cat([(vectors[start:start + chunk].float() @ centroids.T).argmax(dim=1)
+                            for start in range(0, len(vectors), chunk)])
+    return centroids, assignment
+
+class CaseIndex:
+    """Cosine-similarity index over the embeddings of past analyses
+    
+    Embeddings are L2-normalized and stored as float16. Below ivf_threshold
+    cases a query is one matrix-vector product over all of them. Past it an
+    IVF index is built (in a background thread by default): spherical k-means
+    splits the cases into ~sqrt(n) inverted lists stored contiguously, and a
+    query only scans the nprobe lists with the closest centroids. The lists
+    are rebuilt each time the index has grown by rebuild_factor.
+    """
+    
+    def __init__(self, ivf_threshold: int = 10000, nprobe: int = 8, rebuild_factor: int = 4,
+                 background: bool = True, seed: int = 0):
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.rebuild_factor = rebuild_factor
+        self.background = background
+        self.seed = seed
+        
+        self._lock = threading.Lock()
+        self._metadata: List[Dict[str, Any]] = []
+        self._dim: Optional[int] = None
+        self._flat: Optional[_GrowableArray] = None  # all vectors, until the IVF lists exist
+        self._ivf = None  # (centroids, [(vectors, case ids)] per list)
+        self._built_size = 0
+        self._building = False
+        self._pending = []  # (case id, vector) added while a build runs
+    
+    def __len__(self) -> int:
+        return len(self._metadata)
+    
+    @property
+    def dim(self) -> Optional[int]:
+        return self._dim
+    
+    def _normalize(self, embedding) -> torch.Tensor:
+        vector = torch.as_tensor(np.asarray(embedding, dtype=np.float32)).flatten()
+        if self._dim is not None and len(vector) != self._dim:
+            raise ValueError(f"Embedding has {len(vector)} dimensions, the index holds {self._dim}")
+        return vector / vector.norm().clamp_min(1e-12)
+    
+    @staticmethod
+    def _ivf_append(ivf, case_id: int, vector: torch.Tensor):
+        centroids, lists = ivf
+        vectors, ids = lists[int((centroids @ vector.float()).argmax())]
+        vectors.append(vector[None])
+        ids.append(torch.tensor([case_id]))
+    
+    def add(self, embedding, metadata: Optional[Dict[str, Any]] = None) -> int:
+        """Store one embedding with its metadata, returning its case id"""
+        with self._lock:
+            vector = self._normalize(embedding).half()
+            case_id = len(self._metadata)
+            self._metadata.append(dict(metadata or {}))
+            
+            if self._ivf is None:
+                if self._flat is None:
+                    self._dim = len(vector)
+                    self._flat = _GrowableArray(torch.empty((0, self._dim), dtype=torch.float16))
+                self._flat.append(vector[None])
+            else:
+                self._ivf_append(self._ivf, case_id, vector)
+            if self._building:
+                self._pending.append((case_id, vector))
+            
+            build = (not self._building and len(self._metadata) >= self.ivf_threshold
+                     and len(self._metadata) >= self.rebuild_factor * self._built_size)
+            self._building = self._building or build
+        
+        if build:
+            if self.background:
+                threading.Thread(target=self.build_ivf, daemon=True).start()
+            else:
+                self.build_ivf()
+        return case_id
+    
+    def _snapshot(self):
+        """Views of every stored vector and its case id"""
+        if self._ivf is None:
+            return self._flat.view(), torch.arange(self._flat.size)
+        _, lists = self._ivf
+        return (torch.cat([vectors.view() for vectors, _ in lists]),
+                torch.cat([ids.view() for _, ids in lists]))
+    
+    def build_ivf(self):
+        """(Re)build the inverted lists from every case stored so far"""
+        with self._lock:
+            self._building = True
+            vectors, ids = self._snapshot()
+            self._pending = []
+        
+        clusters = max(1, int(math.sqrt(len(vectors))))
+        centroids, assignment = spherical_kmeans(vectors, clusters, seed=self.seed)
+        order = torch.argsort(assignment)
+        counts = torch.bincount(assignment, minlength=clusters).tolist()
+        lists = [(_GrowableArray(list_vectors), _GrowableArray(list_ids)) for list_vectors, list_ids
+                 in zip(vectors[order].split(counts), ids[order].split(counts))]
+        ivf = (centroids, lists)
+        
+        with self._lock:
+            # Cases added during the build are not in the snapshot
+            for case_id, vector in self._pending:
+                self._ivf_append(ivf, case_id, vector)
+            self._ivf, self._flat = ivf, None
+            self._built_size = len(vectors)
+            self._pending = []
+            self._building = False
+    
+    def search(self, embedding, k: int = 5) -> List[Dict[str, Any]]:
+        """The k most similar stored cases, each as its metadata plus case_id and similarity"""
+        with self._lock:
+            if not self._metadata:
+                return []
+            query = self._normalize(embedding).half()
+            if self._ivf is None:
+                candidates = [(self._flat.view(), None)]
+            else:
+                centroids, lists = self._ivf
+                probe = (centroids @ query.float()).topk(min(self.nprobe, len(lists))).indices.tolist()
+                candidates = [(lists[i][0].view(), lists[i][1].view()) for i in probe]
+        
+        # The views stay valid outside the lock, so concurrent adds are not blocked by the scan
+        scores = torch.cat([vectors @ query for vectors, _ in candidates]).float()
+        if candidates[0][1] is None:
+            ids = torch.arange(len(scores))
+        else:
+            ids = torch.cat([list_ids for _, list_ids in candidates])
+        
+        top = scores.topk(min(k, len(scores)))
+        return [dict(self._metadata[case_id], case_id=case_id, similarity=score)
+                for case_id, score in zip(ids[top.indices].tolist(), top.values.tolist())]
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._ivf is None:
+                lists, nbytes = 0, self._flat.nbytes() if self._flat is not None else 0
+            else:
+                centroids, ivf_lists = self._ivf
+                lists = len(ivf_lists)
+                nbytes = sum(vectors.nbytes() + ids.nbytes() for vectors, ids in ivf_lists)
+                nbytes += centroids.numel() * centroids.element_size()
+            return {
+                'cases': len(self._metadata),
+                'dim': self._dim,
+                'mode': 'flat' if self._ivf is None else 'ivf',
+                'lists': lists,
+                'nbytes': nbytes
+            }
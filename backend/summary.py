@@ -0,0 +1,71 @@
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+RISK_LEVELS = ['Normal', 'Slightly High', 'High']
+
+# Difference between the recent (EWMA) and long-run risk score that counts as a trend
+TREND_THRESHOLD = 0.25
+
+def new_user_summary(user_id: str) -> Dict[str, Any]:
+    """Create an empty per-user risk summary"""
+    return {
+        'user_id': user_id,
+        'analysis_count': 0,
+        'risk_counts': {level: 0 for level in RISK_LEVELS},
+        'mean_probabilities': [0.0] * len(RISK_LEVELS),
+        'mean_confidence': 0.0,
+        'mean_risk_score': 0.0,
+        'ewma_risk_score': 0.0,
+        'trend': 'stable',
+        'last_risk_level': None,
+        'last_seen': None
+    }
+
+def risk_score(result: Dict[str, Any]) -> float:
+    """Expected risk on a 0 (Normal) to 2 (High) scale"""
+    probabilities = result.get('probabilities') or []
+    if len(probabilities) == len(RISK_LEVELS):
+        return float(sum(i * p for i, p in enumerate(probabilities)))
+    
+    risk_level = result.get('risk_level')
+    return float(RISK_LEVELS.index(risk_level)) if risk_level in RISK_LEVELS else 0.0
+
+def update_user_summary(summary: Dict[str, Any], result: Dict[str, Any],
+                        alpha: float = 0.3, timestamp: Optional[str] = None) -> Dict[str, Any]:
+    """Fold one analysis result into a summary in O(1)"""
+    count = summary['analysis_count'] + 1
+    score = risk_score(result)
+    
+    risk_level = result.get('risk_level')
+    if risk_level in summary['risk_counts']:
+        summary['risk_counts'][risk_level] += 1
+    
+    # Running means over every analysis
+    probabilities = result.get('probabilities') or []
+    if len(probabilities) == len(summary['mean_probabilities']):
+        summary['mean_probabilities'] = [
+            mean + (float(p) - mean) / count
+            for mean, p in zip(summary['mean_probabilities'], probabilities)
+        ]
+    summary['mean_confidence'] += (float(result.get('confidence', 0)) - summary['mean_confidence']) / count
+    summary['mean_risk_score'] += (score - summary['mean_risk_score']) / count
+    
+    # Exponentially weighted score tracks recent analyses
+    if count == 1:
+        summary['ewma_risk_score'] = score
+    else:
+        summary['ewma_risk_score'] = alpha * score + (1 - alpha) * summary['ewma_risk_score']
+    
+    difference = summary['ewma_risk_score'] - summary['mean_risk_score']
+    if difference > TREND_THRESHOLD:
+        summary['trend'] = 'increasing'
+    elif difference < -TREND_THRESHOLD:
+        summary['trend'] = 'decreasing'
+    else:
+        summary['trend'] = 'stable'
+    
+    summary['analysis_count'] = count
+    summary['last_risk_level'] = risk_level
+    summary['last_seen'] = timestamp or datetime.now().isoformat()
+    
+    return summary
@@ -0,0 +1,121 @@
+"""Run several uvicorn workers that share one listening socket.
+
+Each worker is pinned to its own slice of the CPUs and limits its PyTorch
+thread pools to that slice, so N workers do not oversubscribe the cores.
+Model weights are memory-mapped (see models.eye_model.load_model_weights),
+so the workers share a single physical copy of them through the page cache.
+
+Analysis history, user summaries and the similar-case index live in each
+worker's memory, so with several workers /api/user-history,
+/api/user-summary and /api/similar-cases only see the requests that worker
+served. The stateful endpoints are therefore single-process: more than one
+worker needs --allow-per-worker-state, for stateless deployments that
+only call /api/analyze-eye.
+
+Usage: python backend/workers.py --workers 4 --allow-per-worker-state
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+
+import uvicorn
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.config import config
+
+def available_cpus():
+    """CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def plan_cpu_affinity(workers, cpus=None):
+    """Split CPUs into one contiguous, non-overlapping slice per worker
+    
+    With more workers than CPUs, workers share CPUs round-robin.
+    """
+    cpus = list(cpus) if cpus is not None else available_cpus()
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    
+    per_worker, extra = divmod(len(cpus), workers)
+    plan = []
+    start = 0
+    for i in range(workers):
+        size = per_worker + (1 if i < extra else 0)
+        plan.append(cpus[start:start + size])
+        start += size
+    return plan
+
+def _serve_worker(index, uvicorn_config, sockets, cpus, threads):
+    """Worker process entry point"""
+    # Thread pools read these when torch is first imported
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    
+    print(f"Worker {index} (pid {os.getpid()}): CPUs {cpus}, {threads} threads")
+    uvicorn.Server(config=uvicorn_config).run(sockets=sockets)
+
+def run_workers(workers, host, port, threads_per_worker=0, allow_per_worker_state=False):
+    """Bind once, then spawn pinned uvicorn workers that accept on the shared socket"""
+    if workers > 1 and not allow_per_worker_state:
+        raise ValueError("History, summaries and similar cases are kept per process; "
+                         "run one worker or pass allow_per_worker_state=True")
+    
+    uvicorn_config = uvicorn.Config("backend.main:app", host=host, port=port)
+    sock = uvicorn_config.bind_socket()
+    
+    plan = plan_cpu_affinity(workers)
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    
+    for index, cpus in enumerate(plan):
+        threads = threads_per_worker or len(cpus)
+        process = context.Process(
+            target=_serve_worker,
+            args=(index, uvicorn_config, [sock], cpus, threads),
+            name=f"eyesense-worker-{index}"
+        )
+        process.start()
+        processes.append(process)
+    
+    def shutdown(signum, frame):
+        for process in processes:
+            process.terminate()
+    
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    
+    for process in processes:
+        process.join()
+    sock.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run EyeSense API workers")
+    parser.add_argument("--workers", type=int, default=config.API_WORKERS)
+    parser.add_argument("--threads", type=int, default=config.WORKER_THREADS,
+                        help="Torch threads per worker (0 = size of its CPU slice)")
+    parser.add_argument("--host", default=config.API_HOST)
+    parser.add_argument("--port", type=int, default=config.API_PORT)
+    parser.add_argument("--allow-per-worker-state", action="store_true",
+                        help="Run several workers even though each keeps its own history, "
+                             "summaries and similar-case index")
+    args = parser.parse_args()
+    
+    if args.workers > 1 and not args.allow_per_worker_state:
+        parser.error("the stateful endpoints (user history/summary, similar cases) are per process; "
+                     "use --workers 1 or pass --allow-per-worker-state")
+    
+    print(f"🚀 Starting {args.workers} EyeSense workers on http://{args.host}:{args.port}")
+    run_workers(args.workers, args.host, args.port, args.threads, args.allow_per_worker_state)
@@ -8,7 +8,34 @@ import io
 import time
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import base64
+import os
+import sys
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frontend.utils import get_upload_settings, prepare_upload_image, fetch_user_summary, get_trend_emoji
+
+@st.cache_resource
+def load_served_model():
+    """Load the served model once per Streamlit process (in-process mode)
+    
+    Like the API this is the registry's current version when there is one,
+    otherwise the configured model or the demo predictor.
+    """
+    from backend.serving import ServedModel
+    return ServedModel()
+
+def load_local_predictor():
+    """The in-process (predictor, model version), following registry promotions like the API does"""
+    served = load_served_model()
+    try:
+        served.check_for_update()
+    except Exception as e:
+        st.warning(f"Could not load the new model version, still using {served.version}: {e}")
+    return served.current()
 
 # Page configuration
 st.set_page_config(
@@ -385,6 +412,12 @@ st.markdown("""
 class EyePressureDetector:
     def __init__(self):
         self.api_base = "http://127.0.0.1:8000"
+        self.upload_max_edge, self.upload_quality = get_upload_settings()
+        self.upload_concurrency = int(os.getenv("EYESENSE_UPLOAD_CONCURRENCY", "4"))
+        # "http" posts to the backend; "inprocess" runs the model inside Streamlit
+        self.inference_mode = os.getenv("EYESENSE_INFERENCE_MODE", "http").lower()
+        # Analyses are saved under this user and summarized by the backend
+        self.user_id = os.getenv("EYESENSE_USER_ID", "demo_user")
         
         # Initialize session state
         if 'show_camera' not in st.session_state:
@@ -398,40 +431,124 @@ class EyePressureDetector:
         
     def check_api_status(self):
         """Check if backend API is running"""
+        if self.inference_mode == "inprocess":
+            return True
         try:
             response = requests.get(f"{self.api_base}/api/health", timeout=5)
             return response.status_code == 200
         except:
             return False
     
+    def prepare_request(self, image_file):
+        """Encode an image for upload and build the request headers"""
+        # Convert to bytes if needed
+        if isinstance(image_file, Image.Image):
+            img_byte_arr = io.BytesIO()
+            image_file.save(img_byte_arr, format='JPEG')
+            img_byte_arr.seek(0)
+            file_data = img_byte_arr.getvalue()
+        else:
+            image_file.seek(0)
+            file_data = image_file.read()
+        
+        headers = {}
+        if self.upload_max_edge > 0:
+            # Shrink before posting; the model only ever sees 224x224
+            original = Image.open(io.BytesIO(file_data))
+            original_size = original.size
+            file_data, downscaled = prepare_upload_image(
+                original, self.upload_max_edge, self.upload_quality
+            )
+            if downscaled:
+                headers["X-Image-Downscaled"] = "true"
+                headers["X-Original-Size"] = f"{original_size[0]}x{original_size[1]}"
+        
+        return file_data, headers
+    
+    def submit_image(self, file_data, headers, session=requests):
+        """POST encoded image bytes to the backend (safe to call from worker threads)"""
+        files = {"file": ("image.jpg", file_data, "image/jpeg")}
+        response = session.post(
+            f"{self.api_base}/api/analyze-eye",
+            params={"user_id": self.user_id},
+            files=files,
+            headers=headers,
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def analyze_local(self, image_file, served=None):
+        """Run the backend analysis pipeline directly on the decoded image
+        
+        served is a (predictor, model version) pair, by default the current one.
+        """
+        from backend.analysis import analyze_image_array, image_to_array
+        
+        if isinstance(image_file, Image.Image):
+            image = image_file
+        else:
+            image_file.seek(0)
+            image = Image.open(image_file)
+        
+        predictor, model_version = served or load_local_predictor()
+        return analyze_image_array(image_to_array(image), predictor, model_version=model_version)
+    
     def analyze_image(self, image_file):
         """Send image to backend for analysis"""
         try:
-            # Convert to bytes if needed
-            if isinstance(image_file, Image.Image):
-                img_byte_arr = io.BytesIO()
-                image_file.save(img_byte_arr, format='JPEG')
-                img_byte_arr.seek(0)
-                file_data = img_byte_arr.getvalue()
-            else:
-                image_file.seek(0)
-                file_data = image_file.read()
-            
-            files = {"file": ("image.jpg", file_data, "image/jpeg")}
-            response = requests.post(
-                f"{self.api_base}/api/analyze-eye",
-                files=files,
-                timeout=30
-            )
+            if self.inference_mode == "inprocess":
+                return self.analyze_local(image_file)
             
-            if response.status_code == 200:
-                return response.json()
-            else:
-                st.error(f"API Error: Status {response.status_code}")
-                return None
+            file_data, headers = self.prepare_request(image_file)
+            return self.submit_image(file_data, headers)
+        except requests.HTTPError as e:
+            st.error(f"API Error: Status {e.response.status_code}")
+            return None
         except Exception as e:
             st.error(f"Connection failed: {str(e)}")
             return None
+    
+    def analyze_batch(self, image_files, on_result=None):
+        """Analyze many images with at most upload_concurrency requests in flight
+        
+        on_result(index, result, error) is called on the script thread as each
+        upload completes, so callers can update the page progressively.
+        """
+        results = [None] * len(image_files)
+        # Resolve the cached predictor on the script thread, not in the workers
+        served = load_local_predictor() if self.inference_mode == "inprocess" else None
+        
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.upload_concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            
+            with ThreadPoolExecutor(max_workers=self.upload_concurrency) as executor:
+                def upload(image_file):
+                    if served is not None:
+                        return self.analyze_local(image_file, served)
+                    
+                    # Encoding happens in the workers too, so downscaling overlaps with uploads
+                    file_data, headers = self.prepare_request(image_file)
+                    return self.submit_image(file_data, headers, session=session)
+                
+                futures = {
+                    executor.submit(upload, image_file): index
+                    for index, image_file in enumerate(image_files)
+                }
+                
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        results[index] = future.result()
+                        error = None
+                    except Exception as e:
+                        error = str(e)
+                    if on_result:
+                        on_result(index, results[index], error)
+        
+        return results
 
     def generate_text_report(self, result):
         """Generate a detailed text report"""
@@ -581,6 +698,20 @@ End of Report
             </div>
             """, unsafe_allow_html=True)
             
+            batch_mode = st.toggle("Batch mode (screen several images at once)", key="batch_mode")
+            
+            if batch_mode:
+                uploaded_files = st.file_uploader(
+                    "Choose fundus images",
+                    type=['png', 'jpg', 'jpeg'],
+                    accept_multiple_files=True,
+                    label_visibility="collapsed",
+                    key="batch_file_uploader"
+                )
+                if uploaded_files:
+                    self.process_batch(uploaded_files)
+                return
+            
             uploaded_file = st.file_uploader(
                 "Choose a fundus image",
                 type=['png', 'jpg', 'jpeg'],
@@ -602,6 +733,57 @@ End of Report
                 </div>
                 """, unsafe_allow_html=True)
     
+    def process_batch(self, image_files):
+        """Analyze a queue of uploaded images and fill in a results table as they finish"""
+        st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
+        st.write(f"**{len(image_files)} images queued**")
+        
+        if not self.check_api_status():
+            st.error("🔴 **Analysis Service Unavailable** - start the backend on http://127.0.0.1:8000")
+            return
+        
+        if not st.button(f" Analyze {len(image_files)} Images", type="primary",
+                         use_container_width=True, key="analyze_btn_batch"):
+            return
+        
+        rows = [
+            {'File': f.name, 'Status': 'Queued', 'Risk Level': '', 'Confidence': '', 'Quality': ''}
+            for f in image_files
+        ]
+        progress_bar = st.progress(0)
+        table = st.empty()
+        table.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        completed = 0
+        
+        def on_result(index, result, error):
+            nonlocal completed
+            completed += 1
+            if error or not result:
+                rows[index]['Status'] = f"Failed: {error}"
+            else:
+                analysis = result['analysis_result']
+                rows[index].update({
+                    'Status': 'Done',
+                    'Risk Level': analysis.get('risk_level', 'Unknown'),
+                    'Confidence': f"{analysis.get('confidence', 0):.1%}",
+                    'Quality': f"{result.get('quality_assessment', {}).get('quality_score', 0):.2f}"
+                })
+            progress_bar.progress(completed / len(rows))
+            table.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        
+        start = time.time()
+        self.analyze_batch(image_files, on_result=on_result)
+        st.success(f"Analyzed {len(rows)} images in {time.time() - start:.1f}s")
+        
+        st.download_button(
+            label=" Download Results CSV",
+            data=pd.DataFrame(rows).to_csv(index=False),
+            file_name=f"glaucoma_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv",
+            use_container_width=True,
+            key="download_batch_csv"
+        )
+    
     def process_analysis(self, image_file, source):
         """Process the uploaded image"""
         image = Image.open(image_file)
@@ -901,6 +1083,8 @@ End of Report
             -  **Important:** This is a screening tool, not a diagnosis
             """)
         
+        self.display_user_summary()
+        
         # Medical Disclaimer
         st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
         st.markdown("""
@@ -921,6 +1105,24 @@ End of Report
         </div>
         """, unsafe_allow_html=True)
 
+    def display_user_summary(self):
+        """Show the backend's running risk summary for this user (HTTP mode only)"""
+        if self.inference_mode == "inprocess":
+            return
+        summary = fetch_user_summary(self.user_id, api_base=self.api_base)
+        if not summary or summary['analysis_count'] == 0:
+            return
+        
+        st.markdown('<div class="section-divider"></div>', unsafe_allow_html=True)
+        st.markdown(" Your Risk Trend")
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Analyses", summary['analysis_count'])
+        col2.metric("Recent risk score", f"{summary['ewma_risk_score']:.2f}",
+                    delta=f"{summary['ewma_risk_score'] - summary['mean_risk_score']:+.2f}",
+                    delta_color="inverse")
+        col3.metric("Trend", f"{get_trend_emoji(summary['trend'])} {summary['trend'].title()}")
+        st.caption("Risk score runs from 0 (Normal) to 2 (High); the change is relative to your long-run average.")
+
 def main():
     app = EyePressureDetector()
     app.run()
@@ -2,12 +2,43 @@ import streamlit as st
 import requests
 import json
 from datetime import datetime
+from PIL import Image
+import io
 import os
 
 def get_api_base():
     """Get API base URL from environment or use default"""
     return os.getenv("EYESENSE_API_BASE", "http://localhost:8000")
 
+def get_upload_settings():
+    """Get client-side downscale settings (max edge 0 disables downscaling)"""
+    max_edge = int(os.getenv("EYESENSE_UPLOAD_MAX_EDGE", "0"))
+    quality = int(os.getenv("EYESENSE_UPLOAD_QUALITY", "90"))
+    return max_edge, quality
+
+def prepare_upload_image(image, max_edge, quality=90):
+    """Downscale a PIL image to max_edge and re-encode it as JPEG for upload
+    
+    Returns the encoded bytes and whether the image was actually downscaled.
+    """
+    original_size = image.size
+    
+    if image.format == 'JPEG':
+        # Decode at a reduced DCT scale instead of full resolution
+        image.draft('RGB', (max_edge, max_edge))
+    
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    if max(image.size) > max_edge:
+        image = image.copy()
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    
+    img_byte_arr = io.BytesIO()
+    image.save(img_byte_arr, format='JPEG', quality=quality)
+    
+    return img_byte_arr.getvalue(), image.size != original_size
+
 def validate_image_file(file):
     """Validate uploaded image file"""
     allowed_types = ['image/jpeg', 'image/jpg', 'image/png']
@@ -76,6 +107,16 @@ def calculate_risk_trend(history_data):
     else:
         return "stable"
 
+def fetch_user_summary(user_id, api_base=None):
+    """Fetch the backend's precomputed risk summary instead of the full history"""
+    try:
+        response = requests.get(f"{api_base or get_api_base()}/api/user-summary/{user_id}", timeout=5)
+        if response.status_code == 200:
+            return response.json()
+    except requests.RequestException:
+        pass
+    return None
+
 def get_trend_emoji(trend):
     """Get emoji for trend"""
     emojis = {
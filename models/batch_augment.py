@@ -0,0 +1,89 @@
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+class BatchAugment(nn.Module):
+    """Vectorized minibatch version of the per-sample training augmentations
+    
+    Mirrors the albumentations pipeline in create_data_loaders
+    (HorizontalFlip, RandomBrightnessContrast, Rotate, Normalize) but runs on
+    a whole collated batch at once, after it has been moved to the device.
+    Accepts uint8 batches (0-255) or float batches in [0, 1], NCHW or NHWC.
+    
+    In eval mode only the dtype conversion and normalization are applied, so
+    the same module also prepares validation batches.
+    """
+    
+    def __init__(self, flip_p=0.5, brightness_contrast_p=0.2, brightness_limit=0.2,
+                 contrast_limit=0.2, rotate_p=0.3, rotate_limit=15,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), seed=None):
+        super(BatchAugment, self).__init__()
+        self.flip_p = flip_p
+        self.brightness_contrast_p = brightness_contrast_p
+        self.brightness_limit = brightness_limit
+        self.contrast_limit = contrast_limit
+        self.rotate_p = rotate_p
+        self.rotate_limit = rotate_limit
+        
+        self.register_buffer('mean', torch.tensor(mean).view(1, 3, 1, 1))
+        self.register_buffer('std', torch.tensor(std).view(1, 3, 1, 1))
+        
+        # Random draws happen on the CPU generator so runs repeat on any device
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed)
+    
+    def _uniform(self, n, low, high):
+        return torch.rand(n, generator=self.generator) * (high - low) + low
+    
+    def _mask(self, n, p):
+        return torch.rand(n, generator=self.generator) < p
+    
+    def forward(self, images):
+        if images.dim() == 4 and images.shape[-1] == 3 and images.shape[1] != 3:
+            images = images.permute(0, 3, 1, 2)
+        
+        if images.dtype == torch.uint8:
+            images = images.float().div_(255.0)
+        else:
+            images = images.float()
+        
+        if self.training:
+            images = self._augment(images)
+        
+        return (images - self.mean) / self.std
+    
+    def _augment(self, images):
+        n = images.shape[0]
+        device = images.device
+        
+        # Horizontal flip
+        flip = self._mask(n, self.flip_p).to(device)
+        images = torch.where(flip.view(n, 1, 1, 1), images.flip(-1), images)
+        
+        # Brightness/contrast: x * (1 + contrast) + brightness, as albumentations does
+        jitter = self._mask(n, self.brightness_contrast_p)
+        alpha = torch.where(jitter, 1 + self._uniform(n, -self.contrast_limit, self.contrast_limit), torch.ones(n))
+        beta = torch.where(jitter, self._uniform(n, -self.brightness_limit, self.brightness_limit), torch.zeros(n))
+        images = (images * alpha.to(device).view(n, 1, 1, 1) + beta.to(device).view(n, 1, 1, 1)).clamp_(0, 1)
+        
+        # Rotation through one batched affine grid, only for the selected samples
+        rotate = self._mask(n, self.rotate_p)
+        angles = self._uniform(n, -self.rotate_limit, self.rotate_limit)
+        if rotate.any():
+            index = rotate.nonzero().squeeze(1)
+            radians = angles[index] * math.pi / 180
+            cos, sin = torch.cos(radians), torch.sin(radians)
+            theta = torch.zeros(len(index), 2, 3)
+            theta[:, 0, 0], theta[:, 0, 1] = cos, -sin
+            theta[:, 1, 0], theta[:, 1, 1] = sin, cos
+            
+            index = index.to(device)
+            selected = images.index_select(0, index)
+            grid = F.affine_grid(theta.to(device, selected.dtype), selected.shape, align_corners=False)
+            rotated = F.grid_sample(selected, grid, mode='bilinear',
+                                    padding_mode='reflection', align_corners=False)
+            images = images.index_copy(0, index, rotated)
+        
+        return images
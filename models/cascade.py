@@ -0,0 +1,93 @@
+import threading
+import time
+
+class CascadePredictor:
+    """Two-stage predictor: a cheap screener answers when it is confident,
+    the full model only sees the images the screener is unsure about
+    
+    Both stages expose the GlaucomaRiskPredictor interface, so the screener
+    can be a small backbone or the full model at a lower input resolution.
+    Results carry a 'stage' key naming the stage that answered.
+    """
+    
+    def __init__(self, screener, full_model, threshold=0.9):
+        self.screener = screener
+        self.full_model = full_model
+        self.threshold = threshold
+        self.classes = full_model.classes
+        
+        # Counters are updated from concurrent request threads
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._escalations = 0
+        self._screener_seconds = 0.0
+        self._full_seconds = 0.0
+        self._embed_seconds = 0.0  # extra runs for similar-case queries
+    
+    def predict(self, image, tta=None):
+        """Predict glaucoma risk, escalating to the full model below the confidence threshold"""
+        start = time.perf_counter()
+        result = self.screener.predict(image, tta=tta)
+        screener_seconds = time.perf_counter() - start
+        
+        escalate = 'error' in result or result['confidence'] < self.threshold
+        full_seconds = 0.0
+        if escalate:
+            start = time.perf_counter()
+            result = self.full_model.predict(image, tta=tta)
+            full_seconds = time.perf_counter() - start
+        
+        with self._lock:
+            self._requests += 1
+            self._escalations += int(escalate)
+            self._screener_seconds += screener_seconds
+            self._full_seconds += full_seconds
+        
+        return dict(result, stage='full' if escalate else 'screener')
+    
+    def embed(self, image, stage='full'):
+        """Embedding of image from one stage ('screener' or 'full')
+        
+        Predictions already carry the answering stage's embedding; this is the
+        extra run a similar-case query needs, counted against the saving in
+        metrics().
+        """
+        model = self.screener if stage == 'screener' else self.full_model
+        start = time.perf_counter()
+        embedding = model.predict(image, tta=False).get('embedding')
+        with self._lock:
+            self._embed_seconds += time.perf_counter() - start
+        return embedding
+    
+    def analyze_image_quality(self, image):
+        """Image quality is stage-independent"""
+        return self.full_model.analyze_image_quality(image)
+    
+    def metrics(self):
+        """Escalation rate and the latency saved compared to always running the full model
+        
+        The saving is estimated from the mean measured full-model latency, so
+        it is None until at least one image has been escalated. Time spent in
+        embed() is work the cascade added and is subtracted from it.
+        """
+        with self._lock:
+            requests, escalations = self._requests, self._escalations
+            screener_seconds, full_seconds = self._screener_seconds, self._full_seconds
+            embed_seconds = self._embed_seconds
+        
+        mean_full = full_seconds / escalations if escalations else None
+        saved = None
+        if mean_full is not None:
+            saved = requests * mean_full - (screener_seconds + full_seconds + embed_seconds)
+        
+        return {
+            'threshold': self.threshold,
+            'requests': requests,
+            'escalations': escalations,
+            'escalation_rate': escalations / requests if requests else 0.0,
+            'mean_screener_ms': 1000 * screener_seconds / requests if requests else None,
+            'mean_full_ms': 1000 * mean_full if mean_full is not None else None,
+            'embed_ms': 1000 * embed_seconds,
+            'latency_saved_ms': 1000 * saved if saved is not None else None,
+            'mean_latency_saved_ms': 1000 * saved / requests if saved is not None else None
+        }
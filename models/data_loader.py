@@ -3,6 +3,7 @@ import kaggle
 import zipfile
 import torch
 from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.distributed import DistributedSampler
 import cv2
 import pandas as pd
 from sklearn.model_selection import train_test_split
@@ -10,8 +11,17 @@ import albumentations as A
 from albumentations.pytorch import ToTensorV2
 import numpy as np
 from PIL import Image
-import glob
 import random
+import sys
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.dataset_cache import build_dataset_cache, load_cache_manifest, CachedEyeDataset
+from models.dataset_manifest import build_manifest
+from models.zip_dataset import index_zip_dataset, ZipEyeDataset
+from models.synthetic import write_synthetic_dataset
+from models.roi import crop_optic_disc
 
 class EyeDataset(Dataset):
     def __init__(self, image_paths, labels, transform=None):
@@ -19,7 +29,7 @@ class EyeDataset(Dataset):
         self.labels = labels
         self.transform = transform
         self.class_names = ['Normal', 'Glaucoma', 'Other']
-        
+    
     def __len__(self):
         return len(self.image_paths)
     
@@ -32,14 +42,14 @@ class EyeDataset(Dataset):
             image = cv2.imread(image_path)
             if image is None:
                 raise ValueError(f"Could not load image: {image_path}")
-                
+            
             image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             
             if self.transform:
                 image = self.transform(image=image)['image']
-                
-            return image, label
             
+            return image, label
+        
         except Exception as e:
             print(f"Error loading image {image_path}: {e}")
             # Return a dummy image if loading fails
@@ -48,8 +58,69 @@ class EyeDataset(Dataset):
                 dummy_image = self.transform(image=dummy_image)['image']
             return dummy_image, label
 
-def download_kaggle_dataset():
-    """Download the Ocular Disease Recognition dataset from Kaggle"""
+# Loader profiles control how decoding and augmentation are parallelized.
+# num_workers=None means one worker per spare CPU core.
+LOADER_PROFILES = {
+    'serial': {
+        'num_workers': 0,
+        'prefetch_factor': None,
+        'persistent_workers': False,
+        'pin_memory': False
+    },
+    'parallel': {
+        'num_workers': None,
+        'prefetch_factor': 4,
+        'persistent_workers': True,
+        'pin_memory': torch.cuda.is_available()
+    }
+}
+
+def get_loader_profile(profile='serial'):
+    """Resolve a profile name or dict into DataLoader keyword arguments"""
+    if profile == 'auto':
+        profile = 'parallel' if (os.cpu_count() or 1) > 1 else 'serial'
+    
+    if isinstance(profile, str):
+        if profile not in LOADER_PROFILES:
+            raise ValueError(f"Unknown loader profile: {profile}")
+        settings = dict(LOADER_PROFILES[profile])
+    else:
+        settings = dict(LOADER_PROFILES['serial'], **profile)
+    
+    if settings['num_workers'] is None:
+        settings['num_workers'] = max(1, (os.cpu_count() or 1) - 1)
+    
+    # Prefetching and persistence only apply to worker processes
+    if settings['num_workers'] == 0:
+        settings['prefetch_factor'] = None
+        settings['persistent_workers'] = False
+    
+    return settings
+
+def seed_worker(worker_id):
+    """Seed the augmentation RNGs of a loader worker
+    
+    torch gives each worker base_seed + worker_id, and the base seed comes
+    from the loader's generator, so augmentations repeat for a fixed seed.
+    """
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+    
+    # Newer albumentations releases keep their own generator per pipeline
+    transform = getattr(torch.utils.data.get_worker_info().dataset, 'transform', None)
+    if hasattr(transform, 'set_random_seed'):
+        transform.set_random_seed(worker_seed)
+
+# Archive name the Kaggle API saves the dataset under when not unzipping
+ODIR_ARCHIVE = "data/raw/ocular-disease-recognition-odir5k.zip"
+
+def download_kaggle_dataset(unzip=True):
+    """Download the Ocular Disease Recognition dataset from Kaggle
+    
+    With unzip=False the archive is kept as ODIR_ARCHIVE; pass that path as
+    data_path to create_data_loaders to train from it without extracting.
+    """
     dataset_name = "andrewmvd/ocular-disease-recognition-odir5k"
     download_path = "data/raw"
     
@@ -57,7 +128,7 @@ def download_kaggle_dataset():
     
     try:
         print("Downloading dataset from Kaggle...")
-        kaggle.api.dataset_download_files(dataset_name, path=download_path, unzip=True)
+        kaggle.api.dataset_download_files(dataset_name, path=download_path, unzip=unzip)
         print("Dataset downloaded successfully!")
         return True
     except Exception as e:
@@ -66,64 +137,68 @@ def download_kaggle_dataset():
         print("https://www.kaggle.com/datasets/andrewmvd/ocular-disease-recognition-odir5k")
         return False
 
-def create_synthetic_samples():
-    """Create synthetic eye images for demonstration"""
+def create_synthetic_samples(count=150, seed=0):
+    """Create synthetic fundus images for demonstration (see models.synthetic)"""
     print("Creating synthetic samples for prototype...")
-    os.makedirs('data/raw/synthetic', exist_ok=True)
-    
-    # Create different colored circles to simulate eyes
-    for i in range(50):
-        # Normal (greenish)
-        img = np.zeros((224, 224, 3), dtype=np.uint8)
-        cv2.circle(img, (112, 112), 50, (0, 100, 0), -1)
-        cv2.imwrite(f'data/raw/synthetic/normal_{i}.jpg', img)
-        
-        # Glaucoma (reddish)
-        img = np.zeros((224, 224, 3), dtype=np.uint8)
-        cv2.circle(img, (112, 112), 50, (0, 0, 150), -1)
-        cv2.imwrite(f'data/raw/synthetic/glaucoma_{i}.jpg', img)
-        
-        # Other (yellowish)
-        img = np.zeros((224, 224, 3), dtype=np.uint8)
-        cv2.circle(img, (112, 112), 50, (0, 150, 150), -1)
-        cv2.imwrite(f'data/raw/synthetic/other_{i}.jpg', img)
+    write_synthetic_dataset('data/raw/synthetic', count, seed=seed, sizes='model')
 
 def prepare_eye_dataset(data_path="data/raw"):
-    """Prepare the eye dataset for training with glaucoma focus"""
+    """Prepare the eye dataset for training with glaucoma focus
+    
+    Images and labels come from the cached manifest of data_path
+    (see models.dataset_manifest.build_manifest).
+    """
+    
+    manifest = build_manifest(data_path) if os.path.isdir(data_path) else None
     
     # If dataset doesn't exist, create synthetic data
-    if not os.path.exists(data_path) or len(glob.glob(os.path.join(data_path, "*.jpg"))) == 0:
+    if manifest is None or len(manifest['paths']) == 0:
         print("No dataset found. Creating synthetic data for demonstration...")
         create_synthetic_samples()
-        data_path = "data/raw/synthetic"
+        manifest = build_manifest("data/raw/synthetic")
     
-    images = []
-    labels = []
-    
-    # Map filenames to labels
-    for image_path in glob.glob(os.path.join(data_path, "**", "*.jpg"), recursive=True):
-        filename = os.path.basename(image_path).lower()
-        
-        if 'normal' in filename:
-            label = 0
-        elif 'glaucoma' in filename:
-            label = 1
-        else:
-            label = 2  # Other
-            
-        images.append(image_path)
-        labels.append(label)
+    images = manifest['paths'].tolist()
+    labels = manifest['labels'].tolist()
     
     print(f"Found {len(images)} images")
     print(f"Class distribution: Normal: {labels.count(0)}, Glaucoma: {labels.count(1)}, Other: {labels.count(2)}")
     
     return images, labels, ['Normal', 'Glaucoma', 'Other']
 
-def create_data_loaders(batch_size=32, data_path="data/raw"):
-    """Create data loaders for training and validation"""
+def create_data_loaders(batch_size=32, data_path="data/raw", profile='serial', seed=42,
+                        cache_dir=None, augment='sample', rank=0, world_size=1, roi_crop=False,
+                        build_cache=True):
+    """Create data loaders for training and validation
+    
+    profile is a LOADER_PROFILES name, 'auto', or a dict overriding the
+    serial profile (num_workers, prefetch_factor, persistent_workers, pin_memory).
+    The default is serial; 'parallel'/'auto' start loader processes and are
+    meant for training scripts that own the machine.
+    With cache_dir, images are decoded and resized once into a memory-mapped
+    cache (refreshed incrementally) and only augmentations run per epoch.
+    With build_cache=False the cache is only read, e.g. on ranks other than
+    the one that built it.
+    With augment='batch', loaders yield uint8 tensors and augmentation plus
+    normalization are left to a models.batch_augment.BatchAugment stage.
+    With world_size > 1, each rank gets its own shard of both splits through
+    a DistributedSampler (call train_loader.sampler.set_epoch every epoch).
+    A data_path ending in .zip is read directly from the archive.
+    With roi_crop, full-resolution images are cropped to the optic disc
+    before resizing (not combinable with cache_dir).
+    """
+    
+    from_archive = data_path.lower().endswith('.zip')
+    if from_archive and cache_dir:
+        raise ValueError("cache_dir is not supported when reading from a zip archive")
+    if roi_crop and cache_dir:
+        # Serving crops the full-resolution image; cached images are already downsampled
+        raise ValueError("roi_crop is not supported with cache_dir")
     
     # Get images and labels
-    images, labels, class_names = prepare_eye_dataset(data_path)
+    if from_archive:
+        images, labels, class_names = index_zip_dataset(data_path)
+    else:
+        images, labels, class_names = prepare_eye_dataset(data_path)
     
     if len(images) == 0:
         raise ValueError("No images found in dataset!")
@@ -133,9 +208,12 @@ def create_data_loaders(batch_size=32, data_path="data/raw"):
         images, labels, test_size=0.2, random_state=42, stratify=labels
     )
     
-    # Data transformations
-    train_transform = A.Compose([
-        A.Resize(224, 224),
+    # Data transformations (cached images are already resized)
+    resize = [] if cache_dir else [A.Resize(224, 224)]
+    if roi_crop:
+        resize = [A.Lambda(image=crop_optic_disc)] + resize
+    
+    train_transform = A.Compose(resize + [
         A.HorizontalFlip(p=0.5),
         A.RandomBrightnessContrast(p=0.2),
         A.Rotate(limit=15, p=0.3),
@@ -143,19 +221,60 @@ def create_data_loaders(batch_size=32, data_path="data/raw"):
         ToTensorV2(),
     ])
     
-    val_transform = A.Compose([
-        A.Resize(224, 224),
+    val_transform = A.Compose(resize + [
         A.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
         ToTensorV2(),
     ])
     
+    if augment == 'batch':
+        # Keep samples as uint8 CHW; BatchAugment works on whole batches
+        train_transform = val_transform = A.Compose(resize + [ToTensorV2()])
+    
     # Create datasets
-    train_dataset = EyeDataset(train_images, train_labels, transform=train_transform)
-    val_dataset = EyeDataset(val_images, val_labels, transform=val_transform)
+    if cache_dir:
+        if build_cache:
+            manifest = build_dataset_cache(images, labels, cache_dir=cache_dir, image_size=224)
+        else:
+            manifest = load_cache_manifest(cache_dir)
+            if manifest is None:
+                raise ValueError(f"No dataset cache found in {cache_dir}")
+        if manifest.get('failed'):
+            # Unreadable images are left out instead of stopping training
+            print(f"Warning: skipping {len(manifest['failed'])} images that could not be decoded")
+            train_images = [path for path in train_images if os.path.abspath(path) not in manifest['failed']]
+            val_images = [path for path in val_images if os.path.abspath(path) not in manifest['failed']]
+        train_dataset = CachedEyeDataset(cache_dir, train_images, transform=train_transform)
+        val_dataset = CachedEyeDataset(cache_dir, val_images, transform=val_transform)
+    elif from_archive:
+        train_dataset = ZipEyeDataset(data_path, train_images, train_labels, transform=train_transform)
+        val_dataset = ZipEyeDataset(data_path, val_images, val_labels, transform=val_transform)
+    else:
+        train_dataset = EyeDataset(train_images, train_labels, transform=train_transform)
+        val_dataset = EyeDataset(val_images, val_labels, transform=val_transform)
     
     # Create data loaders
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False)
+    loader_settings = get_loader_profile(profile)
+    if loader_settings['num_workers'] > 0:
+        loader_settings['worker_init_fn'] = seed_worker
+    
+    if world_size > 1:
+        train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank,
+                                           shuffle=True, seed=seed)
+        val_sampler = DistributedSampler(val_dataset, num_replicas=world_size, rank=rank,
+                                         shuffle=False)
+    else:
+        train_sampler = val_sampler = None
+    
+    train_loader = DataLoader(
+        train_dataset, batch_size=batch_size, shuffle=train_sampler is None,
+        sampler=train_sampler, generator=torch.Generator().manual_seed(seed), **loader_settings
+    )
+    # Validation workers only live while validating, so they do not sit alongside the training workers
+    val_settings = dict(loader_settings, persistent_workers=False)
+    val_loader = DataLoader(
+        val_dataset, batch_size=batch_size, shuffle=False, sampler=val_sampler,
+        generator=torch.Generator().manual_seed(seed), **val_settings
+    )
     
     return train_loader, val_loader, class_names
 
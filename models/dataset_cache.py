@@ -0,0 +1,198 @@
+import os
+import json
+import torch
+from torch.utils.data import Dataset
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST_NAME = "manifest.json"
+INDEX_NAME = "index.npz"
+
+def load_cache_manifest(cache_dir):
+    """Load the cache manifest, or None if none exists"""
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+def _decode_resized(image_path, image_size):
+    """Decode an image to RGB and resize it to the cache resolution"""
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not load image: {image_path}")
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_AREA)
+
+def build_dataset_cache(image_paths, labels, cache_dir="data/processed/cache", image_size=224,
+                        workers=None, rebuild=False):
+    """Decode and resize a dataset once into uint8 memory-mapped shards
+
+    Each build writes only new or modified images (by mtime and size) into a
+    new shard; unchanged images keep their existing rows. Images no longer
+    listed are dropped from the manifest. Images that fail to decode are
+    recorded under 'failed' and not retried until their mtime or size
+    changes. Pass rebuild=True to start over and reclaim space held by
+    dropped rows.
+
+    Returns the manifest dict that is also written to cache_dir.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    manifest = None if rebuild else load_cache_manifest(cache_dir)
+    if manifest is None or manifest['image_size'] != image_size:
+        manifest = {'image_size': image_size, 'shards': [], 'entries': {}}
+    previous = (manifest['entries'], manifest.get('failed'))
+    known_failures = manifest.get('failed', {})
+
+    entries = {}
+    failed = {}
+    pending = []
+    for image_path, label in zip(image_paths, labels):
+        key = os.path.abspath(image_path)
+        stat = os.stat(image_path)
+        entry = manifest['entries'].get(key)
+        failure = known_failures.get(key)
+
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            entries[key] = dict(entry, label=int(label))
+        elif failure and failure['mtime'] == stat.st_mtime and failure['size'] == stat.st_size:
+            failed[key] = failure
+        else:
+            pending.append((key, int(label), stat))
+
+    if pending:
+        print(f"Caching {len(pending)} new or modified images "
+              f"({len(entries)} already cached)...")
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            # cv2 releases the GIL while decoding, so threads scale across cores
+            futures = [executor.submit(_decode_resized, key, image_size) for key, _, _ in pending]
+
+            shard_index = len(manifest['shards'])
+            shard_file = f"shard_{shard_index:03d}.npy"
+            shard = np.lib.format.open_memmap(
+                os.path.join(cache_dir, shard_file), mode='w+', dtype=np.uint8,
+                shape=(len(pending), image_size, image_size, 3)
+            )
+            
+            row = 0
+            for (key, label, stat), future in zip(pending, futures):
+                try:
+                    shard[row] = future.result()
+                except Exception as e:
+                    print(f"Error caching image {key}: {e}")
+                    failed[key] = {'mtime': stat.st_mtime, 'size': stat.st_size}
+                    continue
+
+                entries[key] = {
+                    'shard': shard_index,
+                    'row': row,
+                    'label': label,
+                    'mtime': stat.st_mtime,
+                    'size': stat.st_size
+                }
+                row += 1
+
+            shard.flush()
+            del shard
+            if row:
+                manifest['shards'].append({'file': shard_file, 'count': row})
+            else:
+                os.remove(os.path.join(cache_dir, shard_file))
+
+    manifest['entries'] = entries
+    manifest['failed'] = failed
+
+    index_path = os.path.join(cache_dir, INDEX_NAME)
+    if (entries, failed) == previous and os.path.exists(index_path):
+        # Nothing changed; leave the files other readers may have open alone
+        return manifest
+
+    # Compact lookup arrays (path, shard, row, label) for fast dataset startup,
+    # written through a temporary file so concurrent readers never see a partial index
+    keys = sorted(entries)
+    with open(index_path + '.tmp', 'wb') as f:
+        np.savez(
+            f,
+            paths=np.array(keys, dtype=str),
+            shards=np.array([entries[key]['shard'] for key in keys], dtype=np.int64),
+            rows=np.array([entries[key]['row'] for key in keys], dtype=np.int64),
+            labels=np.array([entries[key]['label'] for key in keys], dtype=np.int64)
+        )
+    os.replace(index_path + '.tmp', index_path)
+
+    # Write the manifest last and atomically so readers never see a partial build
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    return manifest
+
+class CachedEyeDataset(Dataset):
+    """EyeDataset equivalent that reads pre-resized images from the memmap cache
+
+    Only the (random) augmentations run per sample; decoding and resizing
+    were paid once by build_dataset_cache.
+    """
+
+    def __init__(self, cache_dir, image_paths=None, transform=None):
+        self.cache_dir = cache_dir
+        self.transform = transform
+        self.class_names = ['Normal', 'Glaucoma', 'Other']
+
+        manifest = load_cache_manifest(cache_dir)
+        if manifest is None:
+            raise ValueError(f"No dataset cache found in {cache_dir}")
+        self.shard_files = [shard['file'] for shard in manifest['shards']]
+
+        index = np.load(os.path.join(cache_dir, INDEX_NAME))
+        if image_paths is None:
+            positions = np.arange(len(index['paths']))
+        else:
+            keys = np.array([os.path.abspath(path) for path in image_paths], dtype=str)
+            positions = np.searchsorted(index['paths'], keys)
+            positions = np.minimum(positions, len(index['paths']) - 1)
+            missing = keys[index['paths'][positions] != keys]
+            if len(missing):
+                raise ValueError(f"{len(missing)} images are not cached, e.g. {missing[0]}")
+
+        self.image_paths = index['paths'][positions].tolist()
+        self.shard_ids = index['shards'][positions]
+        self.rows = index['rows'][positions]
+        self.labels = index['labels'][positions].tolist()
+
+        # Opened lazily so each loader worker maps the shards itself
+        self._shards = None
+
+    def _open_shards(self):
+        self._shards = [
+            np.load(os.path.join(self.cache_dir, shard_file), mmap_mode='r')
+            for shard_file in self.shard_files
+        ]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        if self._shards is None:
+            self._open_shards()
+
+        # A read-only view into the page cache; no decode, no copy
+        image = self._shards[self.shard_ids[idx]][self.rows[idx]]
+        label = self.labels[idx]
+
+        if self.transform:
+            image = self.transform(image=image)['image']
+        else:
+            image = torch.from_numpy(np.ascontiguousarray(image).copy())
+
+        return image, label
+
+    def __getstate__(self):
+        # Don't ship open memmaps to worker processes
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
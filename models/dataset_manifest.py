@@ -0,0 +1,203 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# Under the repository root, not the working directory (EYESENSE_MANIFEST_DIR overrides it)
+MANIFEST_DIR = os.getenv("EYESENSE_MANIFEST_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "processed", "manifests")
+ANNOTATION_NAMES = ("full_df.csv",)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# ODIR diagnostic letters: N = normal, G = glaucoma, everything else is 'Other'
+ODIR_LABELS = {'N': 0, 'G': 1}
+
+def label_from_filename(image_path):
+    """Fallback label from a filename substring (synthetic samples, unannotated files)"""
+    filename = os.path.basename(image_path).lower()
+    if 'normal' in filename:
+        return 0
+    elif 'glaucoma' in filename:
+        return 1
+    return 2  # Other
+
+def load_odir_labels(annotations):
+    """Map image filename -> label from an ODIR annotation sheet (path or file object)
+    
+    Each row of full_df.csv describes one fundus image; its 'labels' column
+    holds the diagnostic letter, e.g. "['G']".
+    """
+    df = pd.read_csv(annotations, usecols=['filename', 'labels'])
+    letters = df['labels'].astype(str).str.strip("[]' \"")
+    return dict(zip(df['filename'], letters.map(lambda letter: ODIR_LABELS.get(letter, 2))))
+
+def select_annotated(paths, odir_labels):
+    """Keep the first path of each annotated filename (all paths without a sheet)
+    
+    ODIR ships the same images in several folders (preprocessed_images/,
+    Training Images/) and unlabelled Testing Images; the sheet keys images
+    by filename, so copies would leak across the train/val split and
+    unannotated files would only get a filename guess.
+    """
+    if not odir_labels:
+        return list(paths)
+    seen = set()
+    selected = []
+    for path in paths:
+        name = os.path.basename(path)
+        if name in odir_labels and name not in seen:
+            seen.add(name)
+            selected.append(path)
+    return selected
+
+def drop_duplicates(paths, keys):
+    """Keep the first path per content key (e.g. a hash), in the original order"""
+    seen = set()
+    unique = []
+    for path in paths:
+        if keys[path] not in seen:
+            seen.add(keys[path])
+            unique.append(path)
+    return unique
+
+def _scan(data_path):
+    """Walk data_path once, returning image stats, each directory's mtime and
+    the ODIR annotation sheet (or None)"""
+    files = {}
+    directories = {}
+    annotations = None
+    for root, _, names in os.walk(data_path):
+        directories[root] = os.stat(root).st_mtime
+        for name in names:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                files[path] = os.stat(path)
+            elif name in ANNOTATION_NAMES and annotations is None:
+                annotations = os.path.join(root, name)
+    return files, directories, annotations
+
+def _file_hash(path):
+    """Content hash of one file (hashlib releases the GIL on large buffers)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def default_manifest_path(data_path):
+    """Manifest location for a dataset directory, kept outside it so writing
+    the manifest does not touch the directory mtimes it tracks"""
+    key = hashlib.blake2b(os.path.abspath(data_path).encode(), digest_size=6).hexdigest()
+    return os.path.join(MANIFEST_DIR, f"manifest_{key}.npz")
+
+def _is_fresh(manifest, manifest_path):
+    """True when no directory, indexed image or the annotation sheet changed
+    since the manifest was built
+    
+    Adding, removing or renaming a file updates its directory's mtime; a
+    file rewritten in place only changes its own size and mtime, so every
+    indexed image is stat'ed too (no directory listing is needed).
+    """
+    own_directory = os.path.dirname(os.path.abspath(manifest_path))
+    for directory, mtime in zip(manifest['directories'], manifest['directory_mtimes']):
+        if os.path.abspath(directory) == own_directory:
+            continue
+        if not os.path.isdir(directory) or os.stat(directory).st_mtime != mtime:
+            return False
+    
+    for path, size, mtime in zip(manifest['paths'], manifest['sizes'], manifest['mtimes']):
+        try:
+            stat = os.stat(str(path))
+        except FileNotFoundError:
+            return False
+        if stat.st_size != size or stat.st_mtime != mtime:
+            return False
+    
+    annotations = str(manifest['annotations'])
+    if annotations:
+        return os.path.exists(annotations) and \
+            os.stat(annotations).st_mtime == float(manifest['annotations_mtime'])
+    return True
+
+def build_manifest(data_path="data/raw", manifest_path=None, workers=None, rebuild=False):
+    """Build or refresh the columnar image index of a dataset directory
+    
+    The index holds path, label, size, mtime and content hash per image and
+    is stored as an .npz under the repository's data/processed/manifests.
+    If no directory or indexed image under data_path changed, the stored
+    index is returned without walking the tree.
+    Otherwise only new or modified files (by size and mtime) are hashed.
+    Labels come from the ODIR annotation sheet when there is one, and then
+    only annotated images are indexed; without one they come from the
+    filename. Byte-identical copies are indexed once.
+    
+    Returns a dict of numpy arrays.
+    """
+    manifest_path = manifest_path or default_manifest_path(data_path)
+    
+    manifest = None
+    if not rebuild and os.path.exists(manifest_path):
+        with np.load(manifest_path) as stored:
+            manifest = {key: stored[key] for key in stored.files}
+        if _is_fresh(manifest, manifest_path):
+            return manifest
+    
+    files, directories, annotations = _scan(data_path)
+    
+    # Reuse hashes of unchanged files
+    known = {}
+    if manifest is not None:
+        # Dropped duplicates keep their hashes too, so they are not rehashed on every refresh
+        for prefix in ('', 'duplicate_'):
+            columns = [manifest.get(prefix + key, ()) for key in ('paths', 'sizes', 'mtimes', 'hashes')]
+            for path, size, mtime, digest in zip(*columns):
+                known[str(path)] = (int(size), float(mtime), str(digest))
+    
+    odir_labels = load_odir_labels(annotations) if annotations else {}
+    paths = select_annotated(sorted(files), odir_labels)
+    hashes = {}
+    pending = []
+    for path in paths:
+        stat = files[path]
+        cached = known.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            hashes[path] = cached[2]
+        else:
+            pending.append(path)
+    
+    if pending:
+        print(f"Indexing {len(pending)} new or modified images ({len(hashes)} unchanged)...")
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            hashes.update(zip(pending, executor.map(_file_hash, pending)))
+    
+    hashed = paths
+    paths = drop_duplicates(hashed, hashes)
+    duplicates = sorted(set(hashed) - set(paths))
+    if len(paths) < len(files):
+        print(f"Skipped {len(files) - len(paths)} unannotated or duplicate images")
+    labels = [odir_labels.get(os.path.basename(path), label_from_filename(path)) for path in paths]
+    
+    manifest = {
+        'paths': np.array(paths, dtype=str),
+        'labels': np.array(labels, dtype=np.int64),
+        'sizes': np.array([files[path].st_size for path in paths], dtype=np.int64),
+        'mtimes': np.array([files[path].st_mtime for path in paths], dtype=np.float64),
+        'hashes': np.array([hashes[path] for path in paths], dtype=str),
+        'duplicate_paths': np.array(duplicates, dtype=str),
+        'duplicate_sizes': np.array([files[path].st_size for path in duplicates], dtype=np.int64),
+        'duplicate_mtimes': np.array([files[path].st_mtime for path in duplicates], dtype=np.float64),
+        'duplicate_hashes': np.array([hashes[path] for path in duplicates], dtype=str),
+        'directories': np.array(sorted(directories), dtype=str),
+        'directory_mtimes': np.array([directories[d] for d in sorted(directories)], dtype=np.float64),
+        'annotations': np.array(annotations or ''),
+        'annotations_mtime': np.array(os.stat(annotations).st_mtime if annotations else 0.0)
+    }
+    
+    # Write through a temporary file so readers never see a partial index
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    with open(manifest_path + '.tmp', 'wb') as f:
+        np.savez(f, **manifest)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    
+    return manifest
@@ -0,0 +1,97 @@
+"""Data-parallel CPU training across several local processes.
+
+Each process trains ModelTrainer on its own shard of the data (through a
+DistributedSampler) and DistributedDataParallel all-reduces gradients over
+the gloo backend, so no GPU is required. Only rank 0 logs and saves models.
+
+Usage: python models/distributed_train.py --nproc 4 --epochs 20
+"""
+import argparse
+import os
+import socket
+import sys
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.data_loader import create_data_loaders
+from models.train_model import ModelTrainer
+
+def find_free_port():
+    """Pick a free local TCP port for the process group rendezvous"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _train_worker(rank, world_size, port, options):
+    """Entry point of one training process"""
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    
+    # Split the cores between processes instead of every rank using all of them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    
+    try:
+        # Rank 0 prepares the dataset (synthetic samples, cache) before the others read it
+        if rank != 0:
+            dist.barrier()
+        train_loader, val_loader, class_names = create_data_loaders(
+            batch_size=options['batch_size'], data_path=options['data_path'],
+            profile=options['profile'], cache_dir=options['cache_dir'],
+            rank=rank, world_size=world_size, build_cache=rank == 0
+        )
+        if rank == 0:
+            dist.barrier()
+        
+        torch.manual_seed(options['seed'])
+        trainer = ModelTrainer(num_classes=len(class_names), use_pretrained=options['use_pretrained'])
+        trainer.distribute(rank, world_size)
+        trainer.train(train_loader, val_loader, epochs=options['epochs'],
+                      checkpoint_dir=options['checkpoint_dir'],
+                      checkpoint_every=options['checkpoint_every'], resume=options['resume'])
+    finally:
+        dist.destroy_process_group()
+
+def launch_distributed_training(nproc=2, epochs=20, batch_size=16, data_path="data/raw",
+                                profile='serial', cache_dir=None, use_pretrained=True, seed=42,
+                                checkpoint_dir=None, checkpoint_every=0, resume=False):
+    """Spawn nproc local training processes joined by a gloo process group
+    
+    batch_size is per process, so the effective batch is nproc * batch_size.
+    """
+    options = {
+        'epochs': epochs,
+        'batch_size': batch_size,
+        'data_path': data_path,
+        'profile': profile,
+        'cache_dir': cache_dir,
+        'use_pretrained': use_pretrained,
+        'seed': seed,
+        'checkpoint_dir': checkpoint_dir,
+        'checkpoint_every': checkpoint_every,
+        'resume': resume
+    }
+    mp.spawn(_train_worker, args=(nproc, find_free_port(), options), nprocs=nproc, join=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-parallel EyeSense training on CPU")
+    parser.add_argument("--nproc", type=int, default=2, help="Number of local training processes")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=16, help="Per-process batch size")
+    parser.add_argument("--data-path", default="data/raw")
+    parser.add_argument("--profile", default='serial', help="Loader profile for each process")
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--checkpoint-dir", default='models/checkpoints')
+    parser.add_argument("--checkpoint-every", type=int, default=0)
+    parser.add_argument("--resume", action="store_true")
+    args = parser.parse_args()
+    
+    launch_distributed_training(nproc=args.nproc, epochs=args.epochs, batch_size=args.batch_size,
+                                data_path=args.data_path, profile=args.profile,
+                                cache_dir=args.cache_dir, checkpoint_dir=args.checkpoint_dir,
+                                checkpoint_every=args.checkpoint_every, resume=args.resume)
@@ -0,0 +1,99 @@
+"""Multi-head ensembles that share one backbone.
+
+Several trained classifier heads (different seeds or labelings) are served
+on top of a single backbone pass. The heads are stacked into one weight
+tensor per layer, so adding heads costs two small matmuls, not a backbone.
+Heads only agree on features if they were trained on the same backbone,
+e.g. by fine-tuning just the classifier from a shared checkpoint.
+"""
+import copy
+import os
+import sys
+import zipfile
+
+import torch
+import torch.nn as nn
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.eye_model import ImprovedEyeSenseModel, load_model_weights
+
+class StackedHeads(nn.Module):
+    """N classifier heads with the ImprovedEyeSenseModel layout evaluated together
+    
+    The first layers of all heads form one (in_features, N * hidden) matmul;
+    the second layers are one batched matmul. Dropout is omitted (heads are
+    for inference). Returns logits of shape (N, batch, classes).
+    """
+    
+    def __init__(self, heads):
+        super(StackedHeads, self).__init__()
+        linears = [[module for module in head.modules() if isinstance(module, nn.Linear)] for head in heads]
+        self.num_heads = len(linears)
+        self.weight1 = nn.Parameter(torch.stack([first.weight.detach().T for first, _ in linears], dim=1))
+        self.bias1 = nn.Parameter(torch.stack([first.bias.detach() for first, _ in linears]))
+        self.weight2 = nn.Parameter(torch.stack([second.weight.detach().T for _, second in linears]))
+        self.bias2 = nn.Parameter(torch.stack([second.bias.detach() for _, second in linears]).unsqueeze(1))
+    
+    def forward(self, features):
+        # (batch, in) @ (in, N * hidden), then split per head
+        hidden = (features @ self.weight1.flatten(1)).view(len(features), self.num_heads, -1)
+        hidden = torch.relu(hidden + self.bias1).transpose(0, 1)
+        # (N, batch, hidden) @ (N, hidden, classes)
+        return torch.baddbmm(self.bias2, hidden, self.weight2)
+
+class EnsembleEyeSenseModel(nn.Module):
+    """One backbone and N stacked classifier heads"""
+    
+    def __init__(self, backbone_model, heads):
+        super(EnsembleEyeSenseModel, self).__init__()
+        self.backbone = backbone_model.backbone
+        self.backbone_name = backbone_model.backbone_name
+        self.feature_dim = backbone_model.feature_dim
+        self.heads = StackedHeads(heads)
+    
+    def forward(self, x, return_features=False):
+        features = self.backbone(x)
+        output = self.heads(features)
+        if return_features:
+            return output, features
+        return output
+
+def _load_state_dict(path):
+    if zipfile.is_zipfile(path):
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    return torch.load(path, map_location='cpu')
+
+def load_ensemble(model_paths, num_classes=3, backbone='resnet50', allow_backbone_mismatch=False):
+    """Build an EnsembleEyeSenseModel from trained ImprovedEyeSenseModel checkpoints
+    
+    The backbone comes from the first checkpoint and every checkpoint
+    contributes its classifier head. A checkpoint whose backbone weights
+    differ raises ValueError, since its head would see features it was not
+    trained on; allow_backbone_mismatch=True only warns.
+    """
+    if not model_paths:
+        raise ValueError("An ensemble needs at least one model")
+    
+    base = ImprovedEyeSenseModel(num_classes=num_classes, use_pretrained=False, backbone=backbone)
+    load_model_weights(base, model_paths[0], torch.device('cpu'))
+    base_backbone = base.backbone.state_dict()
+    
+    heads = [base.classifier]
+    for path in model_paths[1:]:
+        state_dict = _load_state_dict(path)
+        if any(not torch.equal(tensor, state_dict[f'backbone.{name}'])
+               for name, tensor in base_backbone.items() if tensor.is_floating_point()):
+            message = f"{path} was trained on a different backbone than {model_paths[0]}"
+            if not allow_backbone_mismatch:
+                raise ValueError(message)
+            print(f"Warning: {message}")
+        
+        head = copy.deepcopy(base.classifier)
+        head.load_state_dict({name[len('classifier.'):]: tensor for name, tensor in state_dict.items()
+                              if name.startswith('classifier.')})
+        heads.append(head)
+    
+    print(f"Loaded an ensemble of {len(heads)} heads on a shared {backbone} backbone")
+    return EnsembleEyeSenseModel(base, heads).eval()
@@ -0,0 +1,215 @@
+"""Batched model evaluation with vectorized metrics.
+
+Usage: python models/evaluate.py --model models/best_eyesense_model.pth --data-path data/raw
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from scipy.stats import rankdata
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.batch_augment import BatchAugment
+
+def collect_logits(model, loader, batch_transform=None):
+    """Run model over loader under inference_mode into preallocated arrays
+    
+    uint8 batches (from augment='batch' loaders) are normalized with
+    batch_transform, or an eval-mode BatchAugment by default.
+    Returns (logits, labels) as numpy arrays.
+    """
+    device = next(model.parameters()).device
+    model.eval()
+    capacity = len(loader.sampler) if loader.sampler is not None else len(loader.dataset)
+    logits = None
+    labels = np.empty(capacity, dtype=np.int64)
+    filled = 0
+    
+    with torch.inference_mode():
+        for images, targets in loader:
+            images = images.to(device, non_blocking=True)
+            if images.dtype == torch.uint8:
+                batch_transform = batch_transform or BatchAugment().to(device)
+                images = batch_transform.eval()(images)
+            
+            outputs = model(images).float().cpu().numpy()
+            if logits is None:
+                logits = np.empty((capacity, outputs.shape[1]), dtype=np.float32)
+            
+            end = filled + len(outputs)
+            logits[filled:end] = outputs
+            labels[filled:end] = np.asarray(targets)
+            filled = end
+    
+    if logits is None:
+        raise ValueError("Evaluation loader is empty")
+    return logits[:filled], labels[:filled]
+
+def softmax(logits):
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+def compute_metrics(logits, labels, class_names, calibration_bins=15):
+    """Confusion matrix, per-class precision/recall/F1, one-vs-rest ROC-AUC and ECE"""
+    num_classes = logits.shape[1]
+    probabilities = softmax(logits)
+    predictions = probabilities.argmax(axis=1)
+    
+    confusion = np.bincount(labels * num_classes + predictions,
+                            minlength=num_classes * num_classes).reshape(num_classes, num_classes)
+    true_positives = np.diag(confusion).astype(np.float64)
+    support = confusion.sum(axis=1)
+    predicted = confusion.sum(axis=0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(support > 0, true_positives / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        
+        # One-vs-rest ROC-AUC from rank sums (Mann-Whitney U), all classes at once
+        one_hot = labels[:, None] == np.arange(num_classes)
+        ranks = rankdata(probabilities, axis=0)
+        positives = one_hot.sum(axis=0)
+        negatives = len(labels) - positives
+        rank_sums = (ranks * one_hot).sum(axis=0)
+        roc_auc = (rank_sums - positives * (positives + 1) / 2) / (positives * negatives)
+    roc_auc = np.where((positives > 0) & (negatives > 0), roc_auc, np.nan)
+    
+    # Expected calibration error over equal-width confidence bins
+    confidence = probabilities.max(axis=1)
+    bins = np.minimum((confidence * calibration_bins).astype(np.int64), calibration_bins - 1)
+    bin_confidence = np.bincount(bins, weights=confidence, minlength=calibration_bins)
+    bin_correct = np.bincount(bins, weights=predictions == labels, minlength=calibration_bins)
+    ece = np.abs(bin_correct - bin_confidence).sum() / len(labels)
+    
+    def clean(values):
+        # JSON has no NaN; undefined AUCs (class absent) become null
+        return [None if np.isnan(value) else float(value) for value in values]
+    
+    return {
+        'samples': int(len(labels)),
+        'accuracy': float((predictions == labels).mean()),
+        'class_names': list(class_names),
+        'confusion_matrix': confusion.tolist(),
+        'precision': clean(precision),
+        'recall': clean(recall),
+        'f1': clean(f1),
+        'support': support.tolist(),
+        'roc_auc': clean(roc_auc),
+        'macro_roc_auc': None if np.isnan(roc_auc).all() else float(np.nanmean(roc_auc)),
+        'expected_calibration_error': float(ece)
+    }
+
+def plot_confusion_matrix(report, path='models/confusion_matrix.png'):
+    """Render the report's confusion matrix as a heatmap"""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    
+    class_names = report['class_names']
+    plt.figure(figsize=(8, 6))
+    sns.heatmap(np.array(report['confusion_matrix']), annot=True, fmt='d', cmap='Blues',
+                xticklabels=class_names, yticklabels=class_names)
+    plt.title('Confusion Matrix')
+    plt.ylabel('True Label')
+    plt.xlabel('Predicted Label')
+    plt.tight_layout()
+    plt.savefig(path, dpi=300, bbox_inches='tight')
+    plt.close()
+
+def evaluate_model(model, test_loader, class_names, report_path='models/evaluation_report.json',
+                   plot=False, batch_transform=None):
+    """Evaluate model performance and write a JSON report
+    
+    Returns the report dict. plot=True also saves the confusion matrix image.
+    """
+    logits, labels = collect_logits(model, test_loader, batch_transform)
+    report = compute_metrics(logits, labels, class_names)
+    
+    print(f"\n{'Class':<12}{'Precision':>10}{'Recall':>10}{'F1':>10}{'AUC':>10}{'Support':>10}")
+    for i, name in enumerate(class_names):
+        auc = report['roc_auc'][i]
+        print(f"{name:<12}{report['precision'][i]:>10.3f}{report['recall'][i]:>10.3f}"
+              f"{report['f1'][i]:>10.3f}{'n/a' if auc is None else f'{auc:.3f}':>10}{report['support'][i]:>10}")
+    print(f"Accuracy: {report['accuracy']:.4f}, ECE: {report['expected_calibration_error']:.4f}")
+    
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Evaluation report saved to {report_path}")
+    
+    if plot:
+        plot_confusion_matrix(report)
+    
+    return report
+
+def measure_latency(model, image_size=224, batch_size=1, runs=20, warmup=3):
+    """Median wall-clock seconds of one forward pass over a random batch"""
+    device = next(model.parameters()).device
+    model.eval()
+    images = torch.randn(batch_size, 3, image_size, image_size, device=device)
+    timings = []
+    
+    with torch.inference_mode():
+        for run in range(warmup + runs):
+            start = time.perf_counter()
+            model(images)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            if run >= warmup:
+                timings.append(time.perf_counter() - start)
+    
+    return float(np.median(timings))
+
+def compare_models(candidates, val_loader, class_names, image_size=224, runs=20, batch_transform=None):
+    """Latency/accuracy table for choosing a serving model
+    
+    candidates maps a display name to a model. Returns one row per model
+    with parameter count, single-image latency and validation metrics.
+    """
+    rows = []
+    for name, model in candidates.items():
+        logits, labels = collect_logits(model, val_loader, batch_transform)
+        metrics = compute_metrics(logits, labels, class_names)
+        rows.append({
+            'model': name,
+            'parameters': sum(param.numel() for param in model.parameters()),
+            'latency_ms': 1000 * measure_latency(model, image_size, runs=runs),
+            'accuracy': metrics['accuracy'],
+            'macro_roc_auc': metrics['macro_roc_auc']
+        })
+    
+    print(f"\n{'Model':<28}{'Params (M)':>12}{'Latency (ms)':>14}{'Accuracy':>10}{'AUC':>8}")
+    for row in rows:
+        auc = 'n/a' if row['macro_roc_auc'] is None else f"{row['macro_roc_auc']:.3f}"
+        print(f"{row['model']:<28}{row['parameters'] / 1e6:>12.1f}{row['latency_ms']:>14.1f}"
+              f"{row['accuracy']:>10.4f}{auc:>8}")
+    
+    return rows
+
+if __name__ == "__main__":
+    from models.data_loader import create_data_loaders
+    from models.eye_model import ImprovedEyeSenseModel, load_model_weights
+    
+    parser = argparse.ArgumentParser(description="Evaluate a trained EyeSense model")
+    parser.add_argument("--model", default="models/best_eyesense_model.pth")
+    parser.add_argument("--backbone", default='resnet50',
+                        help="Backbone the checkpoint was trained with (see models.eye_model.BACKBONES)")
+    parser.add_argument("--data-path", default="data/raw")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--report", default="models/evaluation_report.json")
+    parser.add_argument("--plot", action="store_true", help="Also save the confusion matrix image")
+    args = parser.parse_args()
+    
+    _, val_loader, class_names = create_data_loaders(batch_size=args.batch_size, data_path=args.data_path)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = ImprovedEyeSenseModel(num_classes=len(class_names), use_pretrained=False, backbone=args.backbone)
+    load_model_weights(model, args.model, device)
+    evaluate_model(model.to(device), val_loader, class_names, report_path=args.report, plot=args.plot)
@@ -3,21 +3,46 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torchvision.models as models
 import os
+import zipfile
 import cv2
 import numpy as np
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
 
+from models.roi import OpticDiscCropper
+
+def _strip_head(model, head):
+    """Replace a torchvision model's classification head with Identity, returning its input size"""
+    layer = getattr(model, head)
+    in_features = layer.in_features if isinstance(layer, nn.Linear) else \
+        next(m for m in layer.modules() if isinstance(m, nn.Linear)).in_features
+    setattr(model, head, nn.Identity())
+    return in_features
+
+# Backbone name -> (torchvision constructor, name of its classification head)
+BACKBONES = {
+    'resnet50': (models.resnet50, 'fc'),
+    'resnet18': (models.resnet18, 'fc'),
+    'mobilenet_v3_small': (models.mobilenet_v3_small, 'classifier'),
+    'mobilenet_v3_large': (models.mobilenet_v3_large, 'classifier'),
+    'efficientnet_b0': (models.efficientnet_b0, 'classifier')
+}
+
 class ImprovedEyeSenseModel(nn.Module):
-    def __init__(self, num_classes=3, use_pretrained=True):
+    def __init__(self, num_classes=3, use_pretrained=True, backbone='resnet50'):
         super(ImprovedEyeSenseModel, self).__init__()
         
-        # Use pre-trained ResNet as backbone
-        self.backbone = models.resnet50(pretrained=use_pretrained)
+        if backbone not in BACKBONES:
+            raise ValueError(f"Unknown backbone: {backbone}")
+        self.backbone_name = backbone
+        
+        # Use a pre-trained torchvision network as backbone
+        constructor, head = BACKBONES[backbone]
+        self.backbone = constructor(pretrained=use_pretrained)
         
-        # Replace the final fully connected layer
-        in_features = self.backbone.fc.in_features
-        self.backbone.fc = nn.Identity()  # Remove the original FC layer
+        # Remove the original classification head; the backbone yields pooled features
+        in_features = _strip_head(self.backbone, head)
+        self.feature_dim = in_features
         
         # Add custom classifier with dropout for regularization
         self.classifier = nn.Sequential(
@@ -27,49 +52,136 @@ class ImprovedEyeSenseModel(nn.Module):
             nn.Dropout(0.3),
             nn.Linear(512, num_classes)
         )
-        
-    def forward(self, x):
+    
+    def forward(self, x, return_features=False):
         # Extract features from backbone
         features = self.backbone(x)
         
         # Classification
         output = self.classifier(features)
         
+        # The pooled backbone features double as an image embedding
+        if return_features:
+            return output, features
         return output
 
+def load_model_weights(model, model_path, device, mmap=True):
+    """Load a saved state dict into model
+    
+    On CPU the weight file is memory-mapped and its tensors are assigned
+    directly as the model parameters. The read-only pages then come from the
+    OS page cache, so several worker processes serving the same file share
+    one physical copy of the weights instead of each holding its own.
+    """
+    # Legacy (non-zipfile) checkpoints cannot be memory-mapped
+    if mmap and device.type == 'cpu' and zipfile.is_zipfile(model_path):
+        state_dict = torch.load(model_path, map_location='cpu', mmap=True, weights_only=True)
+        model.load_state_dict(state_dict, assign=True)
+        return model
+    
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    return model
+
+# Test-time augmentation views as (horizontal flip, rotation in degrees, brightness shift);
+# the first view is the unaugmented image
+TTA_VIEWS = [
+    (False, 0, 0.0),
+    (True, 0, 0.0),
+    (False, 10, 0.0),
+    (False, -10, 0.0),
+    (True, 10, 0.1),
+    (True, -10, -0.1),
+]
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+def tta_batch(image, views=TTA_VIEWS):
+    """Stack augmented copies of one normalized image tensor (1, C, H, W) into a batch
+    
+    Flips and rotations are a single batched affine resampling; brightness is
+    shifted in [0, 1] pixel space and renormalized.
+    """
+    angles = torch.tensor([np.radians(angle) for _, angle, _ in views], dtype=image.dtype)
+    flips = torch.tensor([-1.0 if flip else 1.0 for flip, _, _ in views], dtype=image.dtype)
+    cos, sin = torch.cos(angles), torch.sin(angles)
+    zeros = torch.zeros_like(angles)
+    theta = torch.stack([
+        torch.stack([cos * flips, -sin, zeros], dim=1),
+        torch.stack([sin * flips, cos, zeros], dim=1)
+    ], dim=1).to(image.device)
+    
+    batch = image.expand(len(views), -1, -1, -1)
+    grid = F.affine_grid(theta, batch.shape, align_corners=False)
+    batch = F.grid_sample(batch, grid, padding_mode='border', align_corners=False)
+    
+    mean = torch.tensor(IMAGENET_MEAN, dtype=image.dtype, device=image.device).view(1, -1, 1, 1)
+    std = torch.tensor(IMAGENET_STD, dtype=image.dtype, device=image.device).view(1, -1, 1, 1)
+    shifts = torch.tensor([shift for _, _, shift in views], dtype=image.dtype,
+                          device=image.device).view(-1, 1, 1, 1)
+    pixels = (batch * std + mean + shifts).clamp(0, 1)
+    return (pixels - mean) / std
+
 class GlaucomaRiskPredictor:
-    def __init__(self, model_path=None, num_classes=3):
+    def __init__(self, model_path=None, num_classes=3, mmap_weights=True, backbone='resnet50',
+                 image_size=224, roi_crop=False, tta_threshold=0.0, model=None):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         print(f"Using device: {self.device}")
-        
-        self.model = ImprovedEyeSenseModel(num_classes=num_classes)
         self.classes = ['Normal', 'Slightly High', 'High']
         
-        # Load model weights if available
-        if model_path and os.path.exists(model_path):
-            print(f"Loading model from {model_path}")
-            try:
-                self.model.load_state_dict(torch.load(model_path, map_location=self.device))
-                print("Model loaded successfully!")
-            except Exception as e:
-                print(f"Error loading model: {e}")
-                print("Using randomly initialized weights.")
+        # An already built model (e.g. a multi-head ensemble) is served as is
+        if model is not None:
+            self.model = model
         else:
-            print("No pre-trained model found. Using randomly initialized weights.")
-            print("Please train the model first for accurate predictions.")
+            # ImageNet weights are only needed when there is no trained checkpoint
+            has_weights = bool(model_path and os.path.exists(model_path))
+            self.model = ImprovedEyeSenseModel(num_classes=num_classes, use_pretrained=not has_weights,
+                                               backbone=backbone)
+            
+            # Load model weights if available
+            if has_weights:
+                print(f"Loading model from {model_path}")
+                try:
+                    load_model_weights(self.model, model_path, self.device, mmap=mmap_weights)
+                    print("Model loaded successfully!")
+                except Exception as e:
+                    print(f"Error loading model: {e}")
+                    print("Using randomly initialized weights.")
+            else:
+                print("No pre-trained model found. Using randomly initialized weights.")
+                print("Please train the model first for accurate predictions.")
         
         self.model.to(self.device)
         self.model.eval()
         
+        # Optional optic-disc crop ahead of the resize (the model must be trained on crops)
+        self.cropper = OpticDiscCropper() if roi_crop else None
+        
+        # Test-time augmentation runs automatically below this confidence (0 disables it)
+        self.tta_threshold = tta_threshold
+        
         # Image preprocessing
         self.transform = A.Compose([
-            A.Resize(224, 224),
-            A.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+            A.Resize(image_size, image_size),
+            A.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
             ToTensorV2(),
         ])
+    
+    @staticmethod
+    def _head_probabilities(outputs):
+        """Softmax of model outputs as (heads, batch, classes); single models have one head"""
+        probabilities = F.softmax(outputs, dim=-1)
+        return probabilities if probabilities.dim() == 3 else probabilities.unsqueeze(0)
+    
+    def predict(self, image, tta=None):
+        """Predict glaucoma risk from eye image
         
-    def predict(self, image):
-        """Predict glaucoma risk from eye image"""
+        tta=True averages the probabilities over all TTA_VIEWS, computed in one
+        forward pass; tta=False never augments. With tta=None the augmented views
+        are only added when the plain prediction's confidence is below tta_threshold.
+        Multi-head models report the mean over heads, plus the per-class variance
+        across heads as an uncertainty signal.
+        """
         try:
             # Ensure image is in correct format
             if len(image.shape) == 2:  # Grayscale
@@ -77,25 +189,47 @@ class GlaucomaRiskPredictor:
             elif image.shape[2] == 4:  # RGBA
                 image = cv2.cvtColor(image, cv2.COLOR_RGBA2RGB)
             
+            roi_box = None
+            if self.cropper is not None:
+                image, roi_box = self.cropper.crop(image)
+            
             # Preprocess image
             processed = self.transform(image=image)['image']
             processed = processed.unsqueeze(0).to(self.device)
             
             # Prediction
             with torch.no_grad():
-                outputs = self.model(processed)
-                probabilities = F.softmax(outputs, dim=1)
-                confidence, prediction = torch.max(probabilities, 1)
+                batch = tta_batch(processed) if tta else processed
+                outputs, features = self.model(batch, return_features=True)
+                probabilities = self._head_probabilities(outputs)
+                if tta is None and probabilities[:, 0].mean(0).max().item() < self.tta_threshold:
+                    # Reuse the plain prediction as the unaugmented view
+                    augmented = self._head_probabilities(self.model(tta_batch(processed, TTA_VIEWS[1:])))
+                    probabilities = torch.cat([probabilities, augmented], dim=1)
                 
+                views = probabilities.shape[1]
+                head_probabilities = probabilities.mean(1)
+                mean_probabilities = head_probabilities.mean(0)
+                confidence, prediction = torch.max(mean_probabilities, 0)
+            
             risk_level = self.classes[prediction.item()]
             confidence_score = confidence.item()
             
-            return {
+            result = {
                 'risk_level': risk_level,
                 'confidence': confidence_score,
-                'probabilities': probabilities.cpu().numpy()[0].tolist()
+                'probabilities': mean_probabilities.cpu().numpy().tolist(),
+                'tta_views': views,
+                # Backbone features of the unaugmented image, for similar-case search
+                'embedding': features[0].float().cpu().numpy()
             }
-            
+            if len(head_probabilities) > 1:
+                result['ensemble_size'] = len(head_probabilities)
+                result['probability_variance'] = head_probabilities.var(0, unbiased=False).cpu().numpy().tolist()
+            if roi_box is not None:
+                result['roi_box'] = list(roi_box)
+            return result
+        
         except Exception as e:
             print(f"Prediction error: {e}")
             return {
@@ -0,0 +1,233 @@
+"""Structured channel pruning of the ResNet backbone.
+
+The inner convolutions of every residual block are narrowed by removing
+their least important output channels, which yields a smaller dense model
+(no sparse kernels needed). Block outputs are left alone so the residual
+additions keep matching shapes.
+
+Usage: python models/prune.py --model models/best_eyesense_model.pth --sparsity 0.25 0.5 --finetune-epochs 2
+"""
+import argparse
+import copy
+import os
+import sys
+
+import torch
+import torch.nn as nn
+from torchvision.models.resnet import BasicBlock, Bottleneck
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.eye_model import ImprovedEyeSenseModel
+from models.evaluate import collect_logits, compute_metrics, measure_latency
+from models.train_model import ModelTrainer
+
+IMPORTANCE_METHODS = ('l1', 'taylor')
+
+def _layer_names(block):
+    """(conv, bn, next conv) attribute names whose shared channels can be removed"""
+    if isinstance(block, Bottleneck):
+        return [('conv1', 'bn1', 'conv2'), ('conv2', 'bn2', 'conv3')]
+    return [('conv1', 'bn1', 'conv2')]
+
+def _prunable_layers(block):
+    return [tuple(getattr(block, attr) for attr in names) for names in _layer_names(block)]
+
+def _blocks(model):
+    blocks = [(name, module) for name, module in model.backbone.named_modules()
+              if isinstance(module, (BasicBlock, Bottleneck))]
+    if not blocks:
+        raise ValueError(f"Pruning supports ResNet backbones, not {model.backbone_name}")
+    return blocks
+
+def channel_importance(model, method='l1', loader=None, batches=10):
+    """Score every prunable channel, returning {(block name, layer index): scores}
+    
+    'l1' ranks filters by the L1 norm of their weights. 'taylor' ranks
+    them by the first-order Taylor estimate of the loss change on `loader`
+    when the channel is removed, (gamma * dL/dgamma)^2 of its BatchNorm.
+    """
+    if method not in IMPORTANCE_METHODS:
+        raise ValueError(f"Unknown importance method: {method}")
+    blocks = _blocks(model)
+    
+    if method == 'l1':
+        return {
+            (name, index): conv.weight.detach().abs().sum(dim=(1, 2, 3))
+            for name, block in blocks
+            for index, (conv, _, _) in enumerate(_prunable_layers(block))
+        }
+    
+    if loader is None:
+        raise ValueError("Taylor importance needs a data loader")
+    device = next(model.parameters()).device
+    criterion = nn.CrossEntropyLoss()
+    scores = {
+        (name, index): torch.zeros_like(bn.weight)
+        for name, block in blocks
+        for index, (_, bn, _) in enumerate(_prunable_layers(block))
+    }
+    
+    model.eval()
+    for batch, (images, labels) in enumerate(loader):
+        if batch >= batches:
+            break
+        model.zero_grad()
+        criterion(model(images.to(device)), labels.to(device)).backward()
+        for name, block in blocks:
+            for index, (_, bn, _) in enumerate(_prunable_layers(block)):
+                scores[(name, index)] += (bn.weight * bn.weight.grad).detach() ** 2
+    model.zero_grad()
+    return scores
+
+def _slice_conv(conv, out_keep=None, in_keep=None):
+    weight = conv.weight.detach()
+    if out_keep is not None:
+        weight = weight[out_keep]
+    if in_keep is not None:
+        weight = weight[:, in_keep]
+    new_conv = nn.Conv2d(weight.shape[1], weight.shape[0], conv.kernel_size, stride=conv.stride,
+                         padding=conv.padding, dilation=conv.dilation, bias=conv.bias is not None)
+    new_conv.weight.data.copy_(weight)
+    if conv.bias is not None:
+        new_conv.bias.data.copy_(conv.bias.detach()[out_keep] if out_keep is not None else conv.bias.detach())
+    return new_conv
+
+def _slice_bn(bn, keep):
+    new_bn = nn.BatchNorm2d(len(keep), eps=bn.eps, momentum=bn.momentum)
+    new_bn.weight.data.copy_(bn.weight.detach()[keep])
+    new_bn.bias.data.copy_(bn.bias.detach()[keep])
+    new_bn.running_mean.copy_(bn.running_mean[keep])
+    new_bn.running_var.copy_(bn.running_var[keep])
+    return new_bn
+
+def _narrow(block, names, keep):
+    """Keep only channels `keep` between a conv/bn pair and the conv that consumes them"""
+    conv, bn, next_conv = (getattr(block, attr) for attr in names)
+    setattr(block, names[0], _slice_conv(conv, out_keep=keep))
+    setattr(block, names[1], _slice_bn(bn, keep))
+    setattr(block, names[2], _slice_conv(next_conv, in_keep=keep))
+
+def prune_model(model, sparsity, method='l1', loader=None, batches=10):
+    """Return a slimmer copy of model with `sparsity` of each block's inner channels removed"""
+    scores = channel_importance(model, method, loader, batches)
+    pruned = copy.deepcopy(model).cpu()
+    
+    for name, block in _blocks(pruned):
+        for index, names in enumerate(_layer_names(block)):
+            channel_scores = scores[(name, index)].cpu()
+            keep_count = max(1, round(len(channel_scores) * (1 - sparsity)))
+            _narrow(block, names, channel_scores.topk(keep_count).indices.sort().values)
+    
+    return pruned
+
+def block_widths(model):
+    """Inner channel counts of every residual block, enough to rebuild a pruned model"""
+    return {name: [getattr(block, names[0]).out_channels for names in _layer_names(block)]
+            for name, block in _blocks(model)}
+
+def save_pruned_model(model, path, num_classes=3):
+    """Save a pruned model's weights together with its layer widths"""
+    torch.save({
+        'backbone': model.backbone_name,
+        'num_classes': num_classes,
+        'widths': block_widths(model),
+        'state_dict': model.state_dict()
+    }, path)
+
+def load_pruned_model(path, device=torch.device('cpu')):
+    """Rebuild a model saved by save_pruned_model"""
+    checkpoint = torch.load(path, map_location=device, weights_only=True)
+    model = ImprovedEyeSenseModel(num_classes=checkpoint['num_classes'], use_pretrained=False,
+                                  backbone=checkpoint['backbone'])
+    # Narrow the layers to the saved widths; the weights come from the state dict
+    for name, block in _blocks(model):
+        for names, width in zip(_layer_names(block), checkpoint['widths'][name]):
+            _narrow(block, names, torch.arange(width))
+    model.load_state_dict(checkpoint['state_dict'])
+    return model.to(device)
+
+def count_flops(model, image_size=224):
+    """Multiply-accumulates of one forward pass, the convention behind ResNet50's ~4.1 GFLOPs"""
+    total = 0
+    
+    def conv_hook(module, inputs, output):
+        nonlocal total
+        kernel = module.kernel_size[0] * module.kernel_size[1] * module.in_channels // module.groups
+        total += output.numel() * kernel
+    
+    def linear_hook(module, inputs, output):
+        nonlocal total
+        total += output.numel() * module.in_features
+    
+    hooks = [module.register_forward_hook(conv_hook if isinstance(module, nn.Conv2d) else linear_hook)
+             for module in model.modules() if isinstance(module, (nn.Conv2d, nn.Linear))]
+    device = next(model.parameters()).device
+    model.eval()
+    with torch.inference_mode():
+        model(torch.zeros(1, 3, image_size, image_size, device=device))
+    for hook in hooks:
+        hook.remove()
+    return total
+
+def pruning_report(model, train_loader, val_loader, class_names, sparsities=(0.25, 0.5, 0.75),
+                   method='l1', finetune_epochs=1, image_size=224, latency_runs=20, save_pattern=None):
+    """Prune at several sparsity levels, fine-tune each with ModelTrainer and compare
+    
+    Returns one row per model (the unpruned one first) with FLOPs,
+    parameters, CPU latency and validation accuracy, and prints them.
+    save_pattern (e.g. 'models/pruned_{sparsity}.pth') saves each fine-tuned model.
+    """
+    def describe(candidate, sparsity):
+        logits, labels = collect_logits(candidate, val_loader)
+        return {
+            'sparsity': sparsity,
+            'flops': count_flops(candidate, image_size),
+            'parameters': sum(param.numel() for param in candidate.parameters()),
+            'latency_ms': 1000 * measure_latency(candidate, image_size, runs=latency_runs),
+            'accuracy': compute_metrics(logits, labels, class_names)['accuracy']
+        }
+    
+    rows = [describe(model, 0.0)]
+    for sparsity in sparsities:
+        print(f"\nPruning {sparsity:.0%} of inner channels ({method})...")
+        pruned = prune_model(model, sparsity, method=method, loader=train_loader)
+        
+        # Recover accuracy with the normal training loop (without overwriting saved models)
+        trainer = ModelTrainer(num_classes=len(class_names), model=pruned)
+        trainer.model.to(trainer.device)
+        for epoch in range(finetune_epochs):
+            trainer.train_epoch(train_loader, epoch, finetune_epochs)
+        
+        if save_pattern:
+            save_pruned_model(trainer.model, save_pattern.format(sparsity=sparsity), len(class_names))
+        rows.append(describe(trainer.model, sparsity))
+    
+    print(f"\n{'Sparsity':>9}{'GFLOPs':>9}{'Params (M)':>12}{'Latency (ms)':>14}{'Accuracy':>10}")
+    for row in rows:
+        print(f"{row['sparsity']:>9.0%}{row['flops'] / 1e9:>9.2f}{row['parameters'] / 1e6:>12.1f}"
+              f"{row['latency_ms']:>14.1f}{row['accuracy']:>10.4f}")
+    
+    return rows
+
+if __name__ == "__main__":
+    from models.data_loader import create_data_loaders
+    from models.eye_model import load_model_weights
+    
+    parser = argparse.ArgumentParser(description="Prune the EyeSense backbone and report the trade-off")
+    parser.add_argument("--model", default="models/best_eyesense_model.pth")
+    parser.add_argument("--backbone", default='resnet50')
+    parser.add_argument("--sparsity", type=float, nargs='+', default=[0.25, 0.5, 0.75])
+    parser.add_argument("--method", choices=IMPORTANCE_METHODS, default='l1')
+    parser.add_argument("--finetune-epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--save-pattern", default="models/pruned_{sparsity}.pth")
+    args = parser.parse_args()
+    
+    train_loader, val_loader, class_names = create_data_loaders(batch_size=args.batch_size)
+    model = ImprovedEyeSenseModel(num_classes=len(class_names), use_pretrained=False, backbone=args.backbone)
+    load_model_weights(model, args.model, torch.device('cpu'), mmap=False)
+    pruning_report(model, train_loader, val_loader, class_names, sparsities=args.sparsity,
+                   method=args.method, finetune_epochs=args.finetune_epochs,
+                   save_pattern=args.save_pattern)
@@ -0,0 +1,169 @@
+"""Local registry of versioned model artifacts.
+
+Each version is an immutable directory holding the weights and a
+metadata.json (architecture, input size, metrics). A CURRENT file names the
+version to serve; the backend watches it and hot-swaps to new versions.
+
+    models/registry/
+        CURRENT
+        v0001/model.pth
+        v0001/metadata.json
+
+Usage:
+    python models/registry.py register --model models/final_eyesense_model.pth --metrics models/evaluation_report.json --promote
+    python models/registry.py list
+    python models/registry.py promote v0001
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+
+REGISTRY_DIR = "models/registry"
+WEIGHTS_NAME = "model.pth"
+METADATA_NAME = "metadata.json"
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def scalar_metrics(report):
+    """The scalar fields of an evaluation report (accuracy, macro AUC, ECE, ...)"""
+    return {key: value for key, value in report.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    def _version_dir(self, version):
+        return os.path.join(self.root, version)
+
+    def versions(self):
+        """Metadata of every registered version, oldest first"""
+        if not os.path.isdir(self.root):
+            return []
+        # Versions being written live in hidden temporary directories
+        names = sorted(name for name in os.listdir(self.root)
+                       if not name.startswith('.') and os.path.isfile(
+                           os.path.join(self.root, name, METADATA_NAME)))
+        return [self.get(name) for name in names]
+
+    def get(self, version):
+        """Metadata of one version, with 'path' pointing at its weights"""
+        metadata_path = os.path.join(self._version_dir(version), METADATA_NAME)
+        if not os.path.isfile(metadata_path):
+            raise KeyError(f"Unknown model version: {version}")
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        metadata['path'] = os.path.join(self._version_dir(version), WEIGHTS_NAME)
+        return metadata
+
+    def current(self):
+        """The version named by CURRENT, or the newest version, or None for an empty registry"""
+        try:
+            with open(os.path.join(self.root, 'CURRENT')) as f:
+                version = f.read().strip()
+            if version:
+                return version
+        except FileNotFoundError:
+            pass
+        versions = self.versions()
+        return versions[-1]['version'] if versions else None
+
+    def current_mtime(self):
+        """Modification time of CURRENT (0 when missing), a cheap change signal for watchers"""
+        try:
+            return os.path.getmtime(os.path.join(self.root, 'CURRENT'))
+        except FileNotFoundError:
+            return 0.0
+
+    def _next_version(self):
+        numbers = [int(name[1:]) for name in (os.listdir(self.root) if os.path.isdir(self.root) else [])
+                   if name.startswith('v') and name[1:].isdigit()]
+        return f"v{max(numbers, default=0) + 1:04d}"
+
+    def register(self, model_path, backbone='resnet50', image_size=224, num_classes=3, roi_crop=False,
+                 metrics=None, version=None, promote=False):
+        """Copy a trained checkpoint into the registry as a new version, returning the version
+
+        The version directory is written under a temporary name and renamed
+        into place, so readers never see a partial artifact.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        version = version or self._next_version()
+        if os.path.exists(self._version_dir(version)):
+            raise ValueError(f"Model version {version} already exists")
+
+        tmp_dir = os.path.join(self.root, f".{version}.tmp.{os.getpid()}")
+        os.makedirs(tmp_dir)
+        shutil.copyfile(model_path, os.path.join(tmp_dir, WEIGHTS_NAME))
+        metadata = {
+            'version': version,
+            'backbone': backbone,
+            'num_classes': num_classes,
+            'image_size': image_size,
+            'roi_crop': roi_crop,
+            'metrics': metrics or {},
+            'source': model_path,
+            'created': datetime.now().isoformat()
+        }
+        with open(os.path.join(tmp_dir, METADATA_NAME), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.rename(tmp_dir, self._version_dir(version))
+
+        print(f"Registered {model_path} as model version {version}")
+        if promote:
+            self.promote(version)
+        return version
+
+    def promote(self, version):
+        """Make `version` the served model"""
+        self.get(version)
+        _write_atomic(os.path.join(self.root, 'CURRENT'), version + '\n')
+        print(f"Model version {version} is now current")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local model registry")
+    parser.add_argument("--root", default=REGISTRY_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    register = commands.add_parser("register", help="Add a trained checkpoint as a new version")
+    register.add_argument("--model", required=True)
+    register.add_argument("--backbone", default='resnet50')
+    register.add_argument("--image-size", type=int, default=224)
+    register.add_argument("--num-classes", type=int, default=3)
+    register.add_argument("--roi-crop", action="store_true")
+    register.add_argument("--metrics", default=None, help="Evaluation report JSON to record")
+    register.add_argument("--version", default=None)
+    register.add_argument("--promote", action="store_true", help="Also make it the served version")
+
+    commands.add_parser("list", help="Show registered versions")
+
+    promote = commands.add_parser("promote", help="Serve a registered version")
+    promote.add_argument("version")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root)
+    if args.command == "register":
+        metrics = None
+        if args.metrics:
+            with open(args.metrics) as f:
+                metrics = scalar_metrics(json.load(f))
+        registry.register(args.model, backbone=args.backbone, image_size=args.image_size,
+                          num_classes=args.num_classes, roi_crop=args.roi_crop, metrics=metrics,
+                          version=args.version, promote=args.promote)
+    elif args.command == "list":
+        current = registry.current()
+        for metadata in registry.versions():
+            marker = '*' if metadata['version'] == current else ' '
+            accuracy = metadata['metrics'].get('accuracy')
+            print(f"{marker} {metadata['version']}  {metadata['backbone']:<20} {metadata['image_size']:>4}px  "
+                  f"accuracy={'n/a' if accuracy is None else f'{accuracy:.4f}'}  {metadata['created']}")
+    else:
+        registry.promote(args.version)
+    sys.exit(0)
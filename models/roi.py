@@ -0,0 +1,106 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+def _proxy(image, proxy_edge):
+    """Downscale image so its longest edge is proxy_edge, returning (proxy, scale)"""
+    height, width = image.shape[:2]
+    scale = min(1.0, proxy_edge / max(height, width))
+    if scale == 1.0:
+        return image, scale
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+def locate_optic_disc(proxy, border_threshold=15):
+    """Find the field of view and the optic disc on a small RGB proxy image
+    
+    The black border is trimmed by thresholding luminance. The disc is the
+    brightest blob of the blurred field of view. Returns
+    (field_of_view box, disc center (x, y), disc radius) in proxy pixels.
+    """
+    gray = cv2.cvtColor(proxy, cv2.COLOR_RGB2GRAY) if proxy.ndim == 3 else proxy
+    height, width = gray.shape
+    
+    # Border trimming: bounding box of everything brighter than the black frame
+    field = gray > border_threshold
+    rows = np.flatnonzero(field.any(axis=1))
+    cols = np.flatnonzero(field.any(axis=0))
+    if len(rows) == 0:
+        return (0, 0, width, height), (width / 2, height / 2), min(width, height) / 2
+    fov = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+    fov_size = max(fov[2] - fov[0], fov[3] - fov[1])
+    
+    # Brightest blob, ignoring the rim of the field of view where flash glare sits
+    blurred = cv2.GaussianBlur(gray, (0, 0), sigmaX=max(1.0, fov_size / 60))
+    inner = cv2.erode(field.astype(np.uint8), np.ones((3, 3), np.uint8), iterations=max(1, fov_size // 40))
+    if not inner.any():
+        inner = field.astype(np.uint8)
+    _, peak, _, peak_loc = cv2.minMaxLoc(blurred, mask=inner)
+    
+    blob = ((blurred >= 0.9 * peak) & (inner > 0)).astype(np.uint8)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(blob)
+    area = stats[labels[peak_loc[1], peak_loc[0]], cv2.CC_STAT_AREA]
+    radius = float(np.clip(np.sqrt(area / np.pi), 0.05 * fov_size, 0.15 * fov_size))
+    
+    return fov, peak_loc, radius
+
+class OpticDiscCropper:
+    """Crop fundus images to a square around the optic disc
+    
+    Detection runs on a downscaled proxy. Boxes are cached by a hash of the
+    proxy, so a repeated image skips the detection.
+    """
+    
+    def __init__(self, proxy_edge=256, context=3.0, cache_size=1024):
+        self.proxy_edge = proxy_edge
+        # Crop side as a multiple of the disc diameter, to keep the rim and nearby vessels
+        self.context = context
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def find_box(self, image):
+        """Crop box (x0, y0, x1, y1) around the optic disc, in full-resolution pixels"""
+        proxy, scale = _proxy(image, self.proxy_edge)
+        key = hashlib.blake2b(np.ascontiguousarray(proxy).tobytes(), digest_size=16).hexdigest()
+        key += f"{image.shape}"
+        
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        
+        fov, (cx, cy), radius = locate_optic_disc(proxy)
+        half = min(radius * self.context, (fov[2] - fov[0]) / 2, (fov[3] - fov[1]) / 2)
+        # Keep the square inside the field of view
+        cx = np.clip(cx, fov[0] + half, fov[2] - half)
+        cy = np.clip(cy, fov[1] + half, fov[3] - half)
+        
+        height, width = image.shape[:2]
+        box = (
+            max(0, int((cx - half) / scale)),
+            max(0, int((cy - half) / scale)),
+            min(width, int(np.ceil((cx + half) / scale))),
+            min(height, int(np.ceil((cy + half) / scale)))
+        )
+        
+        with self._lock:
+            self._cache[key] = box
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return box
+    
+    def crop(self, image):
+        """Return (cropped image, box)"""
+        x0, y0, x1, y1 = box = self.find_box(image)
+        return image[y0:y1, x0:x1], box
+
+def crop_optic_disc(image, **kwargs):
+    """Albumentations Lambda target: crop a training image to its optic disc"""
+    return _training_cropper.crop(image)[0]
+
+# Training images are seen once per epoch, so their crops are not cached
+_training_cropper = OpticDiscCropper(cache_size=0)
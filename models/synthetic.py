@@ -0,0 +1,166 @@
+"""Procedural fundus-like images for load tests and pipeline tests.
+
+Images are drawn with whole-array NumPy operations: a vignetted circular
+field of view, an optic disc whose cup-to-disc ratio depends on the class,
+a vessel tree radiating from the disc and sensor noise. Every image has its
+own seed derived from (seed, index), so a dataset is identical whether it
+is generated serially, in parallel or on demand.
+
+Usage: python models/synthetic.py --count 300 --out data/raw/synthetic --sizes camera
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+CLASS_PREFIXES = ['normal', 'glaucoma', 'other']
+
+# Cup-to-disc ratio range per class (glaucoma enlarges the cup)
+CUP_TO_DISC = {0: (0.2, 0.4), 1: (0.6, 0.85), 2: (0.3, 0.5)}
+
+# (height, width) size distributions; 'camera' spans native fundus camera resolutions
+SIZE_DISTRIBUTIONS = {
+    'model': ([(224, 224)], [1.0]),
+    'mixed': ([(224, 224), (512, 512), (1024, 1024), (1536, 2048)], [0.25, 0.25, 0.25, 0.25]),
+    'camera': ([(1536, 2048), (1728, 2592), (1934, 1956), (2336, 3504)], [0.3, 0.4, 0.2, 0.1])
+}
+
+def sample_sizes(count, distribution='mixed', seed=0):
+    """Draw `count` (height, width) sizes from a named distribution, reproducibly"""
+    sizes, weights = SIZE_DISTRIBUTIONS[distribution]
+    choices = np.random.default_rng(seed).choice(len(sizes), size=count, p=weights)
+    return [sizes[i] for i in choices]
+
+# Anatomy is smooth, so it is drawn at most this large and upsampled
+DRAW_MAX_EDGE = 768
+
+def _field_of_view(height, width):
+    """Pixel coordinates normalized so the circular field of view is the unit circle"""
+    radius_px = 0.48 * min(height, width)
+    y, x = np.ogrid[:height, :width]
+    y = ((y - height / 2) / radius_px).astype(np.float32)
+    x = ((x - width / 2) / radius_px).astype(np.float32)
+    return x, y, radius_px
+
+def _draw_anatomy(label, height, width, rng):
+    """Float32 RGB retina, optic disc, vessels and lesions (no noise or mask)"""
+    x, y, radius_px = _field_of_view(height, width)
+    r2 = x * x + y * y
+    
+    # Orange-red retina with vignetting towards the edge of the field of view
+    base = np.array([200, 85, 40], dtype=np.float32) * rng.uniform(0.8, 1.1, 3).astype(np.float32)
+    shade = np.clip(1.0 - 0.55 * r2, 0, 1)
+    
+    # Optic disc left or right of center, with a brighter cup inside it
+    disc_x = rng.choice([-1, 1]) * rng.uniform(0.3, 0.4)
+    disc_y = rng.uniform(-0.08, 0.08)
+    disc_radius = rng.uniform(0.13, 0.17)
+    cup_radius = disc_radius * rng.uniform(*CUP_TO_DISC[label])
+    dx, dy = x - disc_x, y - disc_y
+    disc_d2 = dx * dx + dy * dy
+    disc = np.exp(-(disc_d2 / disc_radius ** 2) ** 2)
+    cup = np.exp(-(disc_d2 / cup_radius ** 2) ** 2)
+    
+    image = base * shade[..., None]
+    image += disc[..., None] * np.array([50, 100, 60], dtype=np.float32)
+    image += cup[..., None] * np.array([30, 60, 80], dtype=np.float32)
+    
+    # Vessels: dark ridges along wobbling angles that radiate from the disc
+    theta = np.arctan2(dy, dx)
+    rho = np.sqrt(disc_d2)
+    vessels = np.zeros_like(r2)
+    # Vessels thin out away from the disc
+    inverse_width = (rho + 0.15) / np.float32(rng.uniform(0.02, 0.04))
+    for angle in rng.uniform(-np.pi, np.pi, rng.integers(6, 11)):
+        wobble = 0.25 * np.sin(rho * rng.uniform(3, 7) + rng.uniform(0, 2 * np.pi))
+        offset = (theta - angle - wobble + np.pi) % (2 * np.pi) - np.pi
+        np.maximum(vessels, np.exp(-(offset * inverse_width) ** 2), out=vessels)
+    vessels *= rho > disc_radius * 0.5
+    image *= (1.0 - 0.45 * vessels)[..., None]
+    
+    # 'Other' pathology: scattered bright exudate-like spots
+    if label == 2:
+        for cx, cy in rng.uniform(-0.6, 0.6, (rng.integers(5, 15), 2)):
+            spread = rng.uniform(0.0003, 0.0015)
+            # Only the window around the spot is touched
+            reach = int(np.ceil(3 * np.sqrt(spread) * radius_px)) + 1
+            col, row = int(width / 2 + cx * radius_px), int(height / 2 + cy * radius_px)
+            rows = slice(max(row - reach, 0), row + reach)
+            cols = slice(max(col - reach, 0), col + reach)
+            spot = np.exp(-((x[:, cols] - cx) ** 2 + (y[rows] - cy) ** 2) / spread)
+            image[rows, cols] += spot[..., None] * np.array([40, 60, 20], dtype=np.float32)
+    
+    return image
+
+def synthesize_fundus(label, size=(224, 224), seed=0):
+    """Render one RGB uint8 fundus-like image of class `label` at size (height, width)"""
+    rng = np.random.default_rng(seed)
+    height, width = size
+    
+    scale = min(1.0, DRAW_MAX_EDGE / max(height, width))
+    image = _draw_anatomy(label, max(1, round(height * scale)), max(1, round(width * scale)), rng)
+    if scale < 1.0:
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+    
+    # Sensor noise and the field-of-view mask at full resolution
+    x, y, _ = _field_of_view(height, width)
+    image += 4 * rng.standard_normal((height, width, 1), dtype=np.float32)
+    image *= (x * x + y * y <= 1.0)[..., None]
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def generate_fundus_images(count, seed=0, sizes='model', labels=None):
+    """Yield (image, label) pairs on demand, in memory
+    
+    sizes is a SIZE_DISTRIBUTIONS name or a list of (height, width); labels
+    defaults to cycling through the three classes.
+    """
+    if isinstance(sizes, str):
+        sizes = sample_sizes(count, sizes, seed)
+    labels = labels if labels is not None else [i % len(CLASS_PREFIXES) for i in range(count)]
+    
+    for index in range(count):
+        yield synthesize_fundus(labels[index], sizes[index], seed=(seed, index)), labels[index]
+
+def _render_to_disk(out_dir, name, label, size, seed):
+    image = synthesize_fundus(label, size, seed=seed)
+    path = os.path.join(out_dir, name)
+    cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    return path
+
+def write_synthetic_dataset(out_dir, count, seed=0, sizes='model', workers=None):
+    """Render `count` images to out_dir as JPEGs in parallel
+    
+    Files are named <class>_<n>.jpg (e.g. glaucoma_3.jpg) so the filename
+    labeling of the dataset builders applies. Returns (paths, labels).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if isinstance(sizes, str):
+        sizes = sample_sizes(count, sizes, seed)
+    labels = [i % len(CLASS_PREFIXES) for i in range(count)]
+    names = [f"{CLASS_PREFIXES[label]}_{i // len(CLASS_PREFIXES)}.jpg" for i, label in enumerate(labels)]
+    
+    # NumPy and cv2 release the GIL for the heavy array work, so threads scale
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        paths = list(executor.map(
+            _render_to_disk, [out_dir] * count, names, labels, sizes,
+            [(seed, index) for index in range(count)]
+        ))
+    
+    return paths, labels
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic fundus images")
+    parser.add_argument("--count", type=int, default=150)
+    parser.add_argument("--out", default="data/raw/synthetic")
+    parser.add_argument("--sizes", choices=sorted(SIZE_DISTRIBUTIONS), default='model')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    
+    paths, _ = write_synthetic_dataset(args.out, args.count, seed=args.seed,
+                                       sizes=args.sizes, workers=args.workers)
+    print(f"Wrote {len(paths)} images to {args.out}")
+    sys.exit(0)
@@ -1,22 +1,116 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
-from torch.utils.data import DataLoader
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, TensorDataset
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.metrics import classification_report, confusion_matrix
-import seaborn as sns
 import os
 import json
+import sys
+import hashlib
+import glob
+import random
 import time
+import uuid
+import argparse
 
-from models.eye_model import ImprovedEyeSenseModel
+from models.eye_model import ImprovedEyeSenseModel, load_model_weights
 from models.data_loader import create_data_loaders
+from models.batch_augment import BatchAugment
+from models.evaluate import evaluate_model, compare_models
+from models.registry import ModelRegistry, scalar_metrics
+
+PRECISIONS = ('fp32', 'bf16')
+
+TIMING_PHASES = ('data', 'forward', 'backward', 'step')
+
+def peak_rss_mb(children=False):
+    """Peak resident set size in MB (None where unsupported)
+    
+    By default this is the main process only. With children=True it is the
+    largest peak of any finished child process; running (e.g. persistent)
+    workers are only covered by worker_peak_rss_mb.
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def live_children_peak_rss_mb():
+    """Largest peak RSS (VmHWM) of the running child processes in MB, read from
+    /proc; None where /proc is unavailable"""
+    if not os.path.isdir('/proc'):
+        return None
+    parent = os.getpid()
+    peak = 0.0
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                # The command name may contain spaces; the fields after it are fixed
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            if ppid != parent:
+                continue
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peak = max(peak, int(line.split()[1]) / 1024)
+        except (OSError, IndexError, ValueError):
+            continue  # exited meanwhile
+    return peak
+
+def worker_peak_rss_mb():
+    """Largest peak RSS of any loader worker in MB: live (e.g. persistent) workers
+    from /proc plus workers that have already exited (None where neither is available)"""
+    peaks = [peak for peak in (live_children_peak_rss_mb(), peak_rss_mb(children=True)) if peak is not None]
+    return max(peaks) if peaks else None
+
+def atomic_save(obj, path):
+    """torch.save through a temporary file so a crash never leaves a truncated file"""
+    torch.save(obj, path + '.tmp')
+    os.replace(path + '.tmp', path)
 
 class ModelTrainer:
-    def __init__(self, num_classes=3):
+    def __init__(self, num_classes=3, use_pretrained=True, batch_transform=None,
+                 precision='fp32', channels_last=False, backbone='resnet50', teacher=None,
+                 distill_temperature=4.0, distill_alpha=0.7, model=None):
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.model = ImprovedEyeSenseModel(num_classes=num_classes)
+        # Optional on-device minibatch stage (e.g. BatchAugment) for raw uint8 batches
+        self.batch_transform = batch_transform.to(self.device) if batch_transform else None
+        # An existing model (e.g. a pruned one) can be passed in to fine-tune instead
+        self.model = model if model is not None else ImprovedEyeSenseModel(
+            num_classes=num_classes, use_pretrained=use_pretrained, backbone=backbone
+        )
+        
+        # Knowledge distillation: a frozen, trained teacher provides soft labels
+        self.teacher = teacher
+        self.distill_temperature = distill_temperature
+        self.distill_alpha = distill_alpha
+        if teacher is not None:
+            teacher.to(self.device).eval()
+            for param in teacher.parameters():
+                param.requires_grad = False
+        
+        # 'bf16' runs forward passes under bfloat16 autocast (AVX512-BF16/AMX on CPU);
+        # bfloat16 keeps float32's exponent range, so no loss scaling is needed
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        self.precision = precision
+        self.channels_last = channels_last
+        if channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+            if teacher is not None:
+                teacher.to(memory_format=torch.channels_last)
+        
+        # Module used for forward passes; a DistributedDataParallel wrapper after distribute()
+        self.network = self.model
+        self.rank = 0
+        self.world_size = 1
         self.criterion = nn.CrossEntropyLoss()
         self.optimizer = optim.Adam(self.model.parameters(), lr=0.001, weight_decay=1e-4)
         self.scheduler = optim.lr_scheduler.ReduceLROnPlateau(self.optimizer, patience=5, factor=0.5)
@@ -24,72 +118,403 @@ class ModelTrainer:
         self.train_losses = []
         self.val_accuracies = []
         self.val_losses = []
+        self.best_accuracy = 0.0
+        # Both files are appended across runs; records carry the run they belong to
+        self.history_path = 'models/training_history.jsonl'
+        self.metrics_path = 'models/training_metrics.jsonl'
+        self.run_id = uuid.uuid4().hex[:12]
+        self.epoch_metrics = []
+        
+        # Checkpointing (configured by train)
+        self.global_step = 0
+        self.checkpoint_dir = None
+        self.checkpoint_every = 0
+        self.keep_checkpoints = 3
+        self.loader_rng_state = None
+    
+    @property
+    def is_main(self):
+        """Only rank 0 logs and writes checkpoints"""
+        return self.rank == 0
+    
+    def log(self, message):
+        if self.is_main:
+            print(message)
+    
+    def distribute(self, rank, world_size):
+        """Wrap the model for data-parallel training in an initialized process group
+        
+        DistributedDataParallel broadcasts rank 0's weights and all-reduces
+        gradients during backward, so every rank steps identically.
+        """
+        self.rank = rank
+        self.world_size = world_size
+        self.model.to(self.device)
+        device_ids = [self.device.index or 0] if self.device.type == 'cuda' else None
+        self.network = DistributedDataParallel(self.model, device_ids=device_ids)
+    
+    def all_reduce(self, *values):
+        """Sum per-rank scalars across the process group"""
+        if self.world_size == 1:
+            return values
+        totals = torch.tensor(values, dtype=torch.float64)
+        dist.all_reduce(totals)
+        return tuple(totals.tolist())
+    
+    def train(self, train_loader, val_loader, epochs=50, checkpoint_dir=None, checkpoint_every=0,
+              keep_checkpoints=3, resume=False):
+        """Train for `epochs` epochs
+        
+        With checkpoint_dir, full training state is checkpointed at the end of
+        every epoch and every `checkpoint_every` optimizer steps, keeping the
+        newest `keep_checkpoints` files. resume=True continues from the newest
+        checkpoint, mid-epoch included, under the run id of the resumed run.
+        """
+        if keep_checkpoints < 1:
+            raise ValueError(f"keep_checkpoints must be at least 1, got {keep_checkpoints}")
+        self.log(f"Training on {self.device} ({self.world_size} process(es))...")
+        self.model.to(self.device)
+        
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+        self.keep_checkpoints = keep_checkpoints
+        
+        start_epoch, progress = 0, None
+        if resume:
+            checkpoint = self.load_checkpoint(train_loader)
+            if checkpoint is not None:
+                start_epoch = checkpoint['epoch']
+                progress = checkpoint['progress']
+        
+        start_time = time.time()
+        
+        for epoch in range(start_epoch, epochs):
+            # Reshuffle each rank's shard differently every epoch
+            if hasattr(train_loader.sampler, 'set_epoch'):
+                train_loader.sampler.set_epoch(epoch)
+            
+            # Shuffle order of this epoch, so a mid-epoch checkpoint can replay it
+            generator = getattr(train_loader, 'generator', None)
+            self.loader_rng_state = generator.get_state() if generator is not None else None
+            
+            # Training phase
+            train_loss, train_accuracy = self.train_epoch(train_loader, epoch, epochs, progress)
+            progress = None
+            self.record_epoch_metrics(epoch + 1)
+            
+            # Validation phase
+            val_accuracy, val_loss = self.validate(val_loader)
+            
+            self.train_losses.append(train_loss)
+            self.val_accuracies.append(val_accuracy)
+            self.val_losses.append(val_loss)
+            
+            # Learning rate scheduling
+            self.scheduler.step(val_loss)
+            
+            self.log(f'\nEpoch [{epoch+1}/{epochs}]')
+            self.log(f'  Train Loss: {train_loss:.4f}, Train Acc: {train_accuracy:.4f}')
+            self.log(f'  Val Loss: {val_loss:.4f}, Val Acc: {val_accuracy:.4f}')
+            self.log(f'  LR: {self.optimizer.param_groups[0]["lr"]:.6f}')
+            
+            # Save best model (metrics are all-reduced, so every rank agrees)
+            if val_accuracy > self.best_accuracy:
+                self.best_accuracy = val_accuracy
+                if self.is_main:
+                    self.save_model('models/best_eyesense_model.pth')
+                self.log(f'  🎯 New best model saved! Accuracy: {self.best_accuracy:.4f}')
+            
+            self.append_history({
+                'epoch': epoch + 1,
+                'train_loss': train_loss,
+                'train_accuracy': train_accuracy,
+                'val_loss': val_loss,
+                'val_accuracy': val_accuracy,
+                'lr': self.optimizer.param_groups[0]['lr']
+            })
+            
+            # The next epoch starts from the loader's current shuffle state
+            if generator is not None:
+                self.loader_rng_state = generator.get_state()
+            self.save_checkpoint(epoch + 1)
+        
+        # Training completed
+        training_time = time.time() - start_time
+        self.log(f"\nTraining completed in {training_time:.2f} seconds")
+        self.log(f"Best validation accuracy: {self.best_accuracy:.4f}")
+        self.summarize_metrics()
+        
+        # Save final model
+        if self.is_main:
+            self.save_model('models/final_eyesense_model.pth')
+            self.plot_training_history()
+        
+        return self.train_losses, self.val_accuracies
+    
+    def train_epoch(self, train_loader, epoch=0, epochs=1, progress=None):
+        """Run one training pass over train_loader, returning (loss, accuracy)
+        
+        progress (from a mid-epoch checkpoint) skips the batches already
+        trained and continues their running totals.
+        """
+        self.network.train()
+        progress = dict(progress or {'batch': 0, 'running_loss': 0.0, 'correct': 0, 'total': 0})
+        
+        # Seconds per phase; 'data' is time spent waiting on the loader
+        timings = dict.fromkeys(TIMING_PHASES, 0.0)
+        timed_images = 0
+        epoch_start = tick = time.perf_counter()
+        
+        for batch_idx, (images, labels) in enumerate(train_loader):
+            if batch_idx < progress['batch']:
+                epoch_start = tick = time.perf_counter()
+                continue
+            
+            images, labels = images.to(self.device), labels.to(self.device)
+            images = self.prepare_batch(images, training=True)
+            tick = self._lap(timings, 'data', tick)
+            
+            self.optimizer.zero_grad()
+            with self.autocast():
+                outputs = self.network(images)
+                loss = self.compute_loss(outputs, labels, images)
+            tick = self._lap(timings, 'forward', tick)
+            loss.backward()
+            tick = self._lap(timings, 'backward', tick)
+            self.optimizer.step()
+            tick = self._lap(timings, 'step', tick)
+            timed_images += labels.size(0)
+            
+            progress['running_loss'] += loss.item()
+            
+            # Training accuracy
+            _, predicted = torch.max(outputs.data, 1)
+            progress['total'] += labels.size(0)
+            progress['correct'] += (predicted == labels).sum().item()
+            progress['batch'] = batch_idx + 1
+            
+            if batch_idx % 10 == 0:
+                self.log(f'Epoch {epoch+1}/{epochs}, Batch {batch_idx}/{len(train_loader)}, Loss: {loss.item():.4f}')
+            
+            self.global_step += 1
+            if self.checkpoint_every and self.global_step % self.checkpoint_every == 0:
+                self.save_checkpoint(epoch, progress)
+            
+            # Bookkeeping (loss.item, logging, checkpoints) is reported as 'other'
+            tick = time.perf_counter()
+        
+        elapsed = time.perf_counter() - epoch_start
+        self.last_epoch_timing = {
+            'images': timed_images,
+            'seconds': elapsed,
+            'images_per_sec': timed_images / elapsed if elapsed > 0 else 0.0,
+            **{f'{phase}_seconds': timings[phase] for phase in TIMING_PHASES},
+            'other_seconds': max(0.0, elapsed - sum(timings.values()))
+        }
+        
+        running_loss, batches, correct_train, total_train = self.all_reduce(
+            progress['running_loss'], len(train_loader), progress['correct'], progress['total']
+        )
+        return running_loss / batches, correct_train / total_train
+    
+    def compute_loss(self, outputs, labels, images):
+        """Training loss: cross-entropy, blended with the teacher's soft labels when distilling
+        
+        The soft term is KL(teacher || student) at temperature T, scaled by
+        T^2 so its gradients stay comparable to the hard-label term.
+        """
+        loss = self.criterion(outputs, labels)
+        if self.teacher is None:
+            return loss
+        
+        with torch.no_grad():
+            teacher_outputs = self.teacher(images)
+        T = self.distill_temperature
+        soft_loss = F.kl_div(F.log_softmax(outputs.float() / T, dim=1),
+                             F.softmax(teacher_outputs.float() / T, dim=1),
+                             reduction='batchmean') * T * T
+        return self.distill_alpha * soft_loss + (1 - self.distill_alpha) * loss
+    
+    def _lap(self, timings, phase, tick):
+        """Add the time since tick to timings[phase] and return the new tick"""
+        if self.device.type == 'cuda':
+            # Kernels run asynchronously; wait so time lands in the right phase
+            torch.cuda.synchronize(self.device)
+        now = time.perf_counter()
+        timings[phase] += now - tick
+        return now
+    
+    def record_epoch_metrics(self, epoch):
+        """Append the last epoch's timing breakdown and peak RSS to the metrics file"""
+        record = dict(self.last_epoch_timing, run_id=self.run_id, epoch=epoch, peak_rss_mb=peak_rss_mb(),
+                      worker_peak_rss_mb=worker_peak_rss_mb())
+        self.epoch_metrics.append(record)
+        
+        timing = ', '.join(f"{phase} {record[f'{phase}_seconds']:.1f}s" for phase in TIMING_PHASES)
+        self.log(f"  Throughput: {record['images_per_sec']:.1f} images/sec ({timing})")
+        
+        if self.is_main:
+            with open(self.metrics_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+    
+    def summarize_metrics(self):
+        """Print where training time went across all epochs of this run"""
+        if not self.epoch_metrics:
+            return
+        total = sum(record['seconds'] for record in self.epoch_metrics)
+        images = sum(record['images'] for record in self.epoch_metrics)
+        
+        self.log(f"\n{'Phase':<10}{'Seconds':>10}{'Share':>8}")
+        for phase in TIMING_PHASES + ('other',):
+            seconds = sum(record[f'{phase}_seconds'] for record in self.epoch_metrics)
+            self.log(f"{phase:<10}{seconds:>10.1f}{seconds / total if total else 0:>8.1%}")
+        self.log(f"Images/sec: {images / total if total else 0:.1f}")
+        rss = self.epoch_metrics[-1]['peak_rss_mb']
+        if rss is not None:
+            self.log(f"Peak RSS (main process): {rss:.0f} MB")
+        worker_rss = self.epoch_metrics[-1]['worker_peak_rss_mb']
+        if worker_rss:
+            self.log(f"Peak RSS (largest loader worker): {worker_rss:.0f} MB")
+    
+    def autocast(self):
+        """Mixed-precision context for forward passes (a no-op in fp32 mode)"""
+        return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16,
+                              enabled=self.precision == 'bf16')
+    
+    def prepare_batch(self, images, training):
+        """Apply the minibatch transform and memory layout to a batch already on the device"""
+        if self.batch_transform is not None:
+            self.batch_transform.train(training)
+            images = self.batch_transform(images)
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        return images
+    
+    def feature_cache_key(self, loader):
+        """Hash of what cached features depend on: backbone weights, input size and images"""
+        digest = hashlib.sha256(self.model.backbone_name.encode())
+        for name, tensor in self.model.backbone.state_dict().items():
+            digest.update(name.encode())
+            digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+        digest.update(str(tuple(loader.dataset[0][0].shape)).encode())
+        for path in sorted(map(str, getattr(loader.dataset, 'image_paths', []))):
+            digest.update(path.encode())
+        return digest.hexdigest()
+    
+    def extract_features(self, loader, views=1, cache_path=None):
+        """Run the frozen backbone over loader once and cache the pooled features
+        
+        With an augmenting loader, each of the `views` passes yields a
+        different augmented view of every image. A cache is only reused when
+        it was extracted with the same backbone weights, input size and images.
+        """
+        key = self.feature_cache_key(loader) if cache_path else None
+        if cache_path and os.path.exists(cache_path):
+            cached = torch.load(cache_path)
+            if (cached.get('key') == key and cached.get('views') == views
+                    and len(cached['labels']) == views * len(loader.dataset)):
+                print(f"Loaded cached features from {cache_path}")
+                return cached['features'], cached['labels']
+            print(f"Cached features in {cache_path} are stale, extracting again")
         
-    def train(self, train_loader, val_loader, epochs=50):
-        print(f"Training on {self.device}...")
         self.model.to(self.device)
+        self.model.backbone.eval()
+        all_features = []
+        all_labels = []
+        
+        with torch.inference_mode():
+            for view in range(views):
+                for images, labels in loader:
+                    images = self.prepare_batch(images.to(self.device), training=views > 1)
+                    with self.autocast():
+                        features = self.model.backbone(images)
+                    all_features.append(features.float().cpu())
+                    all_labels.append(labels)
+                print(f"Extracted features for view {view + 1}/{views}")
+        
+        features = torch.cat(all_features)
+        labels = torch.cat(all_labels)
+        
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+            torch.save({'features': features, 'labels': labels, 'views': views, 'key': key}, cache_path)
+        
+        return features, labels
+    
+    def train_head(self, train_loader, val_loader, epochs=50, views=1,
+                   cache_dir='models/feature_cache', batch_size=256, lr=0.001):
+        """Train only the classifier head on cached features of a frozen backbone
+        
+        The backbone runs once per image (per view) instead of every epoch,
+        so each epoch is just a few matrix multiplies over the cached tensors.
+        """
+        print(f"Training classifier head on {self.device} with a frozen backbone...")
+        for param in self.model.backbone.parameters():
+            param.requires_grad = False
+        
+        train_features, train_labels = self.extract_features(
+            train_loader, views=views, cache_path=os.path.join(cache_dir, f'train_features_{views}v.pt')
+        )
+        val_features, val_labels = self.extract_features(
+            val_loader, views=1, cache_path=os.path.join(cache_dir, 'val_features.pt')
+        )
+        
+        feature_loader = DataLoader(
+            TensorDataset(train_features, train_labels), batch_size=batch_size, shuffle=True
+        )
+        head = self.model.classifier.to(self.device)
+        optimizer = optim.Adam(head.parameters(), lr=lr, weight_decay=1e-4)
+        scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, patience=5, factor=0.5)
+        val_features, val_labels = val_features.to(self.device), val_labels.to(self.device)
         
         best_accuracy = 0.0
         start_time = time.time()
         
         for epoch in range(epochs):
-            # Training phase
-            self.model.train()
+            head.train()
             running_loss = 0.0
-            correct_train = 0
-            total_train = 0
             
-            for batch_idx, (images, labels) in enumerate(train_loader):
-                images, labels = images.to(self.device), labels.to(self.device)
+            for features, labels in feature_loader:
+                features, labels = features.to(self.device), labels.to(self.device)
                 
-                self.optimizer.zero_grad()
-                outputs = self.model(images)
-                loss = self.criterion(outputs, labels)
+                optimizer.zero_grad()
+                loss = self.criterion(head(features), labels)
                 loss.backward()
-                self.optimizer.step()
+                optimizer.step()
                 
                 running_loss += loss.item()
-                
-                # Training accuracy
-                _, predicted = torch.max(outputs.data, 1)
-                total_train += labels.size(0)
-                correct_train += (predicted == labels).sum().item()
-                
-                if batch_idx % 10 == 0:
-                    print(f'Epoch {epoch+1}/{epochs}, Batch {batch_idx}/{len(train_loader)}, Loss: {loss.item():.4f}')
             
-            # Validation phase
-            val_accuracy, val_loss = self.validate(val_loader)
-            train_accuracy = correct_train / total_train
-            train_loss = running_loss / len(train_loader)
+            # Validation on cached features
+            head.eval()
+            with torch.no_grad():
+                outputs = head(val_features)
+                val_loss = self.criterion(outputs, val_labels).item()
+                val_accuracy = (outputs.argmax(1) == val_labels).float().mean().item()
             
+            train_loss = running_loss / len(feature_loader)
             self.train_losses.append(train_loss)
             self.val_accuracies.append(val_accuracy)
             self.val_losses.append(val_loss)
+            scheduler.step(val_loss)
+            self.append_history({
+                'epoch': epoch + 1,
+                'train_loss': train_loss,
+                'val_loss': val_loss,
+                'val_accuracy': val_accuracy,
+                'lr': optimizer.param_groups[0]['lr']
+            })
             
-            # Learning rate scheduling
-            self.scheduler.step(val_loss)
-            
-            print(f'\nEpoch [{epoch+1}/{epochs}]')
-            print(f'  Train Loss: {train_loss:.4f}, Train Acc: {train_accuracy:.4f}')
-            print(f'  Val Loss: {val_loss:.4f}, Val Acc: {val_accuracy:.4f}')
-            print(f'  LR: {self.optimizer.param_groups[0]["lr"]:.6f}')
+            print(f'Epoch [{epoch+1}/{epochs}] Train Loss: {train_loss:.4f}, '
+                  f'Val Loss: {val_loss:.4f}, Val Acc: {val_accuracy:.4f}')
             
-            # Save best model
             if val_accuracy > best_accuracy:
                 best_accuracy = val_accuracy
                 self.save_model('models/best_eyesense_model.pth')
-                print(f'  🎯 New best model saved! Accuracy: {best_accuracy:.4f}')
         
-        # Training completed
-        training_time = time.time() - start_time
-        print(f"\nTraining completed in {training_time:.2f} seconds")
+        print(f"\nHead training completed in {time.time() - start_time:.2f} seconds")
         print(f"Best validation accuracy: {best_accuracy:.4f}")
         
-        # Save final model
         self.save_model('models/final_eyesense_model.pth')
-        self.plot_training_history()
-        
         return self.train_losses, self.val_accuracies
     
     def validate(self, val_loader):
@@ -101,34 +526,119 @@ class ModelTrainer:
         with torch.no_grad():
             for images, labels in val_loader:
                 images, labels = images.to(self.device), labels.to(self.device)
-                outputs = self.model(images)
-                loss = self.criterion(outputs, labels)
+                images = self.prepare_batch(images, training=False)
+                with self.autocast():
+                    outputs = self.model(images)
+                    loss = self.criterion(outputs, labels)
                 running_loss += loss.item()
                 
                 _, predicted = torch.max(outputs.data, 1)
                 total += labels.size(0)
                 correct += (predicted == labels).sum().item()
         
+        # Combine every rank's shard of the validation set
+        correct, total, running_loss, batches = self.all_reduce(
+            correct, total, running_loss, len(val_loader)
+        )
         accuracy = correct / total
-        avg_loss = running_loss / len(val_loader)
+        avg_loss = running_loss / batches
         
         return accuracy, avg_loss
     
     def save_model(self, path):
-        """Save model and training info"""
-        torch.save(self.model.state_dict(), path)
-        
-        # Save training history
-        history = {
-            'train_losses': self.train_losses,
-            'val_accuracies': self.val_accuracies,
-            'val_losses': self.val_losses
+        """Save model weights"""
+        atomic_save(self.model.state_dict(), path)
+        print(f"Model saved to {path}")
+    
+    def append_history(self, record):
+        """Append one epoch's metrics to the JSON-lines training history"""
+        if not self.is_main:
+            return
+        with open(self.history_path, 'a') as f:
+            f.write(json.dumps(dict(record, run_id=self.run_id)) + '\n')
+    
+    def save_checkpoint(self, epoch, progress=None):
+        """Write the full training state so train(resume=True) can continue from here
+        
+        epoch is the epoch being trained; progress is its partial state for a
+        mid-epoch checkpoint, or None once the epoch is complete.
+        """
+        if not self.checkpoint_dir or not self.is_main:
+            return
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        
+        rng = {
+            'torch': torch.get_rng_state(),
+            'numpy': np.random.get_state(),
+            'python': random.getstate(),
+            'loader': self.loader_rng_state
         }
+        if torch.cuda.is_available():
+            rng['cuda'] = torch.cuda.get_rng_state_all()
+        if self.batch_transform is not None and hasattr(self.batch_transform, 'generator'):
+            rng['batch_transform'] = self.batch_transform.generator.get_state()
         
-        with open('models/training_history.json', 'w') as f:
-            json.dump(history, f)
+        checkpoint = {
+            'run_id': self.run_id,
+            'epoch': epoch,
+            'progress': progress,
+            'global_step': self.global_step,
+            'best_accuracy': self.best_accuracy,
+            'model': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'scheduler': self.scheduler.state_dict(),
+            'history': {
+                'train_losses': self.train_losses,
+                'val_accuracies': self.val_accuracies,
+                'val_losses': self.val_losses
+            },
+            'rng': rng
+        }
+        path = os.path.join(self.checkpoint_dir, f'checkpoint_{self.global_step:08d}.pt')
+        atomic_save(checkpoint, path)
         
-        print(f"Model saved to {path}")
+        # Retain only the newest keep_checkpoints files
+        for old_path in sorted(glob.glob(os.path.join(self.checkpoint_dir, 'checkpoint_*.pt')))[:-self.keep_checkpoints]:
+            os.remove(old_path)
+    
+    def load_checkpoint(self, train_loader=None, path=None):
+        """Restore training state from path (default: newest in checkpoint_dir)
+        
+        Returns the checkpoint, or None if there is nothing to resume from.
+        """
+        if path is None:
+            paths = sorted(glob.glob(os.path.join(self.checkpoint_dir or '', 'checkpoint_*.pt')))
+            if not paths:
+                self.log("No checkpoint found, starting from scratch")
+                return None
+            path = paths[-1]
+        
+        # Our own file; it holds RNG states that weights_only loading rejects
+        checkpoint = torch.load(path, map_location=self.device, weights_only=False)
+        self.model.load_state_dict(checkpoint['model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        self.scheduler.load_state_dict(checkpoint['scheduler'])
+        self.global_step = checkpoint['global_step']
+        self.run_id = checkpoint.get('run_id', self.run_id)
+        self.best_accuracy = checkpoint['best_accuracy']
+        self.train_losses = checkpoint['history']['train_losses']
+        self.val_accuracies = checkpoint['history']['val_accuracies']
+        self.val_losses = checkpoint['history']['val_losses']
+        
+        rng = checkpoint['rng']
+        torch.set_rng_state(rng['torch'].cpu())
+        np.random.set_state(rng['numpy'])
+        random.setstate(rng['python'])
+        if 'cuda' in rng and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([state.cpu() for state in rng['cuda']])
+        if 'batch_transform' in rng and self.batch_transform is not None:
+            self.batch_transform.generator.set_state(rng['batch_transform'].cpu())
+        if rng['loader'] is not None and getattr(train_loader, 'generator', None) is not None:
+            train_loader.generator.set_state(rng['loader'].cpu())
+        
+        batch = checkpoint['progress']['batch'] if checkpoint['progress'] else 0
+        self.log(f"Resumed from {path} (epoch {checkpoint['epoch'] + 1}, batch {batch})")
+        return checkpoint
     
     def plot_training_history(self):
         """Plot training history"""
@@ -157,57 +667,146 @@ class ModelTrainer:
         plt.savefig('models/training_history.png', dpi=300, bbox_inches='tight')
         plt.show()
 
-def evaluate_model(model, test_loader, class_names):
-    """Evaluate model performance"""
-    model.eval()
-    all_predictions = []
-    all_labels = []
-    
-    with torch.no_grad():
-        for images, labels in test_loader:
-            images = images.to(model.device)
-            outputs = model(images)
-            _, predicted = torch.max(outputs, 1)
-            
-            all_predictions.extend(predicted.cpu().numpy())
-            all_labels.extend(labels.numpy())
-    
-    # Classification report
-    print("Classification Report:")
-    print(classification_report(all_labels, all_predictions, target_names=class_names))
-    
-    # Confusion matrix
-    cm = confusion_matrix(all_labels, all_predictions)
-    plt.figure(figsize=(8, 6))
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', 
-                xticklabels=class_names, yticklabels=class_names)
-    plt.title('Confusion Matrix')
-    plt.ylabel('True Label')
-    plt.xlabel('Predicted Label')
-    plt.tight_layout()
-    plt.savefig('models/confusion_matrix.png', dpi=300, bbox_inches='tight')
-    plt.show()
+def load_teacher(model_path, num_classes=3, backbone='resnet50'):
+    """Load a trained model checkpoint to distill from"""
+    teacher = ImprovedEyeSenseModel(num_classes=num_classes, use_pretrained=False, backbone=backbone)
+    return load_model_weights(teacher, model_path, torch.device('cpu'))
+
+def compare_precision_modes(train_loader, val_loader, epochs=1, num_classes=3,
+                            use_pretrained=True, batch_transform=None, seed=42):
+    """Train fresh models in float32 and in bfloat16 + channels_last and compare them
+    
+    Returns one row per mode with training throughput (images/sec) and the
+    final validation accuracy, and prints them as a table.
+    """
+    modes = [('fp32', False), ('bf16', True)]
+    rows = []
+    
+    for precision, channels_last in modes:
+        torch.manual_seed(seed)
+        trainer = ModelTrainer(num_classes=num_classes, use_pretrained=use_pretrained,
+                               batch_transform=batch_transform, precision=precision,
+                               channels_last=channels_last)
+        trainer.model.to(trainer.device)
+        
+        train_time = 0.0
+        for epoch in range(epochs):
+            start = time.time()
+            trainer.train_epoch(train_loader, epoch, epochs)
+            train_time += time.time() - start
+            val_accuracy, val_loss = trainer.validate(val_loader)
+        
+        rows.append({
+            'precision': precision,
+            'channels_last': channels_last,
+            'images_per_sec': epochs * len(train_loader.dataset) / train_time,
+            'val_accuracy': val_accuracy,
+            'val_loss': val_loss
+        })
+    
+    baseline = rows[0]['images_per_sec']
+    print(f"\n{'Mode':<22}{'Images/sec':>12}{'Speedup':>10}{'Val Acc':>10}")
+    for row in rows:
+        mode = row['precision'] + (' + channels_last' if row['channels_last'] else '')
+        print(f"{mode:<22}{row['images_per_sec']:>12.1f}{row['images_per_sec'] / baseline:>9.2f}x"
+              f"{row['val_accuracy']:>10.4f}")
+    
+    return rows
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the EyeSense model")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--mode", choices=['full', 'head'], default='full',
+                        help="'head' freezes the backbone and trains the classifier on cached features")
+    parser.add_argument("--feature-views", type=int, default=1,
+                        help="Augmented views per training image to cache in head mode")
+    parser.add_argument("--batch-augment", action="store_true",
+                        help="Augment whole minibatches on the device instead of per sample")
+    parser.add_argument("--precision", choices=PRECISIONS, default='fp32',
+                        help="'bf16' trains under bfloat16 autocast")
+    parser.add_argument("--channels-last", action="store_true",
+                        help="Use the channels_last (NHWC) memory format")
+    parser.add_argument("--compare-precision", action="store_true",
+                        help="Benchmark fp32 against bf16 + channels_last and exit")
+    parser.add_argument("--backbone", default='resnet50',
+                        help="resnet50, resnet18, mobilenet_v3_small, mobilenet_v3_large or efficientnet_b0")
+    parser.add_argument("--teacher", default=None,
+                        help="Trained ResNet50 checkpoint to distill the --backbone student from")
+    parser.add_argument("--distill-temperature", type=float, default=4.0)
+    parser.add_argument("--distill-alpha", type=float, default=0.7,
+                        help="Weight of the teacher's soft labels in the loss")
+    parser.add_argument("--roi-crop", action="store_true",
+                        help="Crop images to the optic disc before resizing")
+    parser.add_argument("--checkpoint-dir", default='models/checkpoints')
+    parser.add_argument("--checkpoint-every", type=int, default=0,
+                        help="Also checkpoint every N optimizer steps (0 = once per epoch)")
+    parser.add_argument("--keep-checkpoints", type=int, default=3)
+    parser.add_argument("--profile", default='auto',
+                        help="Data loader profile: serial, parallel or auto (parallel with spare cores)")
+    parser.add_argument("--data-path", default="data/raw",
+                        help="Dataset directory, or a .zip archive read without extracting")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Decode and resize images once into a memory-mapped cache here")
+    parser.add_argument("--register", action="store_true",
+                        help="Add the final model to the model registry and make it the served version")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the newest checkpoint in --checkpoint-dir")
+    args = parser.parse_args()
+    
     try:
         # Create data loaders
-        train_loader, val_loader, class_names = create_data_loaders(batch_size=16)
+        augment = 'batch' if args.batch_augment else 'sample'
+        train_loader, val_loader, class_names = create_data_loaders(
+            batch_size=args.batch_size, data_path=args.data_path, cache_dir=args.cache_dir,
+            augment=augment, roi_crop=args.roi_crop, profile=args.profile
+        )
         
         print(f"Training with {len(class_names)} classes: {class_names}")
         print(f"Training samples: {len(train_loader.dataset)}")
         print(f"Validation samples: {len(val_loader.dataset)}")
         
         # Train model
-        trainer = ModelTrainer(num_classes=len(class_names))
-        train_losses, val_accuracies = trainer.train(train_loader, val_loader, epochs=20)
+        batch_transform = BatchAugment(seed=42) if args.batch_augment else None
+        
+        if args.compare_precision:
+            compare_precision_modes(train_loader, val_loader, epochs=args.epochs,
+                                    num_classes=len(class_names), batch_transform=batch_transform)
+            sys.exit(0)
+        
+        teacher = load_teacher(args.teacher, num_classes=len(class_names)) if args.teacher else None
+        trainer = ModelTrainer(num_classes=len(class_names), batch_transform=batch_transform,
+                               precision=args.precision, channels_last=args.channels_last,
+                               backbone=args.backbone, teacher=teacher,
+                               distill_temperature=args.distill_temperature,
+                               distill_alpha=args.distill_alpha)
+        if args.mode == 'head':
+            train_losses, val_accuracies = trainer.train_head(
+                train_loader, val_loader, epochs=args.epochs, views=args.feature_views
+            )
+        else:
+            train_losses, val_accuracies = trainer.train(
+                train_loader, val_loader, epochs=args.epochs, checkpoint_dir=args.checkpoint_dir,
+                checkpoint_every=args.checkpoint_every, keep_checkpoints=args.keep_checkpoints,
+                resume=args.resume
+            )
         
         print("Training completed!")
         print(f"Final Validation Accuracy: {val_accuracies[-1]:.4f}")
         
         # Evaluate model
         print("\nEvaluating model...")
-        evaluate_model(trainer.model, val_loader, class_names)
+        report = evaluate_model(trainer.model, val_loader, class_names, batch_transform=batch_transform)
+        
+        if args.register:
+            ModelRegistry().register('models/final_eyesense_model.pth', backbone=args.backbone,
+                                     num_classes=len(class_names), roi_crop=args.roi_crop,
+                                     metrics=scalar_metrics(report), promote=True)
         
+        if teacher is not None:
+            compare_models({'teacher (resnet50)': teacher, f'student ({args.backbone})': trainer.model},
+                           val_loader, class_names, batch_transform=batch_transform)
+    
     except Exception as e:
         print(f"Error during training: {e}")
-        print("Make sure the dataset is properly set up in data/raw/")
\ No newline at end of file
+        print(f"Make sure the dataset is properly set up in {args.data_path}")
@@ -0,0 +1,96 @@
+import os
+import zipfile
+from torch.utils.data import Dataset
+import cv2
+import numpy as np
+
+from models.dataset_manifest import (ANNOTATION_NAMES, IMAGE_EXTENSIONS, label_from_filename, load_odir_labels,
+                                     select_annotated, drop_duplicates)
+
+def index_zip_dataset(zip_path):
+    """List the images of a dataset archive and their labels from its central directory
+    
+    Labels are joined from the ODIR annotation sheet inside the archive when
+    there is one (and unannotated images are skipped), otherwise they come
+    from the filename. Copies with the same CRC and size are listed once.
+    Nothing is extracted.
+    Returns (members, labels, class_names) like prepare_eye_dataset.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        infos = {info.filename: info for info in archive.infolist() if not info.is_dir()}
+        names = sorted(infos)
+        members = [name for name in names if name.lower().endswith(IMAGE_EXTENSIONS)]
+        
+        odir_labels = {}
+        sheets = [name for name in names if os.path.basename(name) in ANNOTATION_NAMES]
+        if sheets:
+            with archive.open(sheets[0]) as sheet:
+                odir_labels = load_odir_labels(sheet)
+    
+    members = select_annotated(members, odir_labels)
+    members = drop_duplicates(members, {name: (infos[name].CRC, infos[name].file_size) for name in members})
+    labels = [odir_labels.get(os.path.basename(member), label_from_filename(member)) for member in members]
+    
+    print(f"Found {len(members)} images in {zip_path}")
+    print(f"Class distribution: Normal: {labels.count(0)}, Glaucoma: {labels.count(1)}, Other: {labels.count(2)}")
+    
+    return members, labels, ['Normal', 'Glaucoma', 'Other']
+
+class ZipEyeDataset(Dataset):
+    """EyeDataset equivalent that decodes images straight out of a zip archive
+    
+    Each loader worker opens its own handle on the archive, so reads are
+    independent seeks to the member's offset, with no extracted copy on disk.
+    """
+    
+    def __init__(self, zip_path, members, labels, transform=None):
+        self.zip_path = zip_path
+        self.image_paths = members
+        self.labels = labels
+        self.transform = transform
+        self.class_names = ['Normal', 'Glaucoma', 'Other']
+        
+        # Opened lazily (per process) because ZipFile handles can't be shared
+        self._archive = None
+        self._archive_pid = None
+    
+    def _open_archive(self):
+        self._archive = zipfile.ZipFile(self.zip_path)
+        self._archive_pid = os.getpid()
+    
+    def __len__(self):
+        return len(self.image_paths)
+    
+    def __getitem__(self, idx):
+        member = self.image_paths[idx]
+        label = self.labels[idx]
+        
+        if self._archive is None or self._archive_pid != os.getpid():
+            self._open_archive()
+        
+        try:
+            data = np.frombuffer(self._archive.read(member), dtype=np.uint8)
+            image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError(f"Could not decode image: {member}")
+            
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            
+            if self.transform:
+                image = self.transform(image=image)['image']
+            
+            return image, label
+        
+        except Exception as e:
+            print(f"Error loading image {member}: {e}")
+            # Return a dummy image if loading fails
+            dummy_image = np.ones((224, 224, 3), dtype=np.uint8) * 128
+            if self.transform:
+                dummy_image = self.transform(image=dummy_image)['image']
+            return dummy_image, label
+    
+    def __getstate__(self):
+        # Don't ship the open archive to worker processes
+        state = self.__dict__.copy()
+        state['_archive'] = None
+        return state
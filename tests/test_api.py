@@ -0,0 +1,296 @@
+import pytest
+import sys
+import os
+import io
+import time
+import numpy as np
+from PIL import Image
+from fastapi.testclient import TestClient
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backend.main
+from backend.main import app, served_model
+from backend.config import config
+from backend.serving import ServedModel
+from backend.analysis import analyze_image_array
+from backend.workers import plan_cpu_affinity, run_workers
+from backend.similarity import CaseIndex
+from models.registry import ModelRegistry
+from models.cascade import CascadePredictor
+from frontend.utils import prepare_upload_image
+
+client = TestClient(app)
+predictor = served_model.current()[0]
+
+def make_jpeg(width, height):
+    """Encode a random RGB image as JPEG bytes"""
+    image = Image.fromarray(np.random.randint(0, 255, (height, width, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def test_prepare_upload_image_downscales():
+    """Test client-side downscale before upload"""
+    image = Image.open(io.BytesIO(make_jpeg(1600, 1200)))
+
+    data, downscaled = prepare_upload_image(image, max_edge=512, quality=85)
+
+    assert downscaled
+    assert max(Image.open(io.BytesIO(data)).size) == 512
+
+    small = Image.open(io.BytesIO(make_jpeg(300, 200)))
+    data, downscaled = prepare_upload_image(small, max_edge=512)
+    assert not downscaled
+
+def test_analyze_accepts_downscaled_header():
+    """Test the backend records client-side downscaling"""
+    files = {"file": ("image.jpg", make_jpeg(512, 384), "image/jpeg")}
+    headers = {"X-Image-Downscaled": "true", "X-Original-Size": "2048x1536"}
+
+    response = client.post("/api/analyze-eye", files=files, headers=headers)
+
+    assert response.status_code == 200
+    image_info = response.json()['image_info']
+    assert image_info['client_downscaled'] is True
+    assert image_info['original_size'] == [2048, 1536]
+    assert image_info['size'] == [384, 512, 3]
+
+def test_user_summary_tracks_analyses():
+    """Test per-user aggregates are maintained as analyses are saved"""
+    files = {"file": ("image.jpg", make_jpeg(224, 224), "image/jpeg")}
+    for _ in range(3):
+        assert client.post("/api/analyze-eye?user_id=summary_user", files=files).status_code == 200
+
+    summary = client.get("/api/user-summary/summary_user").json()
+
+    assert summary['analysis_count'] == 3
+    assert sum(summary['risk_counts'].values()) == 3
+    assert abs(sum(summary['mean_probabilities']) - 1.0) < 0.01
+    assert 0 <= summary['ewma_risk_score'] <= 2
+    assert summary['last_seen'] is not None
+
+    assert client.get("/api/user-summary/unknown_user").json()['analysis_count'] == 0
+
+def test_in_process_result_matches_api():
+    """Test the in-process pipeline returns the same structure as the API"""
+    data = make_jpeg(320, 240)
+    api_result = client.post("/api/analyze-eye", files={"file": ("image.jpg", data, "image/jpeg")}).json()
+
+    image_np = np.array(Image.open(io.BytesIO(data)))
+    local_predictor, model_version = served_model.current()
+    local_result = analyze_image_array(image_np, local_predictor, model_version=model_version)
+
+    # Saved analyses also carry their id
+    assert set(local_result) == set(api_result) - {'analysis_id'}
+    assert local_result['image_info'].keys() == api_result['image_info'].keys()
+    assert local_result['image_info']['size'] == api_result['image_info']['size']
+    assert local_result['model_version'] == api_result['model_version']
+
+def test_worker_cpu_plan_does_not_overlap():
+    """Test worker CPU slices cover every core exactly once"""
+    plan = plan_cpu_affinity(3, cpus=range(8))
+
+    assert [len(cpus) for cpus in plan] == [3, 3, 2]
+    assert sorted(cpu for cpus in plan for cpu in cpus) == list(range(8))
+    assert plan_cpu_affinity(4, cpus=[0, 1]) == [[0], [1], [0], [1]]
+
+def test_multiple_workers_require_opt_in():
+    """Test the launcher refuses to split per-process state across workers by default"""
+    with pytest.raises(ValueError):
+        run_workers(2, "127.0.0.1", 0)
+
+class StubStage:
+    """Cascade stage answering with preset confidences after a fixed delay"""
+
+    classes = ['Normal', 'Slightly High', 'High']
+
+    def __init__(self, confidences, seconds=0.0, embedding=None):
+        self.confidences = list(confidences)
+        self.seconds = seconds
+        self.embedding = embedding
+
+    def predict(self, image, tta=None):
+        time.sleep(self.seconds)
+        return {'risk_level': 'Normal', 'confidence': self.confidences.pop(0), 'embedding': self.embedding}
+
+    def analyze_image_quality(self, image):
+        return {'quality_score': 1.0, 'is_acceptable': True}
+
+def test_cascade_metrics_endpoint(monkeypatch):
+    """Test the cascade metrics endpoint reports escalations and the latency they saved"""
+    assert client.get("/api/cascade-metrics").json()['enabled'] == hasattr(predictor, 'metrics')
+
+    cascade = CascadePredictor(StubStage([0.95, 0.5, 0.99, 0.6]), StubStage([0.8, 0.8], seconds=0.05),
+                               threshold=0.9)
+    image = np.zeros((8, 8, 3), dtype=np.uint8)
+    assert [cascade.predict(image)['stage'] for _ in range(4)] == ['screener', 'full', 'screener', 'full']
+    monkeypatch.setattr(served_model, '_current', (cascade, 'stub'))
+
+    response = client.get("/api/cascade-metrics")
+
+    assert response.status_code == 200
+    metrics = response.json()
+    assert metrics['enabled'] and metrics['model_version'] == 'stub'
+    assert metrics['requests'] == 4 and metrics['escalations'] == 2
+    assert metrics['escalation_rate'] == 0.5
+    # Two screener answers each skipped one ~50 ms full-model run
+    assert metrics['mean_full_ms'] >= 50
+    assert 90 < metrics['latency_saved_ms'] <= 2 * metrics['mean_full_ms']
+
+    # A full-model embedding for a similar-case query is extra work that eats into the saving
+    cascade.full_model.confidences.append(0.8)
+    cascade.embed(image)
+    metrics = client.get("/api/cascade-metrics").json()
+    assert metrics['embed_ms'] >= 50
+    assert metrics['latency_saved_ms'] <= 2 * metrics['mean_full_ms'] - metrics['embed_ms']
+
+def test_cascade_screener_shares_the_served_model(tmp_path, monkeypatch):
+    """Test the default screener reuses the ensemble instead of loading MODEL_PATH"""
+    import torch
+    from models.eye_model import ImprovedEyeSenseModel
+    from backend.analysis import load_predictor
+    weights = str(tmp_path / 'model.pth')
+    torch.save(ImprovedEyeSenseModel(use_pretrained=False, backbone='resnet18').state_dict(), weights)
+    monkeypatch.setattr(config, 'ENSEMBLE_MODEL_PATHS', [weights, weights])
+    monkeypatch.setattr(config, 'MODEL_PATH', str(tmp_path / 'missing.pth'))
+    monkeypatch.setattr(config, 'MODEL_BACKBONE', 'resnet18')
+    monkeypatch.setattr(config, 'CASCADE_ENABLED', True)
+    monkeypatch.setattr(config, 'SCREENER_MODEL_PATH', '')
+
+    cascade = load_predictor()
+    assert cascade.screener.model is cascade.full_model.model
+
+    monkeypatch.setattr(config, 'SCREENER_MODEL_PATH', str(tmp_path / 'missing_screener.pth'))
+    with pytest.raises(FileNotFoundError):
+        load_predictor()
+
+def test_screener_answers_are_indexed_without_the_full_model(monkeypatch):
+    """Test screener answers are indexed with the screener's embedding and found again"""
+    # The full model has no answers queued, so running it would fail
+    cascade = CascadePredictor(StubStage([0.99, 0.99], embedding=np.ones(4)),
+                               StubStage([], embedding=np.ones(8)), threshold=0.9)
+    monkeypatch.setattr(served_model, '_current', (cascade, 'stub'))
+    files = {"file": ("image.jpg", make_jpeg(64, 64), "image/jpeg")}
+
+    saved = client.post("/api/analyze-eye?user_id=screened_user", files=files).json()
+    assert saved['analysis_result']['stage'] == 'screener'
+    assert len(backend.main.case_indexes[('stub', 'screener')]) == 1
+
+    body = client.post("/api/similar-cases", files=files).json()
+    assert body['cases'][0]['analysis_id'] == saved['analysis_id']
+    assert body['cases'][0]['stage'] == 'screener' and list(body['index']['stages']) == ['screener']
+
+def test_case_index_switches_to_ivf():
+    """Test the similar-case index finds near-duplicates both flat and after the IVF build"""
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 64))
+    embeddings = centers[rng.integers(0, 20, 600)] + 0.1 * rng.standard_normal((600, 64))
+    index = CaseIndex(ivf_threshold=400, nprobe=4, background=False)
+
+    for i, embedding in enumerate(embeddings[:300]):
+        index.add(embedding, {'analysis_id': f'case_{i}'})
+    assert index.stats()['mode'] == 'flat'
+    top = index.search(embeddings[7] * 3, k=3)
+    assert top[0]['case_id'] == 7 and top[0]['analysis_id'] == 'case_7'
+    assert abs(top[0]['similarity'] - 1.0) < 1e-2
+
+    for embedding in embeddings[300:]:
+        index.add(embedding)
+    stats = index.stats()
+    assert stats['mode'] == 'ivf' and stats['cases'] == 600 and stats['lists'] == 20
+    hits = sum(index.search(embeddings[i], k=1)[0]['case_id'] == i for i in range(0, 600, 10))
+    assert hits >= 57
+
+    with pytest.raises(ValueError):
+        index.add(np.ones(32))
+
+def test_similar_cases_endpoint():
+    """Test saved analyses are indexed and an identical image is the closest case"""
+    data = make_jpeg(256, 256)
+    files = {"file": ("image.jpg", data, "image/jpeg")}
+    saved = client.post("/api/analyze-eye?user_id=similar_user", files=files)
+    assert saved.status_code == 200
+    again = client.post("/api/analyze-eye?user_id=similar_user", files=files)
+    assert again.json()['analysis_id'] != saved.json()['analysis_id']
+    history = client.get("/api/user-history/similar_user").json()['history']
+    assert [entry['analysis_id'] for entry in history] == [saved.json()['analysis_id'], again.json()['analysis_id']]
+
+    response = client.post("/api/similar-cases?k=3", files=files)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body['cases'][0]['user_id'] == 'similar_user'
+    ids = {saved.json()['analysis_id'], again.json()['analysis_id']}
+    assert {case['analysis_id'] for case in body['cases'][:2]} == ids
+    assert body['cases'][0]['similarity'] > 0.99
+    assert body['index']['cases'] >= 1 and body['search_ms'] >= 0
+    assert 'embedding' not in client.post("/api/analyze-eye", files=files).json()['analysis_result']
+    assert client.post("/api/similar-cases?k=0", files=files).status_code == 422
+    assert client.post("/api/similar-cases?k=1000", files=files).status_code == 422
+
+def test_model_registry_hot_reload(tmp_path, monkeypatch):
+    """Test registry versions are swapped in without disturbing the old model and named in responses"""
+    import torch
+    from models.eye_model import ImprovedEyeSenseModel
+    weights = str(tmp_path / 'model.pth')
+    torch.save(ImprovedEyeSenseModel(use_pretrained=False, backbone='resnet18').state_dict(), weights)
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    registry.register(weights, backbone='resnet18', image_size=64, metrics={'accuracy': 0.5})
+
+    served = ServedModel(registry)
+    assert served.version == 'v0001'
+    old_predictor, _ = served.current()
+
+    registry.register(weights, backbone='resnet18', image_size=64, promote=True)
+    assert served.check_for_update() and served.version == 'v0002'
+    assert 'error' not in old_predictor.predict(np.zeros((64, 64, 3), dtype=np.uint8))
+
+    # A broken artifact is rejected and the served model stays in place
+    broken = tmp_path / 'broken.pth'
+    broken.write_bytes(b'not a checkpoint')
+    registry.register(str(broken), backbone='resnet18', image_size=64)
+    with pytest.raises(Exception):
+        served.reload('v0003')
+    assert served.version == 'v0002'
+
+    monkeypatch.setattr(backend.main, 'served_model', served)
+    monkeypatch.setattr(config, 'ADMIN_TOKEN', 'secret')
+    assert client.post("/api/admin/reload-model?version=v0001").status_code == 403
+    response = client.post("/api/admin/reload-model?version=v0001", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200 and response.json()['model_version'] == 'v0001'
+    assert registry.current() == 'v0001'
+
+    response = client.post("/api/analyze-eye", files={"file": ("image.jpg", make_jpeg(96, 96), "image/jpeg")})
+    assert response.json()['model_version'] == 'v0001'
+    assert response.headers['X-Model-Version'] == 'v0001'
+    models = client.get("/api/models").json()
+    assert models['serving'] == 'v0001' and [m['version'] for m in models['versions']] == ['v0001', 'v0002', 'v0003']
+    assert models['versions'][0]['metrics'] == {'accuracy': 0.5}
+
+def test_registry_versions_use_the_configured_composition(tmp_path, monkeypatch):
+    """Test registry versions are served with the configured ensemble heads and cascade"""
+    import torch
+    from models.eye_model import ImprovedEyeSenseModel
+    model = ImprovedEyeSenseModel(use_pretrained=False, backbone='resnet18')
+    weights, head = str(tmp_path / 'model.pth'), str(tmp_path / 'head.pth')
+    torch.save(model.state_dict(), weights)
+    torch.nn.init.normal_(model.classifier[-1].weight)
+    torch.save(model.state_dict(), head)
+    registry = ModelRegistry(str(tmp_path / 'registry'))
+    registry.register(weights, backbone='resnet18', image_size=64, promote=True)
+    monkeypatch.setattr(config, 'ENSEMBLE_MODEL_PATHS', [head])
+    monkeypatch.setattr(config, 'CASCADE_ENABLED', True)
+    monkeypatch.setattr(config, 'SCREENER_MODEL_PATH', '')
+
+    served = ServedModel(registry)
+
+    cascade, version = served.current()
+    assert version == 'v0001' and isinstance(cascade, CascadePredictor)
+    assert cascade.screener.model is cascade.full_model.model
+    result = cascade.full_model.predict(np.zeros((64, 64, 3), dtype=np.uint8))
+    assert result['ensemble_size'] == 2
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,13 +1,39 @@
 import pytest
 import sys
 import os
+import glob
+import json
+import time
+import shutil
 import numpy as np
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from models.eye_model import GlaucomaRiskPredictor
-from models.data_loader import create_synthetic_samples
+import torch
+
+from models.eye_model import GlaucomaRiskPredictor, ImprovedEyeSenseModel, BACKBONES, TTA_VIEWS, tta_batch
+from models.data_loader import create_synthetic_samples, create_data_loaders
+from models.zip_dataset import index_zip_dataset
+from models.dataset_cache import build_dataset_cache, CachedEyeDataset
+from models import dataset_manifest
+from models.train_model import ModelTrainer, compare_precision_modes, live_children_peak_rss_mb
+from models.batch_augment import BatchAugment
+from models.distributed_train import launch_distributed_training
+from models.evaluate import evaluate_model, compare_models
+from models.cascade import CascadePredictor
+from models.ensemble import load_ensemble
+from models import roi
+from models.prune import prune_model, count_flops, pruning_report, save_pruned_model, load_pruned_model
+from models.synthetic import generate_fundus_images, sample_sizes, write_synthetic_dataset
+
+@pytest.fixture(autouse=True)
+def manifest_dir(tmp_path_factory, monkeypatch):
+    """Keep dataset manifests built by tests out of the working tree"""
+    directory = str(tmp_path_factory.mktemp('manifests'))
+    monkeypatch.setattr(dataset_manifest, 'MANIFEST_DIR', directory)
+    # Spawned training processes import the module again
+    monkeypatch.setenv('EYESENSE_MANIFEST_DIR', directory)
 
 def test_model_initialization():
     """Test model initialization"""
@@ -73,5 +99,551 @@ def test_synthetic_data_creation():
     assert len(glaucoma_images) > 0
     assert len(other_images) > 0
 
+def test_memory_mapped_weight_loading(tmp_path):
+    """Test trained weights load through the shared memory-mapped path"""
+    model = ImprovedEyeSenseModel(use_pretrained=False)
+    model_path = str(tmp_path / "model.pth")
+    torch.save(model.state_dict(), model_path)
+    
+    predictor = GlaucomaRiskPredictor(model_path=model_path)
+    
+    for name, tensor in model.state_dict().items():
+        assert torch.equal(tensor, predictor.model.state_dict()[name])
+    
+    test_image = np.random.randint(0, 255, (224, 224, 3), dtype=np.uint8)
+    assert 'error' not in predictor.predict(test_image)
+
+def test_parallel_loader_is_reproducible(tmp_path):
+    """Test seeded worker augmentation repeats across parallel loaders"""
+    import cv2
+    for i in range(5):
+        for name in ['normal', 'glaucoma', 'other']:
+            image = np.random.randint(0, 255, (64, 64, 3), dtype=np.uint8)
+            cv2.imwrite(str(tmp_path / f"{name}_{i}.jpg"), image)
+    
+    profile = {'num_workers': 2, 'prefetch_factor': 2, 'persistent_workers': False}
+    batches = []
+    for _ in range(2):
+        train_loader, _, _ = create_data_loaders(batch_size=4, data_path=str(tmp_path), profile=profile)
+        assert train_loader.num_workers == 2
+        batches.append(next(iter(train_loader)))
+    
+    assert torch.equal(batches[0][0], batches[1][0])
+    assert torch.equal(batches[0][1], batches[1][1])
+
+def test_dataset_cache_incremental_build(tmp_path):
+    """Test the memmap cache serves resized images and only adds new files"""
+    import cv2
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    paths = []
+    for i in range(3):
+        path = str(image_dir / f"normal_{i}.png")
+        cv2.imwrite(path, np.full((300, 400, 3), i * 50, dtype=np.uint8))
+        paths.append(path)
+    
+    cache_dir = str(tmp_path / "cache")
+    manifest = build_dataset_cache(paths, [0, 1, 2], cache_dir=cache_dir, image_size=64)
+    assert len(manifest['shards']) == 1
+    
+    new_path = str(image_dir / "glaucoma_0.png")
+    cv2.imwrite(new_path, np.full((100, 100, 3), 200, dtype=np.uint8))
+    manifest = build_dataset_cache(paths + [new_path], [0, 1, 2, 1], cache_dir=cache_dir, image_size=64)
+    assert [shard['count'] for shard in manifest['shards']] == [3, 1]
+    
+    dataset = CachedEyeDataset(cache_dir, image_paths=[paths[2], new_path])
+    image, label = dataset[0]
+    assert image.shape == (64, 64, 3)
+    assert int(image[0, 0, 0]) == 100 and label == 2
+    assert int(dataset[1][0][0, 0, 0]) == 200 and dataset[1][1] == 1
+    
+    # A corrupt image is recorded once, not retried into a new shard on every build
+    broken_path = str(image_dir / "glaucoma_broken.jpg")
+    with open(broken_path, 'wb') as f:
+        f.write(b'not an image')
+    index_mtimes = []
+    for _ in range(2):
+        manifest = build_dataset_cache(paths + [new_path, broken_path], [0, 1, 2, 1, 1],
+                                       cache_dir=cache_dir, image_size=64)
+        assert list(manifest['failed']) == [os.path.abspath(broken_path)]
+        assert [shard['count'] for shard in manifest['shards']] == [3, 1]
+        index_mtimes.append(os.stat(os.path.join(cache_dir, 'index.npz')).st_mtime_ns)
+    assert not os.path.exists(os.path.join(cache_dir, 'shard_002.npy'))
+    # An unchanged build does not rewrite the index readers may be loading
+    assert index_mtimes[0] == index_mtimes[1]
+
+def test_cached_loaders_skip_undecodable_images(tmp_path, monkeypatch):
+    """Test one corrupt file is left out of the split instead of stopping training"""
+    monkeypatch.chdir(tmp_path)
+    write_synthetic_dataset('data/fundus', 20, seed=0, sizes='model')
+    with open('data/fundus/glaucoma_broken.jpg', 'wb') as f:
+        f.write(b'not an image')
+    
+    train_loader, val_loader, _ = create_data_loaders(batch_size=4, data_path='data/fundus', cache_dir='data/cache')
+    
+    assert len(train_loader.dataset) + len(val_loader.dataset) == 20
+    
+    # Ranks that did not build the cache only read it
+    train_loader, _, _ = create_data_loaders(batch_size=4, data_path='data/fundus', cache_dir='data/cache',
+                                             build_cache=False)
+    assert len(train_loader.dataset) == 16
+    with pytest.raises(ValueError):
+        create_data_loaders(batch_size=4, data_path='data/fundus', cache_dir='data/missing', build_cache=False)
+
+def test_train_head_on_cached_features(tmp_path, monkeypatch):
+    """Test head-only training extracts backbone features once and reuses them"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('models')
+    dataset = torch.utils.data.TensorDataset(torch.randn(6, 3, 64, 64), torch.tensor([0, 1, 2, 0, 1, 2]))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=3)
+    
+    trainer = ModelTrainer(use_pretrained=False)
+    backbone_before = {k: v.clone() for k, v in trainer.model.backbone.state_dict().items()}
+    trainer.train_head(loader, loader, epochs=2, views=2, cache_dir='features')
+    
+    cached = torch.load('features/train_features_2v.pt')
+    assert cached['features'].shape == (12, 2048)
+    assert len(trainer.val_accuracies) == 2
+    assert os.path.exists('models/best_eyesense_model.pth')
+    for name, tensor in trainer.model.backbone.state_dict().items():
+        assert torch.equal(tensor, backbone_before[name])
+    
+    # A different backbone must not reuse the cached features
+    stale = torch.load('features/val_features.pt')['features']
+    other = ModelTrainer(use_pretrained=False)
+    features, _ = other.extract_features(loader, views=1, cache_path='features/val_features.pt')
+    assert not torch.equal(features, stale)
+    assert torch.load('features/val_features.pt')['key'] == other.feature_cache_key(loader)
+    assert trainer.feature_cache_key(loader) != other.feature_cache_key(loader)
+
+def test_batch_augment_is_seeded_and_normalizes():
+    """Test minibatch augmentation repeats per seed and matches eval normalization"""
+    images = torch.randint(0, 256, (8, 3, 32, 32), dtype=torch.uint8)
+    
+    first = BatchAugment(seed=7)(images)
+    second = BatchAugment(seed=7)(images)
+    assert first.shape == (8, 3, 32, 32) and first.dtype == torch.float32
+    assert torch.equal(first, second)
+    
+    # Eval mode only normalizes, identical to the albumentations Normalize step
+    augment = BatchAugment().eval()
+    expected = (images.float() / 255 - torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)) \
+        / torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+    assert torch.allclose(augment(images.permute(0, 2, 3, 1)), expected, atol=1e-5)
+    
+    # With every augmentation forced on, flips and rotations change the batch
+    forced = BatchAugment(flip_p=1.0, rotate_p=1.0, brightness_contrast_p=1.0, seed=0)
+    assert not torch.allclose(forced(images), augment(images))
+
+def test_bf16_channels_last_comparison():
+    """Test the bfloat16 + channels_last path trains and is compared to fp32"""
+    dataset = torch.utils.data.TensorDataset(torch.randn(4, 3, 64, 64), torch.tensor([0, 1, 2, 0]))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2)
+    
+    rows = compare_precision_modes(loader, loader, epochs=1, use_pretrained=False)
+    
+    assert [row['precision'] for row in rows] == ['fp32', 'bf16']
+    assert rows[1]['channels_last']
+    for row in rows:
+        assert row['images_per_sec'] > 0
+        assert 0 <= row['val_accuracy'] <= 1
+        assert np.isfinite(row['val_loss'])
+
+def test_distributed_training_on_cpu(tmp_path, monkeypatch):
+    """Test two gloo processes train together and only rank 0 saves"""
+    import cv2
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('models')
+    os.makedirs('data')
+    for i in range(4):
+        for name in ['normal', 'glaucoma', 'other']:
+            image = np.random.randint(0, 255, (64, 64, 3), dtype=np.uint8)
+            cv2.imwrite(f"data/{name}_{i}.jpg", image)
+    
+    launch_distributed_training(nproc=2, epochs=1, batch_size=2, data_path='data', use_pretrained=False)
+    
+    assert os.path.exists('models/best_eyesense_model.pth')
+    assert os.path.exists('models/final_eyesense_model.pth')
+    state_dict = torch.load('models/final_eyesense_model.pth')
+    assert not any(key.startswith('module.') for key in state_dict)
+
+def test_resume_from_mid_epoch_checkpoint(tmp_path, monkeypatch):
+    """Test resuming from a mid-epoch checkpoint reproduces an uninterrupted run"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('models')
+    dataset = torch.utils.data.TensorDataset(torch.randn(6, 3, 64, 64), torch.tensor([0, 1, 2, 0, 1, 2]))
+    
+    def make_loader():
+        return torch.utils.data.DataLoader(dataset, batch_size=2, shuffle=True,
+                                           generator=torch.Generator().manual_seed(0))
+    
+    torch.manual_seed(0)
+    trainer = ModelTrainer(use_pretrained=False)
+    trainer.train(make_loader(), make_loader(), epochs=2, checkpoint_dir='checkpoints',
+                  checkpoint_every=1, keep_checkpoints=10)
+    assert len(glob.glob('checkpoints/checkpoint_*.pt')) == 6
+    
+    # Simulate a crash after the first batch of epoch 2
+    for path in sorted(glob.glob('checkpoints/checkpoint_*.pt'))[4:]:
+        os.remove(path)
+    
+    resumed = ModelTrainer(use_pretrained=False)
+    resumed.train(make_loader(), make_loader(), epochs=2, checkpoint_dir='checkpoints',
+                  checkpoint_every=1, keep_checkpoints=2, resume=True)
+    
+    assert resumed.global_step == 6
+    assert len(resumed.train_losses) == 2
+    assert len(glob.glob('checkpoints/checkpoint_*.pt')) == 2
+    for name, tensor in trainer.model.state_dict().items():
+        assert torch.allclose(tensor.float(), resumed.model.state_dict()[name].float(), atol=1e-6), name
+    
+    # History is appended per epoch: 2 epochs, then epoch 2 again after the resume, all one run
+    with open('models/training_history.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert [record['epoch'] for record in records] == [1, 2, 2]
+    assert {record['run_id'] for record in records} == {trainer.run_id} == {resumed.run_id}
+    
+    with pytest.raises(ValueError):
+        ModelTrainer(use_pretrained=False).train(make_loader(), make_loader(), epochs=1,
+                                                 checkpoint_dir='checkpoints', keep_checkpoints=0)
+
+def test_training_records_step_timings(tmp_path, monkeypatch):
+    """Test each epoch writes a data/forward/backward/step breakdown"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('models')
+    dataset = torch.utils.data.TensorDataset(torch.randn(4, 3, 64, 64), torch.tensor([0, 1, 2, 0]))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2)
+    
+    trainer = ModelTrainer(use_pretrained=False)
+    trainer.train(loader, loader, epochs=2)
+    
+    with open('models/training_metrics.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    assert [record['epoch'] for record in records] == [1, 2]
+    
+    # A fresh run appends under its own run id
+    ModelTrainer(use_pretrained=False).train(loader, loader, epochs=1)
+    with open('models/training_metrics.jsonl') as f:
+        run_ids = [json.loads(line)['run_id'] for line in f]
+    assert run_ids[:2] == [trainer.run_id] * 2 and run_ids[2] != trainer.run_id
+    
+    # Persistent workers are still running at the end of an epoch and are sampled from /proc
+    worker_loader = torch.utils.data.DataLoader(dataset, batch_size=2, num_workers=1, persistent_workers=True)
+    next(iter(worker_loader))
+    if os.path.isdir('/proc'):
+        assert live_children_peak_rss_mb() > 0
+    
+    for record in records:
+        assert record['images'] == 4 and record['images_per_sec'] > 0
+        phases = sum(record[f'{phase}_seconds'] for phase in ['data', 'forward', 'backward', 'step', 'other'])
+        assert abs(phases - record['seconds']) < 1e-3
+        assert record['forward_seconds'] > 0 and record['backward_seconds'] > 0
+        assert record['peak_rss_mb'] > 0 and record['worker_peak_rss_mb'] >= 0
+
+def test_manifest_labels_and_incremental_refresh(tmp_path, monkeypatch):
+    """Test the manifest reads ODIR labels, skips unchanged trees and hashes only new files"""
+    import cv2
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data/odir/images')
+    for name in ['0_left.jpg', '0_right.jpg', '1_left.jpg']:
+        cv2.imwrite(f'data/odir/images/{name}', np.random.randint(0, 255, (32, 32, 3), dtype=np.uint8))
+    with open('data/odir/full_df.csv', 'w') as f:
+        f.write("ID,filename,labels\n0,0_left.jpg,['N']\n0,0_right.jpg,['G']\n1,1_left.jpg,['D']\n"
+                "2,2_left.jpg,['N']\n")
+    # A second copy of an image, a byte-identical image and an unannotated test image
+    os.makedirs('data/odir/preprocessed')
+    shutil.copyfile('data/odir/images/0_left.jpg', 'data/odir/preprocessed/0_left.jpg')
+    shutil.copyfile('data/odir/images/0_left.jpg', 'data/odir/images/2_left.jpg')
+    cv2.imwrite('data/odir/images/test_9.jpg', np.zeros((32, 32, 3), dtype=np.uint8))
+    
+    manifest = dataset_manifest.build_manifest('data/odir')
+    assert [os.path.basename(p) for p in manifest['paths']] == ['0_left.jpg', '0_right.jpg', '1_left.jpg']
+    assert manifest['labels'].tolist() == [0, 1, 2]
+    assert len(set(manifest['hashes'])) == 3
+    
+    # Unchanged tree: loaded without walking it
+    def fail_scan(data_path):
+        raise AssertionError("tree was rescanned")
+    with monkeypatch.context() as patch:
+        patch.setattr(dataset_manifest, '_scan', fail_scan)
+        assert dataset_manifest.build_manifest('data/odir')['labels'].tolist() == [0, 1, 2]
+    
+    # A new file triggers a refresh that hashes only that file
+    hashed = []
+    original_hash = dataset_manifest._file_hash
+    monkeypatch.setattr(dataset_manifest, '_file_hash', lambda path: hashed.append(path) or original_hash(path))
+    cv2.imwrite('data/odir/images/3_left.jpg', np.full((32, 32, 3), 7, dtype=np.uint8))
+    with open('data/odir/full_df.csv', 'a') as f:
+        f.write("3,3_left.jpg,['G']\n")
+    manifest = dataset_manifest.build_manifest('data/odir')
+    assert len(manifest['paths']) == 4
+    assert [os.path.basename(p) for p in hashed] == ['3_left.jpg']
+    assert manifest['labels'].tolist()[-1] == 1
+    
+    # A file rewritten in place leaves its directory's mtime alone but is still rehashed
+    hashed.clear()
+    directory_stat = os.stat('data/odir/images')
+    old_hash = manifest['hashes'][2]
+    cv2.imwrite('data/odir/images/1_left.jpg', np.full((40, 40, 3), 99, dtype=np.uint8))
+    os.utime('data/odir/images', ns=(directory_stat.st_atime_ns, directory_stat.st_mtime_ns))
+    manifest = dataset_manifest.build_manifest('data/odir')
+    assert [os.path.basename(p) for p in hashed] == ['1_left.jpg']
+    assert manifest['hashes'][2] != old_hash
+
+def test_loaders_stream_from_zip_archive(tmp_path):
+    """Test training images are decoded straight from a zip with labels from its sheet"""
+    import cv2
+    import zipfile
+    zip_path = str(tmp_path / 'odir.zip')
+    rows = []
+    with zipfile.ZipFile(zip_path, 'w') as archive:
+        for i in range(15):
+            name = f'{i}_left.jpg'
+            ok, encoded = cv2.imencode('.jpg', np.full((48, 48, 3), i * 15, dtype=np.uint8))
+            archive.writestr(f'ODIR-5K/Training Images/{name}', encoded.tobytes())
+            archive.writestr(f'preprocessed_images/{name}', encoded.tobytes())
+            rows.append(f"{i},{name},['{'NGD'[i % 3]}']")
+        archive.writestr('ODIR-5K/Testing Images/99_left.jpg', encoded.tobytes())
+        archive.writestr('full_df.csv', "ID,filename,labels\n" + "\n".join(rows) + "\n")
+    
+    # Copies and unannotated images are left out
+    members, labels, _ = index_zip_dataset(zip_path)
+    assert len(members) == 15 and labels.count(2) == 5
+    
+    # One worker process exercises the per-worker archive handle
+    train_loader, val_loader, _ = create_data_loaders(batch_size=4, data_path=zip_path,
+                                                      profile={'num_workers': 1})
+    
+    assert train_loader.dataset.labels.count(2) + val_loader.dataset.labels.count(2) == 5
+    images, labels = next(iter(train_loader))
+    assert images.shape == (4, 3, 224, 224)
+    assert not os.path.exists(tmp_path / 'ODIR-5K')
+
+def test_synthetic_fundus_generator_is_reproducible(tmp_path):
+    """Test generated fundus images repeat per seed on disk and in memory"""
+    import cv2
+    assert sample_sizes(20, 'camera', seed=3) == sample_sizes(20, 'camera', seed=3)
+    
+    sizes = [(96, 128), (64, 64), (80, 80)]
+    in_memory = list(generate_fundus_images(3, seed=5, sizes=sizes))
+    assert [image.shape for image, _ in in_memory] == [(96, 128, 3), (64, 64, 3), (80, 80, 3)]
+    assert [label for _, label in in_memory] == [0, 1, 2]
+    assert np.array_equal(in_memory[0][0], next(generate_fundus_images(1, seed=5, sizes=sizes))[0])
+    assert not np.array_equal(in_memory[1][0], next(generate_fundus_images(2, seed=6, sizes=sizes))[0])
+    
+    # The corners are outside the circular field of view
+    assert in_memory[0][0][0, 0].max() == 0 and in_memory[0][0][48, 64].max() > 0
+    
+    paths, labels = write_synthetic_dataset(str(tmp_path), 6, seed=5, sizes=sizes * 2, workers=2)
+    assert [os.path.basename(path) for path in paths[:3]] == ['normal_0.jpg', 'glaucoma_0.jpg', 'other_0.jpg']
+    assert cv2.imread(paths[4]).shape == (64, 64, 3)
+
+def test_evaluation_metrics_match_sklearn(tmp_path):
+    """Test the vectorized evaluation metrics agree with sklearn"""
+    from sklearn.metrics import confusion_matrix, precision_score, recall_score, roc_auc_score
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(3 * 8 * 8, 3))
+    labels = torch.arange(30) % 3
+    images = torch.randn(30, 3, 8, 8) + labels.view(-1, 1, 1, 1) * 0.3
+    loader = torch.utils.data.DataLoader(torch.utils.data.TensorDataset(images, labels), batch_size=7)
+    
+    report_path = str(tmp_path / 'report.json')
+    report = evaluate_model(model, loader, ['Normal', 'Glaucoma', 'Other'], report_path=report_path)
+    
+    with torch.no_grad():
+        probabilities = torch.softmax(model(images), 1).numpy()
+    predictions = probabilities.argmax(1)
+    assert report['confusion_matrix'] == confusion_matrix(labels, predictions).tolist()
+    assert np.allclose(report['precision'], precision_score(labels, predictions, average=None, zero_division=0))
+    assert np.allclose(report['recall'], recall_score(labels, predictions, average=None))
+    assert np.isclose(report['macro_roc_auc'], roc_auc_score(labels, probabilities, multi_class='ovr'), atol=1e-6)
+    assert 0 <= report['expected_calibration_error'] <= 1
+    with open(report_path) as f:
+        assert json.load(f)['samples'] == 30
+
+def test_lightweight_backbones():
+    """Test every selectable backbone feeds the classifier its pooled features"""
+    images = torch.randn(2, 3, 64, 64)
+    for backbone in BACKBONES:
+        model = ImprovedEyeSenseModel(use_pretrained=False, backbone=backbone).eval()
+        with torch.no_grad():
+            assert model.backbone(images).shape == (2, model.feature_dim)
+            assert model(images).shape == (2, 3)
+
+def test_distillation_from_teacher(tmp_path, monkeypatch):
+    """Test a small student trains against a frozen teacher and is compared to it"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('models')
+    dataset = torch.utils.data.TensorDataset(torch.randn(4, 3, 64, 64), torch.tensor([0, 1, 2, 0]))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2)
+    
+    teacher = ImprovedEyeSenseModel(use_pretrained=False, backbone='resnet18')
+    teacher_before = {k: v.clone() for k, v in teacher.state_dict().items()}
+    trainer = ModelTrainer(use_pretrained=False, backbone='mobilenet_v3_small', teacher=teacher)
+    trainer.train(loader, loader, epochs=1)
+    
+    assert np.isfinite(trainer.train_losses[0])
+    for name, tensor in teacher.state_dict().items():
+        assert torch.equal(tensor, teacher_before[name])
+    
+    rows = compare_models({'teacher': teacher, 'student': trainer.model}, loader,
+                          ['Normal', 'Glaucoma', 'Other'], image_size=64, runs=2)
+    assert [row['model'] for row in rows] == ['teacher', 'student']
+    assert rows[1]['parameters'] < rows[0]['parameters']
+    assert all(row['latency_ms'] > 0 for row in rows)
+
+def test_cascade_escalates_uncertain_images():
+    """Test the cascade answers confident images with the screener and escalates the rest"""
+    class FixedPredictor:
+        classes = ['Normal', 'Slightly High', 'High']
+        
+        def __init__(self, confidences, delay=0.0):
+            self.confidences = iter(confidences)
+            self.delay = delay
+        
+        def predict(self, image, tta=None):
+            time.sleep(self.delay)
+            confidence = next(self.confidences)
+            return {'risk_level': 'Normal', 'confidence': confidence,
+                    'probabilities': [confidence, 1 - confidence, 0.0]}
+    
+    screener = FixedPredictor([0.95, 0.6, 0.99, 0.5])
+    full_model = FixedPredictor([0.8, 0.7], delay=0.02)
+    cascade = CascadePredictor(screener, full_model, threshold=0.9)
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    
+    stages = [cascade.predict(image)['stage'] for _ in range(4)]
+    
+    assert stages == ['screener', 'full', 'screener', 'full']
+    metrics = cascade.metrics()
+    assert metrics['requests'] == 4 and metrics['escalations'] == 2
+    assert metrics['escalation_rate'] == 0.5
+    assert metrics['latency_saved_ms'] > 0
+
+def test_optic_disc_crop_finds_bright_disc(monkeypatch):
+    """Test the ROI stage trims the border, crops around the disc and caches the box"""
+    import cv2
+    import albumentations as A
+    image = np.zeros((1200, 1600, 3), dtype=np.uint8)
+    cv2.circle(image, (800, 600), 560, (170, 70, 30), -1)
+    cv2.circle(image, (1050, 520), 60, (255, 230, 170), -1)
+    
+    cropper = roi.OpticDiscCropper()
+    crop, (x0, y0, x1, y1) = cropper.crop(image)
+    
+    assert x0 < 1050 < x1 and y0 < 520 < y1
+    assert crop.shape[0] * crop.shape[1] < 0.25 * 1200 * 1600
+    assert x0 >= 240 and x1 <= 1360
+    
+    # Same image again: served from the cache without re-detection
+    monkeypatch.setattr(roi, 'locate_optic_disc', lambda proxy: pytest.fail("box not cached"))
+    assert cropper.find_box(image) == (x0, y0, x1, y1)
+    
+    # The training pipeline applies the same crop before resizing
+    monkeypatch.undo()
+    transform = A.Compose([A.Lambda(image=roi.crop_optic_disc), A.Resize(224, 224)])
+    assert transform(image=image)['image'].shape == (224, 224, 3)
+
+def test_roi_crop_uses_full_resolution_images(tmp_path, monkeypatch):
+    """Test ROI crops are taken from source images, so cached (downsampled) ones are refused"""
+    monkeypatch.chdir(tmp_path)
+    write_synthetic_dataset('data/fundus', 20, seed=0, sizes='model')
+    
+    train_loader, _, _ = create_data_loaders(batch_size=4, data_path='data/fundus', roi_crop=True)
+    assert next(iter(train_loader))[0].shape == (4, 3, 224, 224)
+    
+    with pytest.raises(ValueError):
+        create_data_loaders(batch_size=4, data_path='data/fundus', cache_dir='data/cache', roi_crop=True)
+
+def test_structured_pruning_shrinks_backbone(tmp_path):
+    """Test pruned models are physically smaller, still run, fine-tune and reload"""
+    dataset = torch.utils.data.TensorDataset(torch.randn(4, 3, 64, 64), torch.tensor([0, 1, 2, 0]))
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2)
+    model = ImprovedEyeSenseModel(use_pretrained=False)
+    
+    pruned = prune_model(model, 0.5, method='taylor', loader=loader, batches=1)
+    assert pruned.backbone.layer1[0].conv1.out_channels == 32
+    assert pruned.backbone.layer1[0].conv3.in_channels == 32
+    assert count_flops(pruned, 64) < count_flops(model, 64)
+    with torch.no_grad():
+        assert pruned.eval()(torch.randn(1, 3, 64, 64)).shape == (1, 3)
+    
+    path = str(tmp_path / 'pruned.pth')
+    save_pruned_model(pruned, path)
+    reloaded = load_pruned_model(path).eval()
+    images = torch.randn(2, 3, 64, 64)
+    with torch.no_grad():
+        assert torch.allclose(reloaded(images), pruned(images), atol=1e-5)
+    
+    rows = pruning_report(model, loader, loader, ['Normal', 'Glaucoma', 'Other'], sparsities=[0.5],
+                          image_size=64, latency_runs=2)
+    assert [row['sparsity'] for row in rows] == [0.0, 0.5]
+    assert rows[1]['parameters'] < rows[0]['parameters'] and rows[1]['flops'] < rows[0]['flops']
+
+def test_test_time_augmentation_single_forward_pass(tmp_path):
+    """Test TTA views are batched into one forward pass and gated by the confidence threshold"""
+    mean = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+    std = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+    image = (torch.rand(1, 3, 32, 32) - mean) / std
+    views = tta_batch(image)
+    assert views.shape == (len(TTA_VIEWS), 3, 32, 32)
+    assert torch.allclose(views[0], image[0], atol=1e-5)
+    assert torch.allclose(views[1], image[0].flip(-1), atol=1e-5)
+    
+    path = str(tmp_path / 'model.pth')
+    torch.save(ImprovedEyeSenseModel(use_pretrained=False, backbone='resnet18').state_dict(), path)
+    predictor = GlaucomaRiskPredictor(model_path=path, backbone='resnet18', image_size=64)
+    batch_sizes = []
+    predictor.model.register_forward_hook(lambda module, inputs, output: batch_sizes.append(len(inputs[0])))
+    fundus = np.random.default_rng(0).integers(0, 255, (80, 80, 3), dtype=np.uint8)
+    
+    assert predictor.predict(fundus)['tta_views'] == 1
+    batch_sizes.clear()
+    forced = predictor.predict(fundus, tta=True)
+    assert forced['tta_views'] == len(TTA_VIEWS) and batch_sizes == [len(TTA_VIEWS)]
+    assert forced['embedding'].shape == (predictor.model.feature_dim,)
+    
+    # Every prediction is below a threshold above 1, so TTA always kicks in
+    predictor.tta_threshold = 1.01
+    batch_sizes.clear()
+    automatic = predictor.predict(fundus)
+    assert batch_sizes == [1, len(TTA_VIEWS) - 1]
+    assert np.allclose(automatic['probabilities'], forced['probabilities'], atol=1e-5)
+    assert predictor.predict(fundus, tta=False)['tta_views'] == 1
+
+def test_ensemble_runs_backbone_once(tmp_path):
+    """Test stacked heads match the individual models and report their disagreement"""
+    torch.manual_seed(0)
+    members = [ImprovedEyeSenseModel(use_pretrained=False, backbone='resnet18').eval() for _ in range(3)]
+    paths = []
+    for i, member in enumerate(members):
+        # Heads trained on a shared backbone
+        member.backbone.load_state_dict(members[0].backbone.state_dict())
+        paths.append(str(tmp_path / f'head_{i}.pth'))
+        torch.save(member.state_dict(), paths[-1])
+    
+    ensemble = load_ensemble(paths, backbone='resnet18')
+    backbone_calls = []
+    ensemble.backbone.register_forward_hook(lambda module, inputs, output: backbone_calls.append(1))
+    images = torch.randn(2, 3, 64, 64)
+    with torch.no_grad():
+        outputs = ensemble(images)
+        expected = torch.stack([member(images) for member in members])
+    assert outputs.shape == (3, 2, 3) and len(backbone_calls) == 1
+    assert torch.allclose(outputs, expected, atol=1e-4)
+    
+    predictor = GlaucomaRiskPredictor(model=ensemble, image_size=64)
+    result = predictor.predict(np.random.default_rng(0).integers(0, 255, (80, 80, 3), dtype=np.uint8))
+    assert result['ensemble_size'] == 3 and len(result['probability_variance']) == 3
+    assert abs(sum(result['probabilities']) - 1.0) < 1e-5
+    
+    # A head from a different backbone is refused unless explicitly allowed
+    other = ImprovedEyeSenseModel(use_pretrained=False, backbone='resnet18')
+    torch.save(other.state_dict(), str(tmp_path / 'other.pth'))
+    with pytest.raises(ValueError):
+        load_ensemble(paths + [str(tmp_path / 'other.pth')], backbone='resnet18')
+    assert load_ensemble(paths + [str(tmp_path / 'other.pth')], backbone='resnet18',
+                         allow_backbone_mismatch=True).heads.num_heads == 4
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file